@@ -1,6 +1,5 @@
 """Analysis commands."""
 
-import csv
 from io import TextIOWrapper
 from pathlib import Path
 
@@ -170,42 +169,28 @@ from starrynight.modules.sbs_preprocess.constants import (
 from starrynight.templates import get_templates_path
 from starrynight.utils.cellprofiler import CellProfilerContext
 from starrynight.utils.dfutils import (
-    filter_df_by_hierarchy,
-    filter_images,
-    gen_image_hierarchy,
     gen_legacy_channel_map,
     get_channels_by_batch_plate,
     get_channels_from_df,
     get_cycles_by_batch_plate,
     get_cycles_from_df,
     get_default_path_prefix,
-    get_filenames_by_channel_id,
-    get_filenames_by_channel_id_cycle_id,
+    load_images,
 )
-from starrynight.utils.globbing import flatten_all, flatten_dict, get_files_by
-from starrynight.utils.misc import resolve_path_loaddata
+from starrynight.utils.globbing import flatten_dict, get_files_by
+from starrynight.utils.loaddata import (
+    lookup_index_files,
+    well_value_expr,
+    write_loaddata_csv,
+    write_loaddata_levels,
+)
+from starrynight.utils.misc import resolve_path_loaddata, staged_directory
 
 ###############################
 ## Load data generation
 ###############################
 
 
-def handle_sbs_index_query(
-    sbs_comp_index_df: pl.LazyFrame,
-    legacy_channel_map: dict,
-    cycle: str,
-    ch: str,
-):
-    out = get_filenames_by_channel_id_cycle_id(
-        sbs_comp_index_df, legacy_channel_map[ch], cycle
-    )
-    if len(out) == 0:
-        out = get_filenames_by_channel_id_cycle_id(
-            sbs_comp_index_df, legacy_channel_map[ch], "1"
-        )
-    return out
-
-
 def get_header(
     header: str,
     cycle: int | None,
@@ -228,32 +213,72 @@ def get_header(
 
 
 def get_cp_filename_value(
-    index: PCPIndex,
     ch: str,
     use_legacy: bool = False,
     legacy_channel_map: dict = {},
-) -> str:
+) -> pl.Expr:
     if not use_legacy:
-        return f"{index.batch_id}_{index.plate_id}_Well_{index.well_id}_Site_{int(index.site_id)}_Corr{ch}.tiff"
+        return pl.concat_str(
+            [
+                pl.col("batch_id"),
+                pl.lit("_"),
+                pl.col("plate_id"),
+                pl.lit("_Well_"),
+                pl.col("well_id"),
+                pl.lit("_Site_"),
+                pl.col("site_num"),
+                pl.lit(f"_Corr{ch}.tiff"),
+            ]
+        )
     else:
-        return f"Plate_{index.plate_id}_Well_{index.well_id}_Site_{int(index.site_id)}_Corr{legacy_channel_map[ch]}.tiff"
+        return pl.concat_str(
+            [
+                pl.lit("Plate_"),
+                pl.col("plate_id"),
+                pl.lit("_Well_"),
+                pl.col("well_id"),
+                pl.lit("_Site_"),
+                pl.col("site_num"),
+                pl.lit(f"_Corr{legacy_channel_map[ch]}.tiff"),
+            ]
+        )
 
 
 def get_sbs_filename_value(
-    index: PCPIndex,
     cycle: int,
     ch: str,
     use_legacy: bool = False,
     legacy_channel_map: dict = {},
-) -> str:
+) -> pl.Expr:
     if not use_legacy:
-        return f"{index.batch_id}_{index.plate_id}_{int(cycle)}_Well_{index.well_id}_Site_{int(index.site_id)}_Compensated{ch}.tiff"
+        return pl.concat_str(
+            [
+                pl.col("batch_id"),
+                pl.lit("_"),
+                pl.col("plate_id"),
+                pl.lit(f"_{int(cycle)}_Well_"),
+                pl.col("well_id"),
+                pl.lit("_Site_"),
+                pl.col("site_num"),
+                pl.lit(f"_Compensated{ch}.tiff"),
+            ]
+        )
     else:
         if legacy_channel_map[ch] == "DNA":
-            return f"Plate_{index.plate_id}_Well_{index.well_id}_Site_{int(index.site_id)}_Cycle{1:02d}_{legacy_channel_map[ch]}.tiff"
-
+            suffix = f"_Cycle{1:02d}_{legacy_channel_map[ch]}.tiff"
         else:
-            return f"Plate_{index.plate_id}_Well_{index.well_id}_Site_{int(index.site_id)}_Cycle{int(cycle):02d}_{legacy_channel_map[ch]}.tiff"
+            suffix = f"_Cycle{int(cycle):02d}_{legacy_channel_map[ch]}.tiff"
+        return pl.concat_str(
+            [
+                pl.lit("Plate_"),
+                pl.col("plate_id"),
+                pl.lit("_Well_"),
+                pl.col("well_id"),
+                pl.lit("_Site_"),
+                pl.col("site_num"),
+                pl.lit(suffix),
+            ]
+        )
 
 
 def write_loaddata(
@@ -270,8 +295,6 @@ def write_loaddata(
     cp_corr_index_path: Path | CloudPath | None = None,
     sbs_comp_index_path: Path | CloudPath | None = None,
 ) -> None:
-    # setup csv headers and write the header first
-    loaddata_writer = csv.writer(f, delimiter=",", quoting=csv.QUOTE_MINIMAL)
     legacy_channel_map = {}
 
     # setup index dfs if avalilale
@@ -315,104 +338,215 @@ def write_loaddata(
         for cycle in plate_cycles_list
         for ch in sbs_plate_channel_list
     ]
-    loaddata_writer.writerow(
-        [
-            *metadata_heads,
-            *cp_filename_heads,
-            *cp_pathname_heads,
-            *sbs_filename_heads,
-            *sbs_pathname_heads,
-        ]
-    )
-
     if cp_corr_index_path is not None:
         index = cp_corr_index_df.first().collect().to_dicts()[0]
     else:
         index = cp_images_df.first().collect().to_dicts()[0]
 
     index = PCPIndex(**index)
+    assert index.key is not None
+
+    # One row per well and site, batch and plate are taken from the first image
     wells_sites = (
-        cp_images_df.collect()
-        .group_by("well_id")
-        .agg(pl.col("site_id").unique())
-        .to_dicts()
+        cp_images_df.select("well_id", "site_id", "site_num")
+        .unique(maintain_order=True)
+        .collect()
     )
-    for well_sites in wells_sites:
-        index.well_id = well_sites["well_id"]
-        for site_id in well_sites["site_id"]:
-            index.site_id = site_id
-            if cp_corr_index_path is None:
-                cp_filenames = [
-                    get_cp_filename_value(
-                        index, ch, use_legacy, legacy_channel_map
-                    )
-                    for ch in cp_plate_channel_list
-                ]
-                cp_pathnames = [
+
+    if cp_corr_index_path is None:
+        cp_filenames = [
+            get_cp_filename_value(ch, use_legacy, legacy_channel_map)
+            for ch in cp_plate_channel_list
+        ]
+        cp_pathnames = [
+            pl.lit(
+                str(
                     resolve_path_loaddata(
                         AnyPath(path_mask), cp_corr_images_path
                     )
-                    for _ in range(len(cp_pathname_heads))
-                ]
-            else:
-                cp_ch = [
-                    get_filenames_by_channel_id(
-                        cp_corr_index_df, legacy_channel_map[ch]
-                    )[0]
-                    for ch in cp_plate_channel_list
-                ]
-                cp_filenames = [elem["filename"] for elem in cp_ch]
-                cp_pathnames = [str(elem["pathname"]) for elem in cp_ch]
-            # Match the order of iteration in sbs_filename_heads to ensure correct alignment
-            if sbs_comp_index_path is None:
-                sbs_filenames = [
-                    get_sbs_filename_value(
-                        index, cycle, ch, use_legacy, legacy_channel_map
-                    )
-                    for cycle in plate_cycles_list
-                    for ch in sbs_plate_channel_list
-                ]
-                sbs_pathnames = [
+                )
+            )
+            for _ in range(len(cp_pathname_heads))
+        ]
+    else:
+        cp_files = lookup_index_files(
+            wells_sites,
+            cp_corr_index_df,
+            [legacy_channel_map[ch] for ch in cp_plate_channel_list],
+        )
+        wells_sites = wells_sites.with_columns(
+            cp_filename=cp_files["filename"], cp_pathname=cp_files["pathname"]
+        )
+        cp_filenames = [
+            pl.col("cp_filename").list.get(i)
+            for i in range(len(cp_plate_channel_list))
+        ]
+        cp_pathnames = [
+            pl.col("cp_pathname").list.get(i)
+            for i in range(len(cp_plate_channel_list))
+        ]
+    # Match the order of iteration in sbs_filename_heads to ensure correct alignment
+    if sbs_comp_index_path is None:
+        sbs_filenames = [
+            get_sbs_filename_value(cycle, ch, use_legacy, legacy_channel_map)
+            for cycle in plate_cycles_list
+            for ch in sbs_plate_channel_list
+        ]
+        sbs_pathnames = [
+            pl.lit(
+                str(
                     resolve_path_loaddata(
                         AnyPath(path_mask), sbs_comp_images_path
                     )
-                    for _ in range(len(sbs_pathname_heads))
-                ]
-            else:
-                sbs_ch_cycle = [
-                    handle_sbs_index_query(
-                        sbs_comp_index_df, legacy_channel_map, cycle, ch
-                    )[0]
-                    for cycle in plate_cycles_list
-                    for ch in sbs_plate_channel_list
-                ]
-                sbs_filenames = [elem["filename"] for elem in sbs_ch_cycle]
-                sbs_pathnames = [str(elem["pathname"]) for elem in sbs_ch_cycle]
-
-            well_value = (
-                index.well_id[4:]
-                if index.well_id.startswith("Well")
-                else index.well_id
+                )
             )
+            for _ in range(len(sbs_pathname_heads))
+        ]
+    else:
+        # Channels missing from a cycle fall back to cycle 1
+        sbs_files = lookup_index_files(
+            wells_sites,
+            sbs_comp_index_df,
+            [
+                legacy_channel_map[ch]
+                for _ in plate_cycles_list
+                for ch in sbs_plate_channel_list
+            ],
+            [
+                cycle
+                for cycle in plate_cycles_list
+                for _ in sbs_plate_channel_list
+            ],
+            fallback_cycle="1",
+        )
+        wells_sites = wells_sites.with_columns(
+            sbs_filename=sbs_files["filename"],
+            sbs_pathname=sbs_files["pathname"],
+        )
+        sbs_filenames = [
+            pl.col("sbs_filename").list.get(i)
+            for i in range(len(sbs_filename_heads))
+        ]
+        sbs_pathnames = [
+            pl.col("sbs_pathname").list.get(i)
+            for i in range(len(sbs_pathname_heads))
+        ]
 
-            # make sure frame heads are matched with their order in the filenames
-            assert index.key is not None
-            loaddata_writer.writerow(
-                [
-                    # Metadata heads
-                    index.batch_id,
-                    index.plate_id,
-                    index.site_id,
-                    index.well_id,
-                    well_value,
-                    # CP Filename and Pathname heads
-                    *cp_filenames,
-                    *cp_pathnames,
-                    # SBS Filename and Pathname heads
-                    *sbs_filenames,
-                    *sbs_pathnames,
-                ]
-            )
+    write_loaddata_csv(
+        wells_sites.with_columns(
+            batch_id=pl.lit(index.batch_id, pl.String),
+            plate_id=pl.lit(index.plate_id, pl.String),
+        ),
+        [
+            *metadata_heads,
+            *cp_filename_heads,
+            *cp_pathname_heads,
+            *sbs_filename_heads,
+            *sbs_pathname_heads,
+        ],
+        [
+            # Metadata heads
+            pl.col("batch_id"),
+            pl.col("plate_id"),
+            pl.col("site_id"),
+            pl.col("well_id"),
+            well_value_expr(),
+            # CP Filename and Pathname heads
+            *cp_filenames,
+            *cp_pathnames,
+            # SBS Filename and Pathname heads
+            *sbs_filenames,
+            *sbs_pathnames,
+        ],
+        f,
+    )
+
+
+def write_level_loaddata(
+    level: list[str],
+    cp_level_df: pl.LazyFrame,
+    out_path: Path | CloudPath,
+    path_mask: str,
+    sbs_plate_channel_list: list[str],
+    plate_cycles_list: list[str],
+    cp_corr_images_path: Path | CloudPath,
+    sbs_comp_images_path: Path | CloudPath,
+    cp_corr_index_dir: Path | CloudPath | None = None,
+    sbs_comp_index_dir: Path | CloudPath | None = None,
+    use_legacy: bool = False,
+    exp_config_path: Path | CloudPath | None = None,
+) -> None:
+    """Write the analysis LoadData of a unit of work.
+
+    Parameters
+    ----------
+    level : list[str]
+        Level values of the unit of work.
+    cp_level_df : pl.LazyFrame
+        CP images of the unit of work.
+    out_path : Path | CloudPath
+        Path to the LoadData directory.
+    path_mask : str
+        Path prefix mask to use.
+    sbs_plate_channel_list : list[str]
+        SBS channels.
+    plate_cycles_list : list[str]
+        SBS cycles.
+    cp_corr_images_path : Path | CloudPath
+        Path | CloudPath to cp corr images directory.
+    sbs_comp_images_path : Path | CloudPath
+        Path | CloudPath to sbs compensated images directory.
+    cp_corr_index_dir : Path | CloudPath
+        Path | CloudPath to cp corr index directory.
+    sbs_comp_index_dir : Path | CloudPath
+        Path | CloudPath to sbs compensated index directory.
+    use_legacy : bool
+        Use legacy cppipe and loaddata.
+    exp_config_path : Path | CloudPath
+        Path to experiment config json path.
+
+    """
+    # Setup channel list for this level
+    cp_plate_channel_list = get_channels_from_df(cp_level_df)
+
+    # Construct corr images path for this level
+    cp_corr_images_path_level = cp_corr_images_path.joinpath("-".join(level))
+
+    # Construct align images path for this level
+    sbs_comp_images_path_level = sbs_comp_images_path.joinpath("-".join(level))
+
+    # Construct filename for the loaddata csv
+    level_out_path = out_path.joinpath(f"{'^'.join(level)}#analysis.csv")
+
+    # Construct index paths
+    if cp_corr_index_dir is not None:
+        cp_corr_index_path = next(
+            cp_corr_index_dir.glob(f"{'^'.join(level)}#*.parquet")
+        )
+    else:
+        cp_corr_index_path = None
+
+    if sbs_comp_index_dir is not None:
+        sbs_comp_index_path = next(
+            sbs_comp_index_dir.glob(f"{'^'.join(level)}#*.parquet")
+        )
+    else:
+        sbs_comp_index_path = None
+    with level_out_path.open("w") as f:
+        write_loaddata(
+            cp_level_df,
+            cp_plate_channel_list,
+            sbs_plate_channel_list,
+            plate_cycles_list,
+            cp_corr_images_path_level,
+            sbs_comp_images_path_level,
+            path_mask,
+            f,
+            use_legacy,
+            exp_config_path,
+            cp_corr_index_path,
+            sbs_comp_index_path,
+        )
 
 
 def gen_analysis_load_data(
@@ -426,6 +560,7 @@ def gen_analysis_load_data(
     use_legacy: bool = False,
     exp_config_path: Path | CloudPath | None = None,
     uow_hierarchy: list[str] = None,
+    jobs: int = 1,
 ) -> None:
     """Generate load data for analysis pipeline.
 
@@ -451,6 +586,8 @@ def gen_analysis_load_data(
         Path to experiment config json path.
     uow_hierarchy : list[str] | None
         Unit of work list
+    jobs : int
+        Number of parallel jobs to use.
 
     """
     # Construct illum path if not given
@@ -463,15 +600,14 @@ def gen_analysis_load_data(
             SBS_PREPROCESS_OUT_PATH_SUFFIX
         )
 
-    # Load index
-    df = pl.scan_parquet(index_path.resolve().__str__())
-
-    # Filter for relevant images
-    cp_images_df = filter_images(df, False)
-    sbs_images_df = filter_images(df, True)
+    # Load relevant images, shared by the stages run in this process
+    cp_images_df = load_images(index_path, False)
+    sbs_images_df = load_images(index_path, True).lazy()
 
     # Query default path prefix
-    default_path_prefix: str = get_default_path_prefix(cp_images_df)
+    default_path_prefix: str = get_default_path_prefix(
+        cp_images_df.lazy(), index_path
+    )
 
     # Setup path mask (required for resolving pathnames during the execution)
     if path_mask is None:
@@ -484,64 +620,29 @@ def gen_analysis_load_data(
         "well_id",
         "site_id",
     ]
-    images_hierarchy_dict = gen_image_hierarchy(cp_images_df, uow_hierarchy)
-    levels = flatten_all(images_hierarchy_dict)
-    # Setup chunking and write loaddata for each batch/plate
-    for level in levels:
-        # setup filtered df for chunked levels
-        cp_level_df = filter_df_by_hierarchy(cp_images_df, level, False)
-
-        # Setup channel list for this level
-        cp_plate_channel_list = get_channels_from_df(cp_level_df)
-        # TODO: This is a hack for now, need to fix this later
-        # TODO: Find a way to filter sbs dataframe as well
-        sbs_plate_channel_list = get_channels_from_df(sbs_images_df)
-
-        # Setup cycles list
-        plate_cycles_list = get_cycles_from_df(sbs_images_df)
-
-        # Construct corr images path for this level
-        cp_corr_images_path_level = cp_corr_images_path.joinpath(
-            "-".join(level)
-        )
-
-        # Construct align images path for this level
-        sbs_comp_images_path_level = sbs_comp_images_path.joinpath(
-            "-".join(level)
-        )
-
-        # Construct filename for the loaddata csv
-        level_out_path = out_path.joinpath(f"{'^'.join(level)}#analysis.csv")
-
-        # Construct index paths
-        if cp_corr_index_dir is not None:
-            cp_corr_index_path = next(
-                cp_corr_index_dir.glob(f"{'^'.join(level)}#*.parquet")
-            )
-        else:
-            cp_corr_index_path = None
-
-        if sbs_comp_index_dir is not None:
-            sbs_comp_index_path = next(
-                sbs_comp_index_dir.glob(f"{'^'.join(level)}#*.parquet")
-            )
-        else:
-            sbs_comp_index_path = None
-        with level_out_path.open("w") as f:
-            write_loaddata(
-                cp_level_df,
-                cp_plate_channel_list,
-                sbs_plate_channel_list,
-                plate_cycles_list,
-                cp_corr_images_path_level,
-                sbs_comp_images_path_level,
-                path_mask,
-                f,
-                use_legacy,
-                exp_config_path,
-                cp_corr_index_path,
-                sbs_comp_index_path,
-            )
+    # TODO: This is a hack for now, need to fix this later
+    # TODO: Find a way to filter sbs dataframe as well
+    sbs_plate_channel_list = get_channels_from_df(sbs_images_df)
+
+    # Setup cycles list
+    plate_cycles_list = get_cycles_from_df(sbs_images_df)
+
+    write_loaddata_levels(
+        cp_images_df,
+        uow_hierarchy,
+        write_level_loaddata,
+        jobs=jobs,
+        out_path=out_path,
+        path_mask=path_mask,
+        sbs_plate_channel_list=sbs_plate_channel_list,
+        plate_cycles_list=plate_cycles_list,
+        cp_corr_images_path=cp_corr_images_path,
+        sbs_comp_images_path=sbs_comp_images_path,
+        cp_corr_index_dir=cp_corr_index_dir,
+        sbs_comp_index_dir=sbs_comp_index_dir,
+        use_legacy=use_legacy,
+        exp_config_path=exp_config_path,
+    )
 
 
 ###################################
@@ -2054,33 +2155,34 @@ def gen_analysis_cppipe(
     # Default run dir should already be present, otherwise CP raises an error
     out_dir.mkdir(exist_ok=True, parents=True)
 
-    filename = "analysis.cppipe"
-
-    # Write old cppipe and return early if use_old is true
-    if use_legacy:
-        ref_cppipe = Template(
-            text=get_templates_path()
-            .joinpath("cppipe/ref_9_Analysis.cppipe.mako")
-            .read_text(),
-            output_encoding="utf-8",
-        ).render(barcode_csv_path=barcode_csv_path)
-        ref_cppipe = ref_cppipe.decode("utf-8")
-        out_dir.joinpath(filename).write_text(ref_cppipe)
-        return
-
-    # get one of the load data file for generating cppipe
-    sample_loaddata_file = next(load_data_path.rglob("*.csv"))
-    with CellProfilerContext(out_dir=workspace_path) as cpipe:
-        cpipe = generate_analysis_pipeline(
-            cpipe,
-            sample_loaddata_file,
-            barcode_csv_path,
-            nuclei_channel,
-            cell_channel,
-            mito_channel,
-        )
-        with out_dir.joinpath(filename).open("w") as f:
-            cpipe.dump(f)
-        filename = "analysis.json"
-        with out_dir.joinpath(filename).open("w") as f:
-            dumpit(cpipe, f, version=6)
+    with staged_directory(out_dir, delete=False) as staging_dir:
+        filename = "analysis.cppipe"
+
+        # Write old cppipe and return early if use_old is true
+        if use_legacy:
+            ref_cppipe = Template(
+                text=get_templates_path()
+                .joinpath("cppipe/ref_9_Analysis.cppipe.mako")
+                .read_text(),
+                output_encoding="utf-8",
+            ).render(barcode_csv_path=barcode_csv_path)
+            ref_cppipe = ref_cppipe.decode("utf-8")
+            staging_dir.joinpath(filename).write_text(ref_cppipe)
+            return
+
+        # get one of the load data file for generating cppipe
+        sample_loaddata_file = next(load_data_path.rglob("*.csv"))
+        with CellProfilerContext(out_dir=workspace_path) as cpipe:
+            cpipe = generate_analysis_pipeline(
+                cpipe,
+                sample_loaddata_file,
+                barcode_csv_path,
+                nuclei_channel,
+                cell_channel,
+                mito_channel,
+            )
+            with staging_dir.joinpath(filename).open("w") as f:
+                cpipe.dump(f)
+            filename = "analysis.json"
+            with staging_dir.joinpath(filename).open("w") as f:
+                dumpit(cpipe, f, version=6)
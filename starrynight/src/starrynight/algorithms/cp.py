@@ -1,14 +1,113 @@
 """Invoke cellprofiler."""
 
+import os
+from collections.abc import Iterator
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from multiprocessing import get_context
+from multiprocessing.context import BaseContext
 from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
 
 import cellprofiler_core.utilities.java
-from cpgdata.utils import parallel
 from tqdm import tqdm
 
-from starrynight.utils.cellprofiler import CellProfilerContext
+from starrynight.utils.cellprofiler import CP_PLUGIN_DIR_ENV, CellProfilerWorker
+from starrynight.utils.loaddata import get_loaddata_cost
 from starrynight.utils.misc import clean_directory
 
+# Modules imported once by the forkserver of the warm started workers
+CP_PRELOAD_MODULES = [
+    "starrynight.utils.cellprofiler_preload",
+    "starrynight.algorithms.cp",
+]
+
+# CellProfiler worker of the current process
+_cp_worker: dict = {}
+
+
+def get_cp_context(warm_start: bool = True) -> BaseContext:
+    """Get the multiprocessing context of the CellProfiler workers.
+
+    Warm started workers are forked from a forkserver that imports
+    CellProfiler, its readers, modules and plugins once. The forkserver is a
+    fresh interpreter, so workers do not inherit the JVM of the parent.
+
+    Parameters
+    ----------
+    warm_start : bool
+        Fork the workers from a preloaded forkserver instead of spawning them.
+
+    Returns
+    -------
+    BaseContext
+        The multiprocessing context.
+
+    """
+    if not warm_start:
+        return get_context("spawn")
+    context = get_context("forkserver")
+    context.set_forkserver_preload(CP_PRELOAD_MODULES)
+    return context
+
+
+@contextmanager
+def cp_plugin_dir_env(plugin_dir: Path | None) -> Iterator[None]:
+    """Expose the plugin directory to the forkserver of the workers.
+
+    The `CP_PLUGIN_DIR_ENV` environment variable is set for the duration of
+    the context and restored on exit. It is only read when the forkserver
+    starts, workers forked from a forkserver preloaded with another plugin
+    directory fill their modules again from `plugin_dir`.
+
+    Parameters
+    ----------
+    plugin_dir : Path
+        Path to cellprofiler plugin directory.
+
+    """
+    old_plugin_dir = os.environ.get(CP_PLUGIN_DIR_ENV)
+    if plugin_dir is not None:
+        os.environ[CP_PLUGIN_DIR_ENV] = plugin_dir.resolve().__str__()
+    try:
+        yield
+    finally:
+        if old_plugin_dir is None:
+            os.environ.pop(CP_PLUGIN_DIR_ENV, None)
+        else:
+            os.environ[CP_PLUGIN_DIR_ENV] = old_plugin_dir
+
+
+def get_cp_worker(plugin_dir: Path | None = None) -> CellProfilerWorker:
+    """Get the CellProfiler worker of the current process.
+
+    The worker is created on first use and reused by the next units of work
+    run in the process.
+
+    Parameters
+    ----------
+    plugin_dir : Path
+        Path to cellprofiler plugin directory.
+
+    Returns
+    -------
+    CellProfilerWorker
+        The worker of the process.
+
+    """
+    if _cp_worker.get("plugin_dir", ()) != plugin_dir:
+        _cp_worker["worker"] = CellProfilerWorker(plugin_dir=plugin_dir)
+        _cp_worker["plugin_dir"] = plugin_dir
+    return _cp_worker["worker"]
+
 
 def run_cp(
     uow_list: list[tuple[Path, Path]],
@@ -38,27 +137,73 @@ def run_cp(
 
     Notes
     -----
-    This function loads each UOW item from the list, runs the CellProfilerContext,
-    and saves the results to the specified output directory.
+    CellProfiler is set up once per process and each pipeline is parsed once,
+    only the LoadData file and the output directory change between UOW items.
 
     """
-    for pipe_path, load_data_path in tqdm(uow_list, position=job_idx):
-        # Create output dir for this load data
-        local_out_dir = out_dir.joinpath(
-            "-".join(load_data_path.name.split("#")[0].split("^"))
-        )
-        if clean:
-            clean_directory(local_out_dir)
-        print(local_out_dir)
-        local_out_dir.mkdir(parents=True, exist_ok=True)
-        with CellProfilerContext(
-            out_dir=local_out_dir,
-            loaddata_path=load_data_path,
-            require_jvm=False,
-            plugin_dir=plugin_dir,
-        ) as cpipe:
-            cpipe.load(str(pipe_path.resolve()))
-            cpipe.run()
+    for uow in tqdm(uow_list, position=job_idx):
+        run_cp_uow(uow, out_dir, plugin_dir, clean)
+
+
+def run_cp_uow(
+    uow: tuple[Path, Path],
+    out_dir: Path,
+    plugin_dir: Path | None = None,
+    clean: bool = True,
+) -> tuple[int, float]:
+    """Run cellprofiler for a unit-of-work (UOW) item.
+
+    Parameters
+    ----------
+    uow : tuple[Path, Path]
+        Paths to the pipeline and load data files.
+    out_dir : Path
+        Output directory path.
+    plugin_dir : Path
+        Path to cellprofiler plugin directory.
+    clean : bool
+        Clean output directory before the run.
+
+    Returns
+    -------
+    tuple[int, float]
+        Process id of the worker and seconds spent on the UOW item.
+
+    """
+    start = perf_counter()
+    pipe_path, load_data_path = uow
+    # Create output dir for this load data
+    local_out_dir = out_dir.joinpath(
+        "-".join(load_data_path.name.split("#")[0].split("^"))
+    )
+    if clean:
+        clean_directory(local_out_dir)
+    print(local_out_dir)
+    get_cp_worker(plugin_dir).run(pipe_path, load_data_path, local_out_dir)
+    return os.getpid(), perf_counter() - start
+
+
+def run_cp_first_image_set(
+    uow: tuple[Path, Path],
+    out_dir: Path,
+    plugin_dir: Path | None = None,
+) -> None:
+    """Run cellprofiler on the first image set of a unit-of-work (UOW) item.
+
+    Parameters
+    ----------
+    uow : tuple[Path, Path]
+        Paths to the pipeline and load data files.
+    out_dir : Path
+        Output directory path.
+    plugin_dir : Path
+        Path to cellprofiler plugin directory.
+
+    """
+    pipe_path, load_data_path = uow
+    get_cp_worker(plugin_dir).run(
+        pipe_path, load_data_path, out_dir, image_set_end=1
+    )
 
 
 def run_cp_parallel(
@@ -66,9 +211,14 @@ def run_cp_parallel(
     out_dir: Path,
     plugin_dir: Path | None = None,
     jobs: int = 20,
-) -> None:
+    warm_start: bool = True,
+) -> dict[int, tuple[int, float]]:
     """Run cellprofiler on multiple unit-of-work (UOW) items in parallel.
 
+    UOW items are dispatched one at a time to the next free worker, largest
+    first by their LoadData cost (see `get_loaddata_cost`), so that a few
+    large items do not keep one worker busy long after the others are done.
+
     Parameters
     ----------
     uow_list : list of tuple of Path
@@ -79,18 +229,177 @@ def run_cp_parallel(
         Path to cellprofiler plugin directory.
     jobs : int, optional
         Number of parallel jobs to use (default is 20).
+    warm_start : bool, optional
+        Fork the workers from a forkserver with CellProfiler preloaded, see
+        `get_cp_context` (default is True).
 
     Returns
     -------
-    None
+    dict[int, tuple[int, float]]
+        Number of UOW items run and seconds busy, by worker process id.
+
+    Raises
+    ------
+    RuntimeError
+        If any UOW item failed, once all the others have run.
 
     Notes
     -----
     This function starts a Java Virtual Machine (JVM) instance using the CellProfiler
-    library, runs the Illumination Calculate pipeline on each UOW item in parallel,
-    and saves the results to the specified output directory.
+    library, runs the pipeline of each UOW item in parallel, saves the results
+    to the specified output directory and prints the utilization of every
+    worker. A failed UOW item does not stop the run, its error is printed
+    with the utilization. If the pool breaks, e.g. a worker is killed, the
+    UOW items left are reported as failed. The JVM is stopped even if the run
+    is aborted.
+
+    """
+    # LoadData files on the cloud are read concurrently
+    with ThreadPoolExecutor() as executor:
+        costs = list(
+            executor.map(get_loaddata_cost, [uow[1] for uow in uow_list])
+        )
+    uow_list = [
+        uow
+        for _, uow in sorted(
+            zip(costs, uow_list), key=lambda item: item[0], reverse=True
+        )
+    ]
+    jobs = max(min(jobs, len(uow_list)), 1)
+    worker_stats: dict[int, tuple[int, float]] = {}
+    failed: dict[tuple[Path, Path], Exception] = {}
+    cellprofiler_core.utilities.java.start_java()
+    start = perf_counter()
+    try:
+        with (
+            cp_plugin_dir_env(plugin_dir),
+            ProcessPoolExecutor(
+                jobs, mp_context=get_cp_context(warm_start)
+            ) as executor,
+            tqdm(total=len(uow_list)) as progress,
+        ):
+            pending = iter(uow_list)
+            running: dict[Future, tuple[Path, Path]] = {}
+
+            def submit_next() -> None:
+                for uow in pending:
+                    try:
+                        future = executor.submit(
+                            run_cp_uow, uow, out_dir, plugin_dir
+                        )
+                    except BrokenProcessPool as e:
+                        # A worker died, the UOW items left cannot run
+                        failed[uow] = e
+                        progress.update()
+                    else:
+                        running[future] = uow
+                        return
+
+            for _ in range(jobs):
+                submit_next()
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    uow = running.pop(future)
+                    try:
+                        pid, seconds = future.result()
+                    except Exception as e:
+                        # The other UOW items still run, failures are
+                        # reported at the end of the run
+                        failed[uow] = e
+                    else:
+                        num_uows, busy = worker_stats.get(pid, (0, 0.0))
+                        worker_stats[pid] = (num_uows + 1, busy + seconds)
+                    progress.update()
+                    submit_next()
+        wall_seconds = perf_counter() - start
+    finally:
+        cellprofiler_core.utilities.java.stop_java()
+    print_worker_utilization(worker_stats, wall_seconds, failed)
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(uow_list)} UOW items failed")
+    return worker_stats
+
+
+def print_worker_utilization(
+    worker_stats: dict[int, tuple[int, float]],
+    wall_seconds: float,
+    failed: dict[tuple[Path, Path], Exception] | None = None,
+) -> None:
+    """Print the share of the run time every worker spent on UOW items.
+
+    Parameters
+    ----------
+    worker_stats : dict[int, tuple[int, float]]
+        Number of UOW items run and seconds busy, by worker process id.
+    wall_seconds : float
+        Wall time of the run.
+    failed : dict[tuple[Path, Path], Exception] | None
+        Error of every failed UOW item, not counted in `worker_stats`.
+
+    """
+    num_uows = sum(num_uows for num_uows, _ in worker_stats.values())
+    print(f"Ran {num_uows} UOW items in {wall_seconds:.1f}s")
+    for idx, (pid, (num_uows, busy)) in enumerate(sorted(worker_stats.items())):
+        utilization = busy / wall_seconds if wall_seconds > 0 else 0.0
+        print(
+            f"worker {idx} (pid {pid}): {num_uows} UOW items,"
+            f" {busy:.1f}s busy, {utilization:.0%} utilization"
+        )
+    for (pipe_path, load_data_path), error in (failed or {}).items():
+        print(f"failed {pipe_path.name} on {load_data_path}: {error!r}")
+
+
+def benchmark_cp_startup(
+    uow_list: list[tuple[Path, Path]],
+    plugin_dir: Path | None = None,
+    jobs: int = 20,
+) -> dict[str, float]:
+    """Time the startup of cold and warm started CellProfiler workers.
+
+    Starts `jobs` workers of each kind and measures the wall time until every
+    worker has run the first image set of a UOW item, outputs are discarded.
+
+    Parameters
+    ----------
+    uow_list : list of tuple of Path
+        List of tuples containing the paths to the pipeline and load data files.
+    plugin_dir : Path
+        Path to cellprofiler plugin directory.
+    jobs : int, optional
+        Number of workers to start (default is 20).
+
+    Returns
+    -------
+    dict[str, float]
+        Seconds to the first image set of all the workers, by "cold" and
+        "warm" start.
 
     """
+    timings = {}
     cellprofiler_core.utilities.java.start_java()
-    parallel(uow_list, run_cp, [out_dir, plugin_dir], jobs)
-    cellprofiler_core.utilities.java.stop_java()
+    try:
+        for name, warm_start in [("cold", False), ("warm", True)]:
+            with TemporaryDirectory() as tmp_dir:
+                start = perf_counter()
+                with (
+                    cp_plugin_dir_env(plugin_dir),
+                    ProcessPoolExecutor(
+                        jobs, mp_context=get_cp_context(warm_start)
+                    ) as executor,
+                ):
+                    futures = [
+                        executor.submit(
+                            run_cp_first_image_set,
+                            uow_list[idx % len(uow_list)],
+                            Path(tmp_dir).joinpath(str(idx)),
+                            plugin_dir,
+                        )
+                        for idx in range(jobs)
+                    ]
+                    for future in futures:
+                        future.result()
+                timings[name] = perf_counter() - start
+    finally:
+        cellprofiler_core.utilities.java.stop_java()
+    return timings
@@ -1,6 +1,5 @@
 """Illum Calculate commands."""
 
-import csv
 from io import TextIOWrapper
 from pathlib import Path
 
@@ -61,7 +60,7 @@ from cellprofiler_core.preferences import json
 from cloudpathlib import AnyPath, CloudPath
 from mako.template import Template
 
-from starrynight.algorithms.index import OutputIndex, PCPIndex
+from starrynight.algorithms.index import write_loaddata_output_index
 from starrynight.modules.cp_illum_apply.constants import (
     CP_ILLUM_APPLY_OUT_PATH_SUFFIX,
 )
@@ -71,16 +70,20 @@ from starrynight.modules.cp_illum_calc.constants import (
 from starrynight.templates import get_templates_path
 from starrynight.utils.cellprofiler import CellProfilerContext
 from starrynight.utils.dfutils import (
-    filter_df_by_hierarchy,
-    filter_images,
-    gen_image_hierarchy,
     gen_legacy_channel_map,
     get_channels_by_batch_plate,
     get_channels_from_df,
     get_default_path_prefix,
+    load_images,
 )
-from starrynight.utils.globbing import flatten_all, flatten_dict, get_files_by
-from starrynight.utils.misc import clean_directory, write_pq
+from starrynight.utils.globbing import flatten_dict, get_files_by
+from starrynight.utils.loaddata import (
+    frame_index_expr,
+    key_dir_expr,
+    write_loaddata_csv,
+    write_loaddata_levels,
+)
+from starrynight.utils.misc import staged_directory
 
 
 def write_output_index(
@@ -103,89 +106,55 @@ def write_output_index(
     # Read the loaddata CSV file
     loaddata_df = pl.read_csv(loaddata_file_path.resolve().__str__())
 
-    # Initialize list to store output index records
-    output_records = []
-
-    # Process each row in the loaddata
-    for row in loaddata_df.iter_rows(named=True):
-        # Extract metadata
-        batch_id = row.get("Metadata_Batch")
-        plate_id = row.get("Metadata_Plate")
-        site_id = row.get("Metadata_Site")
-        well_id = row.get("Metadata_Well")
-
-        # Find all corrected image columns (output files)
-        corr_channels = [
-            col
-            for col in loaddata_df.columns
-            if col.startswith("FileName_Orig")
-        ]
-
-        for channel_col in corr_channels:
-            # Extract channel name from column (e.g., "FileName_OrigDNA" -> "DNA")
-            channel = channel_col.replace("FileName_Orig", "")
-
-            # Generate output filename based on pipeline configuration
-            output_filename = f"Plate_{plate_id}_Well_{well_id}_Site_{site_id}_Corr{channel}.tiff"
-
-            # Create output file path
-            output_key = f"{output_filename}"
-
-            # Create OutputIndex record
-            output_record = OutputIndex(
-                key=output_key,
-                prefix=str(generated_output_dir.resolve().absolute()),
-                dataset_id=None,
-                batch_id=batch_id,
-                plate_id=plate_id,
-                cycle_id=None,
-                magnification=None,
-                well_id=well_id,
-                site_id=str(site_id),
-                channel_dict=[channel],
-                channel_id=channel,
-                filename=output_filename,
-                extension="tiff",
-                file_type="corrected_image",
-            )
-
-            output_records.append(output_record.model_dump())
+    # Find all corrected image columns (output files)
+    corr_channels = [
+        col for col in loaddata_df.columns if col.startswith("FileName_Orig")
+    ]
 
-        # Also add measurements CSV output
-        measurements_filenames = [
-            "PaintingIllumApplication_Cells.csv",
-            "PaintingIllumApplication_ConfluentRegions.csv",
-            "PaintingIllumApplication_Experiment.csv",
-            "PaintingIllumApplication_Image.csv",
-            "PaintingIllumApplication_Nuclei.csv",
-        ]
+    outputs = []
+    for channel_col in corr_channels:
+        # Extract channel name from column (e.g., "FileName_OrigDNA" -> "DNA")
+        channel = channel_col.replace("FileName_Orig", "")
 
-        for measurement in measurements_filenames:
-            measurements_record = OutputIndex(
-                key=f"{measurement}",
-                prefix=str(generated_output_dir.resolve().absolute()),
-                dataset_id=None,
-                batch_id=batch_id,
-                plate_id=plate_id,
-                cycle_id=None,
-                magnification=None,
-                well_id=well_id,
-                site_id=str(site_id),
-                channel_dict=None,
-                filename=measurement,
-                extension="csv",
-                file_type="measurements",
-            )
-            output_records.append(measurements_record.model_dump())
+        # Output filename template, filled per row with the site metadata
+        output_filename = (
+            "Plate_{plate_id}_Well_{well_id}_Site_{site_id}"
+            f"_Corr{channel}.tiff"
+        )
+        outputs.append(
+            {
+                "key": output_filename,
+                "filename": output_filename,
+                "channel_id": channel,
+                "extension": "tiff",
+                "file_type": "corrected_image",
+            }
+        )
 
-    # Convert to dictionary format for write_pq
-    output_index_dict = {
-        key: [record[key] for record in output_records]
-        for key in output_records[0].keys()
-    }
+    # Also add measurements CSV output
+    measurements_filenames = [
+        "PaintingIllumApplication_Cells.csv",
+        "PaintingIllumApplication_ConfluentRegions.csv",
+        "PaintingIllumApplication_Experiment.csv",
+        "PaintingIllumApplication_Image.csv",
+        "PaintingIllumApplication_Nuclei.csv",
+    ]
+    outputs += [
+        {
+            "key": measurement,
+            "filename": measurement,
+            "extension": "csv",
+            "file_type": "measurements",
+        }
+        for measurement in measurements_filenames
+    ]
 
-    # Write parquet file
-    write_pq(output_index_dict, OutputIndex, output_index_path)
+    write_loaddata_output_index(
+        loaddata_df,
+        outputs,
+        str(generated_output_dir.resolve().absolute()),
+        output_index_path,
+    )
 
 
 ###############################
@@ -202,13 +171,13 @@ def write_loaddata_illum_apply(
     use_legacy: bool = False,
     exp_config_path: Path | CloudPath | None = None,
 ) -> None:
-    loaddata_writer = csv.writer(f, delimiter=",", quoting=csv.QUOTE_MINIMAL)
-
     # Setup metadata headers
     metadata_heads = [
         f"Metadata_{col}" for col in ["Batch", "Plate", "Site", "Well", "Cycle"]
     ]
 
+    # Index channels stored in the frame of each LoadData channel
+    frame_channels = {ch: [ch] for ch in plate_channel_list}
     if use_legacy:
         # Load experiment config
         exp_config = json.loads(exp_config_path.read_text())
@@ -222,6 +191,12 @@ def write_loaddata_illum_apply(
         plate_channel_list = [
             legacy_channel_map[ch] for ch in plate_channel_list
         ]
+        frame_channels = {
+            legacy_ch: [
+                ch for ch, v in legacy_channel_map.items() if v == legacy_ch
+            ]
+            for legacy_ch in plate_channel_list
+        }
 
         illum_by_channel_dict = {
             legacy_channel_map[ch]: AnyPath(
@@ -247,8 +222,9 @@ def write_loaddata_illum_apply(
         illum_by_channel_dict[ch].name.__str__() for ch in plate_channel_list
     ]
 
-    # Write the headers first
-    loaddata_writer.writerow(
+    # Build all the rows from the index in one go
+    write_loaddata_csv(
+        images_df,
         [
             *metadata_heads,
             *filename_heads,
@@ -256,48 +232,104 @@ def write_loaddata_illum_apply(
             *pathname_heads,
             *illum_filename_heads,
             *illum_pathname_heads,
-        ]
+        ],
+        [
+            # Metadata heads
+            pl.col("batch_id"),
+            pl.col("plate_id"),
+            pl.col("site_id"),
+            pl.col("well_id"),
+            pl.col("cycle_id").replace("", None).fill_null("0"),
+            # Filename heads
+            *[pl.col("filename") for _ in filename_heads],
+            # Frame heads, matched with their order in the filenames
+            *[
+                frame_index_expr(frame_channels[ch])
+                for ch in plate_channel_list
+            ],
+            # Pathname heads, the file name removed from the "key"
+            # (expected by cellprofiler)
+            *[key_dir_expr(path_mask) for _ in pathname_heads],
+            # Illum filename heads
+            *[pl.lit(value) for value in illum_filename_values],
+            # Illum Pathname heads
+            *[pl.lit(value) for value in illum_pathname_values],
+        ],
+        f,
     )
 
-    # Iterate over index and add all the files
-    for index in images_df.collect().to_dicts():
-        index = PCPIndex(**index)
-        assert index.channel_dict is not None
-        if use_legacy:
-            index.channel_dict = [
-                legacy_channel_map[ch] for ch in index.channel_dict
-            ]
-        # make sure frame heads are matched with their order in the filenames
-        frame_index = [
-            index.channel_dict.index(channel.replace("Frame_Orig", ""))
-            for channel in frame_heads
-        ]
-        assert index.key is not None
-        loaddata_writer.writerow(
-            [
-                # Metadata heads
-                index.batch_id,
-                index.plate_id,
-                index.site_id,
-                index.well_id,
-                index.cycle_id or 0,
-                # Filename heads
-                *[f"{index.filename}" for _ in range(len(filename_heads))],
-                # Frame heads
-                *[str(i) for i in frame_index],
-                # Pathname heads
-                *[
-                    # We need to remove the file name from the "key"
-                    # (expected by cellprofiler)
-                    f"{path_mask.rstrip('/')}/{'/'.join(index.key.split('/')[0:-1])}/"
-                    for _ in range(len(pathname_heads))
-                ],
-                # Illum filename heads
-                *illum_filename_values,
-                # Illum Pathname heads
-                *illum_pathname_values,
-            ]
+
+def write_level_loaddata(
+    level: list[str],
+    level_df: pl.LazyFrame,
+    out_path: Path | CloudPath,
+    path_mask: str,
+    illum_path: Path | CloudPath,
+    index_out_dir: Path | CloudPath,
+    generated_output_dir: Path | CloudPath,
+    use_legacy: bool = False,
+    exp_config_path: Path | CloudPath | None = None,
+) -> None:
+    """Write the illum apply LoadData and output index of a unit of work.
+
+    Parameters
+    ----------
+    level : list[str]
+        Level values of the unit of work.
+    level_df : pl.LazyFrame
+        Images of the unit of work.
+    out_path : Path | CloudPath
+        Path to the LoadData directory.
+    path_mask : str
+        Path prefix mask to use.
+    illum_path : Path | CloudPath
+        Path | CloudPath to illum directory.
+    index_out_dir : Path | CloudPath
+        Path to the output index directory.
+    generated_output_dir : Path | CloudPath
+        Path to generated output.
+    use_legacy : bool
+        Use legacy cppipe and loaddata.
+    exp_config_path : Path | CloudPath
+        Path to experiment config json path.
+
+    """
+    # Setup channel list for this level
+    plate_channel_list = get_channels_from_df(level_df)
+
+    # Find illum files for this level
+    illum_by_channel_dict = {
+        ch: illum_path.joinpath(
+            # INFO: This is not optimal, output form previous step is calculated per plate
+            # INFO: So, level[:2] is used and not just levels
+            f"{'-'.join(level[:2])}/{level[1]}_Illum{ch}.npy"
         )
+        for ch in plate_channel_list
+    }
+
+    # Construct filename for the loaddata csv
+    level_out_path = out_path.joinpath(f"{'^'.join(level)}#illum_apply.csv")
+
+    # Construct filename for the output index parquet
+    output_index_path = index_out_dir.joinpath(
+        f"{'^'.join(level)}#illum_apply_output_index.parquet"
+    )
+
+    with level_out_path.open("w") as f:
+        write_loaddata_illum_apply(
+            level_df,
+            plate_channel_list,
+            illum_by_channel_dict,
+            path_mask,
+            f,
+            use_legacy,
+            exp_config_path,
+        )
+    write_output_index(
+        level_out_path,
+        generated_output_dir.joinpath("-".join(level)),
+        output_index_path,
+    )
 
 
 def gen_illum_apply_load_data(
@@ -310,6 +342,7 @@ def gen_illum_apply_load_data(
     uow_hierarchy: list[str] | None = None,
     generated_output_dir: Path | CloudPath | None = None,
     clean: bool = True,
+    jobs: int = 1,
 ) -> None:
     """Generate load data for illum calc pipeline.
 
@@ -332,27 +365,24 @@ def gen_illum_apply_load_data(
     generated_output_dir : Path | CloudPath | None
         Path to generated output.
     clean: bool
-        Clean output directory.
+        Remove stale files from the output directory.
+    jobs : int
+        Number of parallel jobs to use.
 
     """
-    if clean:
-        # clean output directory
-        clean_directory(out_path)
-
     # Construct illum path if not given
     if not illum_path:
         illum_path = index_path.parents[1].joinpath(
             CP_ILLUM_CALC_OUT_PATH_SUFFIX
         )
 
-    # Load index
-    df = pl.scan_parquet(index_path.resolve().__str__())
-
-    # Filter for relevant images
-    images_df = filter_images(df, False)
+    # Load relevant images, shared by the stages run in this process
+    images_df = load_images(index_path, False)
 
     # Query default path prefix
-    default_path_prefix: str = get_default_path_prefix(images_df)
+    default_path_prefix: str = get_default_path_prefix(
+        images_df.lazy(), index_path, False
+    )
 
     # Setup path mask (required for resolving pathnames during the execution)
     if path_mask is None:
@@ -365,12 +395,8 @@ def gen_illum_apply_load_data(
         "well_id",
         "site_id",
     ]
-    images_hierarchy_dict = gen_image_hierarchy(images_df, uow_hierarchy)
-    levels = flatten_all(images_hierarchy_dict)
-
-    # Create dir for output index
+    # Dir for output index
     index_out_dir = index_path.parent.joinpath("cp_illum_apply")
-    index_out_dir.mkdir(parents=True, exist_ok=True)
 
     # Construct generated_output_dir
     if generated_output_dir is None:
@@ -378,45 +404,22 @@ def gen_illum_apply_load_data(
             CP_ILLUM_APPLY_OUT_PATH_SUFFIX
         )
 
-    for level in levels:
-        # setup filtered df for chunked levels
-        level_df = filter_df_by_hierarchy(images_df, level, False)
-
-        # Setup channel list for this level
-        plate_channel_list = get_channels_from_df(level_df)
-
-        # Find illum files for this level
-        illum_by_channel_dict = {
-            ch: illum_path.joinpath(
-                # INFO: This is not optimal, output form previous step is calculated per plate
-                # INFO: So, level[:2] is used and not just levels
-                f"{'-'.join(level[:2])}/{level[1]}_Illum{ch}.npy"
-            )
-            for ch in plate_channel_list
-        }
-
-        # Construct filename for the loaddata csv
-        level_out_path = out_path.joinpath(f"{'^'.join(level)}#illum_apply.csv")
-
-        # Construct filename for the output index parquet
-        output_index_path = index_out_dir.joinpath(
-            f"{'^'.join(level)}#illum_apply_output_index.parquet"
-        )
-
-        with level_out_path.open("w") as f:
-            write_loaddata_illum_apply(
-                level_df,
-                plate_channel_list,
-                illum_by_channel_dict,
-                path_mask,
-                f,
-                use_legacy,
-                exp_config_path,
-            )
-        write_output_index(
-            level_out_path,
-            generated_output_dir.joinpath("-".join(level)),
-            output_index_path,
+    # Output indexes are staged like the LoadData files, so that unchanged
+    # ones keep their modification times
+    with staged_directory(index_out_dir, delete=clean) as index_staging_dir:
+        write_loaddata_levels(
+            images_df,
+            uow_hierarchy,
+            write_level_loaddata,
+            jobs=jobs,
+            clean=clean,
+            out_path=out_path,
+            path_mask=path_mask,
+            illum_path=illum_path,
+            index_out_dir=index_staging_dir,
+            generated_output_dir=generated_output_dir,
+            use_legacy=use_legacy,
+            exp_config_path=exp_config_path,
         )
     return out_path
 
@@ -724,27 +727,30 @@ def gen_illum_apply_cppipe(
     # Default run dir should already be present, otherwise CP raises an error
     out_dir.mkdir(exist_ok=True, parents=True)
 
-    filename = "illum_apply_painting.cppipe"
+    with staged_directory(out_dir, delete=False) as staging_dir:
+        filename = "illum_apply_painting.cppipe"
 
-    # Write old cppipe and return early if use_old is true
-    if use_legacy:
-        ref_cppipe = get_templates_path() / "cppipe/ref_2_CP_Apply_Illum.cppipe"
+        # Write old cppipe and return early if use_old is true
+        if use_legacy:
+            ref_cppipe = (
+                get_templates_path() / "cppipe/ref_2_CP_Apply_Illum.cppipe"
+            )
 
-        out_dir.joinpath(filename).write_text(ref_cppipe.read_text())
-        return
+            staging_dir.joinpath(filename).write_text(ref_cppipe.read_text())
+            return
 
-    # get one of the load data file for generating cppipe
-    sample_loaddata_file = next(load_data_path.rglob("*.csv"))
+        # get one of the load data file for generating cppipe
+        sample_loaddata_file = next(load_data_path.rglob("*.csv"))
 
-    with CellProfilerContext(out_dir=workspace_path) as cpipe:
-        cpipe = generate_illum_apply_pipeline(
-            cpipe, sample_loaddata_file, nuclei_channel, cell_channel
-        )
-        with out_dir.joinpath(filename).open("w") as f:
-            cpipe.dump(f)
-        filename = "illum_apply_painting.json"
-        with out_dir.joinpath(filename).open("w") as f:
-            dumpit(cpipe, f, version=6)
+        with CellProfilerContext(out_dir=workspace_path) as cpipe:
+            cpipe = generate_illum_apply_pipeline(
+                cpipe, sample_loaddata_file, nuclei_channel, cell_channel
+            )
+            with staging_dir.joinpath(filename).open("w") as f:
+                cpipe.dump(f)
+            filename = "illum_apply_painting.json"
+            with staging_dir.joinpath(filename).open("w") as f:
+                dumpit(cpipe, f, version=6)
 
 
 def write_qc_notebook(
@@ -55,18 +55,17 @@ from starrynight.modules.sbs_illum_calc.constants import (
 from starrynight.templates import get_templates_path
 from starrynight.utils.cellprofiler import CellProfilerContext
 from starrynight.utils.dfutils import (
-    filter_df_by_hierarchy,
-    filter_images,
-    gen_image_hierarchy,
     gen_legacy_channel_map,
     get_channels_by_batch_plate,
     get_channels_from_df,
     get_cycles_by_batch_plate,
     get_cycles_from_df,
     get_default_path_prefix,
+    load_images,
 )
-from starrynight.utils.globbing import flatten_all, flatten_dict, get_files_by
-from starrynight.utils.misc import clean_directory, resolve_path_loaddata
+from starrynight.utils.globbing import flatten_dict, get_files_by
+from starrynight.utils.loaddata import write_loaddata_levels
+from starrynight.utils.misc import resolve_path_loaddata, staged_directory
 
 ###############################
 ## Load data generation
@@ -208,10 +207,12 @@ def write_loaddata_illum_apply(
         ]
     )
 
+    # Wells and sites are sorted, so that the rows do not depend on the index
     wells_sites = (
         images_df.collect()
         .group_by("well_id")
-        .agg(pl.col("site_id").unique())
+        .agg(pl.col("site_id").unique().sort())
+        .sort("well_id")
         .to_dicts()
     )
     for well_sites in wells_sites:
@@ -292,6 +293,83 @@ def write_loaddata_illum_apply(
             )
 
 
+def write_level_loaddata(
+    level: list[str],
+    level_df: pl.LazyFrame,
+    out_path: Path | CloudPath,
+    path_mask: str,
+    illum_path: Path | CloudPath,
+    nuclei_channel: str,
+    use_legacy: bool = False,
+    exp_config_path: Path | CloudPath | None = None,
+) -> None:
+    """Write the SBS illum apply LoadData of a unit of work.
+
+    Parameters
+    ----------
+    level : list[str]
+        Level values of the unit of work.
+    level_df : pl.LazyFrame
+        Images of the unit of work.
+    out_path : Path | CloudPath
+        Path to the LoadData directory.
+    path_mask : str
+        Path prefix mask to use.
+    illum_path : Path | CloudPath
+        Path | CloudPath to illum directory.
+    nuclei_channel : str
+        Channel to use for nuclei segmentation.
+    use_legacy : bool
+        Use legacy cppipe and loaddata.
+    exp_config_path : Path | CloudPath
+        Path to experiment config json path.
+
+    """
+    # Setup channel list for this level
+    plate_channel_list = get_channels_from_df(level_df)
+
+    # Setup cycles list
+    plate_cycles_list = get_cycles_from_df(level_df)
+
+    # find illum files for this level
+    illum_by_cycle_channel_dict = {
+        cycle: {
+            ch: illum_path.joinpath(
+                # INFO: This is not optimal, output form previous step is calculated per plate
+                # INFO: So, level[:2] is used and not just levels
+                f"{'-'.join(level[:2] + [str(cycle)])}/{level[1]}_Cycle{int(cycle)}_Illum{ch}.npy"
+            )
+            for ch in plate_channel_list
+        }
+        for cycle in plate_cycles_list
+    }
+
+    # gen metadata to index key dict
+    metadata_to_index_dict = {}
+    for image in level_df.collect().iter_rows(named=True):
+        image = PCPIndex(**image)
+        metadata_to_index_dict[
+            f"{image.cycle_num}_{image.well_id}_{image.site_num}"
+        ] = image
+
+    # Construct filename for the loaddata csv
+    level_out_path = out_path.joinpath(f"{'^'.join(level)}#illum_apply_sbs.csv")
+
+    with level_out_path.open("w") as f:
+        write_loaddata_illum_apply(
+            level_df,
+            plate_cycles_list,
+            plate_channel_list,
+            illum_by_cycle_channel_dict,
+            metadata_to_index_dict,
+            nuclei_channel,
+            path_mask,
+            f,
+            use_legacy,
+            exp_config_path,
+        )
+
+
 def gen_illum_apply_sbs_load_data(
     index_path: Path | CloudPath,
     out_path: Path | CloudPath,
@@ -302,6 +380,7 @@ def gen_illum_apply_sbs_load_data(
     exp_config_path: Path | CloudPath | None = None,
     uow_hierarchy: list[str] = None,
     clean: bool = True,
+    jobs: int = 1,
 ) -> None:
     """Generate load data for segcheck pipeline.
 
@@ -324,27 +403,24 @@ def gen_illum_apply_sbs_load_data(
     uow_hierarchy : list[str] | None
         Unit of work list
     clean: bool
-        Clean output directory.
+        Remove stale files from the output directory.
+    jobs : int
+        Number of parallel jobs to use.
 
     """
-    if clean:
-        # clean output directory
-        clean_directory(out_path)
-
     # Construct illum path if not given
     if not illum_path:
         illum_path = index_path.parents[1].joinpath(
             SBS_ILLUM_CALC_OUT_PATH_SUFFIX
         )
 
-    # Load index
-    df = pl.scan_parquet(index_path.resolve().__str__())
-
-    # Filter for relevant images
-    images_df = filter_images(df, True)
+    # Load relevant images, shared by the stages run in this process
+    images_df = load_images(index_path, True)
 
     # Query default path prefix
-    default_path_prefix: str = get_default_path_prefix(images_df)
+    default_path_prefix: str = get_default_path_prefix(
+        images_df.lazy(), index_path, True
+    )
 
     # Setup path mask (required for resolving pathnames during the execution)
     if path_mask is None:
@@ -357,57 +433,19 @@ def gen_illum_apply_sbs_load_data(
         "well_id",
         "site_id",
     ]
-    images_hierarchy_dict = gen_image_hierarchy(images_df, uow_hierarchy)
-    levels = flatten_all(images_hierarchy_dict)
-    for level in levels:
-        # setup filtered df for chunked levels
-        level_df = filter_df_by_hierarchy(images_df, level, False)
-
-        # Setup channel list for this level
-        plate_channel_list = get_channels_from_df(level_df)
-
-        # Setup cycles list
-        plate_cycles_list = get_cycles_from_df(level_df)
-
-        # find illum files for this level
-        illum_by_cycle_channel_dict = {
-            cycle: {
-                ch: illum_path.joinpath(
-                    # INFO: This is not optimal, output form previous step is calculated per plate
-                    # INFO: So, level[:2] is used and not just levels
-                    f"{'-'.join(level[:2] + [str(cycle)])}/{level[1]}_Cycle{int(cycle)}_Illum{ch}.npy"
-                )
-                for ch in plate_channel_list
-            }
-            for cycle in plate_cycles_list
-        }
-
-        # gen metadata to index key dict
-        metadata_to_index_dict = {}
-        for image in level_df.collect().iter_rows(named=True):
-            image = PCPIndex(**image)
-            metadata_to_index_dict[
-                f"{int(image.cycle_id)}_{image.well_id}_{int(image.site_id)}"
-            ] = image
-
-        # Construct filename for the loaddata csv
-        level_out_path = out_path.joinpath(
-            f"{'^'.join(level)}#illum_apply_sbs.csv"
-        )
-
-        with level_out_path.open("w") as f:
-            write_loaddata_illum_apply(
-                level_df,
-                plate_cycles_list,
-                plate_channel_list,
-                illum_by_cycle_channel_dict,
-                metadata_to_index_dict,
-                nuclei_channel,
-                path_mask,
-                f,
-                use_legacy,
-                exp_config_path,
-            )
+    write_loaddata_levels(
+        images_df,
+        uow_hierarchy,
+        write_level_loaddata,
+        jobs=jobs,
+        clean=clean,
+        out_path=out_path,
+        path_mask=path_mask,
+        illum_path=illum_path,
+        nuclei_channel=nuclei_channel,
+        use_legacy=use_legacy,
+        exp_config_path=exp_config_path,
+    )
     return out_path
 
 
@@ -696,27 +734,30 @@ def gen_illum_apply_sbs_cppipe(
     # Default run dir should already be present, otherwise CP raises an error
     out_dir.mkdir(exist_ok=True, parents=True)
 
-    filename = "illum_apply_sbs.cppipe"
+    with staged_directory(out_dir, delete=False) as staging_dir:
+        filename = "illum_apply_sbs.cppipe"
 
-    # Write old cppipe and return early if use_old is true
-    if use_legacy:
-        ref_cppipe = get_templates_path() / "cppipe/ref_6_BC_Apply_Illum.cppipe"
+        # Write old cppipe and return early if use_old is true
+        if use_legacy:
+            ref_cppipe = (
+                get_templates_path() / "cppipe/ref_6_BC_Apply_Illum.cppipe"
+            )
 
-        out_dir.joinpath(filename).write_text(ref_cppipe.read_text())
-        return
+            staging_dir.joinpath(filename).write_text(ref_cppipe.read_text())
+            return
 
-    # get one of the load data file for generating cppipe
-    sample_loaddata_file = next(load_data_path.rglob("*.csv"))
+        # get one of the load data file for generating cppipe
+        sample_loaddata_file = next(load_data_path.rglob("*.csv"))
 
-    with CellProfilerContext(out_dir=workspace_path) as cpipe:
-        cpipe = generate_illum_apply_sbs_pipeline(
-            cpipe, sample_loaddata_file, nuclei_channel
-        )
-        with out_dir.joinpath(filename).open("w") as f:
-            cpipe.dump(f)
-        filename = "illum_apply_painting.json"
-        with out_dir.joinpath(filename).open("w") as f:
-            dumpit(cpipe, f, version=6)
+        with CellProfilerContext(out_dir=workspace_path) as cpipe:
+            cpipe = generate_illum_apply_sbs_pipeline(
+                cpipe, sample_loaddata_file, nuclei_channel
+            )
+            with staging_dir.joinpath(filename).open("w") as f:
+                cpipe.dump(f)
+            filename = "illum_apply_painting.json"
+            with staging_dir.joinpath(filename).open("w") as f:
+                dumpit(cpipe, f, version=6)
 
 
 # ------------------------------------------------------
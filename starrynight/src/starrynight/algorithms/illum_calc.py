@@ -1,6 +1,5 @@
 """Illum Calculate commands."""
 
-import csv
 import json
 from io import TextIOWrapper
 from pathlib import Path
@@ -39,20 +38,23 @@ from centrosome.bg_compensate import MODE_AUTO
 from cloudpathlib import CloudPath
 from mako.template import Template
 
-from starrynight.algorithms.index import PCPIndex
 from starrynight.templates import get_templates_path
 from starrynight.utils.cellprofiler import CellProfilerContext
 from starrynight.utils.dfutils import (
-    filter_df_by_hierarchy,
-    filter_images,
-    gen_image_hierarchy,
     gen_legacy_channel_map,
     get_channels_from_df,
     get_cycles_by_batch_plate,
     get_default_path_prefix,
+    load_images,
 )
-from starrynight.utils.globbing import flatten_all, flatten_dict, get_files_by
-from starrynight.utils.misc import clean_directory
+from starrynight.utils.globbing import flatten_dict, get_files_by
+from starrynight.utils.loaddata import (
+    frame_index_expr,
+    key_dir_expr,
+    write_loaddata_csv,
+    write_loaddata_levels,
+)
+from starrynight.utils.misc import staged_directory
 
 ###############################
 ## Load data generation
@@ -67,13 +69,13 @@ def write_loaddata_illum_calc(
     use_legacy: bool = False,
     exp_config_path: Path | CloudPath | None = None,
 ) -> None:
-    loaddata_writer = csv.writer(f, delimiter=",", quoting=csv.QUOTE_MINIMAL)
-
     # Setup metadata headers
     metadata_heads = [
         f"Metadata_{col}" for col in ["Batch", "Plate", "Site", "Well", "Cycle"]
     ]
 
+    # Index channels stored in the frame of each LoadData channel
+    frame_channels = {ch: [ch] for ch in plate_channel_list}
     if use_legacy:
         # Load experiment config
         exp_config = json.loads(exp_config_path.read_text())
@@ -85,50 +87,84 @@ def write_loaddata_illum_calc(
         plate_channel_list = [
             legacy_channel_map[ch] for ch in plate_channel_list
         ]
+        frame_channels = {
+            legacy_ch: [
+                ch for ch, v in legacy_channel_map.items() if v == legacy_ch
+            ]
+            for legacy_ch in plate_channel_list
+        }
 
     # Setup FileName, PathName and FrameName headers
     filename_heads = [f"FileName_Orig{ch}" for ch in plate_channel_list]
     frame_heads = [f"Frame_Orig{ch}" for ch in plate_channel_list]
     pathname_heads = [f"PathName_Orig{ch}" for ch in plate_channel_list]
 
-    # Write the headers first
-    loaddata_writer.writerow(
-        [*metadata_heads, *filename_heads, *frame_heads, *pathname_heads]
+    # Build all the rows from the index in one go
+    write_loaddata_csv(
+        images_df,
+        [*metadata_heads, *filename_heads, *frame_heads, *pathname_heads],
+        [
+            # Metadata heads
+            pl.col("batch_id"),
+            pl.col("plate_id"),
+            pl.col("site_id"),
+            pl.col("well_id"),
+            pl.col("cycle_id").replace("", None).fill_null("0"),
+            # Filename heads
+            *[pl.col("filename") for _ in filename_heads],
+            # Frame heads, matched with their order in the filenames
+            *[
+                frame_index_expr(frame_channels[ch])
+                for ch in plate_channel_list
+            ],
+            # Pathname heads, the file name removed from the "key"
+            # (expected by cellprofiler)
+            *[key_dir_expr(path_mask) for _ in pathname_heads],
+        ],
+        f,
     )
 
-    # Iterate over index and add all the files
-    for index in images_df.collect().to_dicts():
-        index = PCPIndex(**index)
-        assert index.channel_dict is not None
-        if use_legacy:
-            index.channel_dict = [
-                legacy_channel_map[ch] for ch in index.channel_dict
-            ]
-        # make sure frame heads are matched with their order in the filenames
-        frame_index = [
-            index.channel_dict.index(ch) for ch in plate_channel_list
-        ]
-        assert index.key is not None
-        loaddata_writer.writerow(
-            [
-                # Metadata heads
-                index.batch_id,
-                index.plate_id,
-                index.site_id,
-                index.well_id,
-                index.cycle_id or 0,
-                # Filename heads
-                *[f"{index.filename}" for _ in range(len(filename_heads))],
-                # Frame heads
-                *[str(i) for i in frame_index],
-                # Pathname heads
-                *[
-                    # We need to remove the file name from the "key"
-                    # (expected by cellprofiler)
-                    f"{path_mask.rstrip('/')}/{'/'.join(index.key.split('/')[0:-1])}/"
-                    for _ in range(len(pathname_heads))
-                ],
-            ]
+
+def write_level_loaddata(
+    level: list[str],
+    level_df: pl.LazyFrame,
+    out_path: Path | CloudPath,
+    path_mask: str,
+    use_legacy: bool = False,
+    exp_config_path: Path | CloudPath | None = None,
+) -> None:
+    """Write the illum calc LoadData of a unit of work.
+
+    Parameters
+    ----------
+    level : list[str]
+        Level values of the unit of work.
+    level_df : pl.LazyFrame
+        Images of the unit of work.
+    out_path : Path | CloudPath
+        Path to the LoadData directory.
+    path_mask : str
+        Path prefix mask to use.
+    use_legacy : bool
+        Use legacy cppipe and loaddata.
+    exp_config_path : Path | CloudPath
+        Path to experiment config json path.
+
+    """
+    # Setup channel list for this level
+    plate_channel_list = get_channels_from_df(level_df)
+
+    # Construct filename for the loaddata csv
+    level_out_path = out_path.joinpath(f"{'^'.join(level)}#illum_calc.csv")
+
+    with level_out_path.open("w") as f:
+        write_loaddata_illum_calc(
+            level_df,
+            plate_channel_list,
+            path_mask,
+            f,
+            use_legacy,
+            exp_config_path,
         )
 
 
@@ -141,6 +177,7 @@ def gen_illum_calc_load_data(
     exp_config_path: Path | CloudPath | None = None,
     uow_hierarchy: list[str] = None,
     clean: bool = True,
+    jobs: int = 1,
 ) -> Path | CloudPath:
     """Generate load data for illum calc pipeline.
 
@@ -161,7 +198,9 @@ def gen_illum_calc_load_data(
     uow_hierarchy : list[str] | None
         Unit of work list
     clean: bool
-        Clean output directory
+        Remove stale files from the output directory.
+    jobs : int
+        Number of parallel jobs to use.
 
     Returns
     -------
@@ -175,18 +214,13 @@ def gen_illum_calc_load_data(
     This modules generates load data for the illum calculate step of the pipeline.
 
     """
-    if clean:
-        # clean output directory
-        clean_directory(out_path)
-
-    # Load index
-    df = pl.scan_parquet(index_path.resolve().__str__())
-
-    # Filter for relevant images
-    images_df = filter_images(df, for_sbs)
+    # Load relevant images, shared by the stages run in this process
+    images_df = load_images(index_path, for_sbs)
 
     # Query default path prefix
-    default_path_prefix = get_default_path_prefix(images_df)
+    default_path_prefix = get_default_path_prefix(
+        images_df.lazy(), index_path, for_sbs
+    )
 
     # Setup path mask (required for resolving pathnames during the execution)
     if path_mask is None:
@@ -195,35 +229,23 @@ def gen_illum_calc_load_data(
     # Setup chunking and write loaddata for parallel processing
     if not for_sbs:
         uow_hierarchy = uow_hierarchy or ["batch_id", "plate_id"]
-        images_hierarchy_dict = gen_image_hierarchy(images_df, uow_hierarchy)
     else:
         uow_hierarchy = uow_hierarchy or [
             "batch_id",
             "plate_id",
             "cycle_id",
         ]
-        images_hierarchy_dict = gen_image_hierarchy(images_df, uow_hierarchy)
-    levels = flatten_all(images_hierarchy_dict)
-
-    for level in levels:
-        # setup filtered df for chunked levels
-        levels_df = filter_df_by_hierarchy(images_df, level, for_sbs)
-
-        # Setup channel list for this level
-        plate_channel_list = get_channels_from_df(levels_df)
-
-        # Construct filename for the loaddata csv
-        level_out_path = out_path.joinpath(f"{'^'.join(level)}#illum_calc.csv")
-
-        with level_out_path.open("w") as f:
-            write_loaddata_illum_calc(
-                levels_df,
-                plate_channel_list,
-                path_mask,
-                f,
-                use_legacy,
-                exp_config_path,
-            )
+    write_loaddata_levels(
+        images_df,
+        uow_hierarchy,
+        write_level_loaddata,
+        jobs=jobs,
+        clean=clean,
+        out_path=out_path,
+        path_mask=path_mask,
+        use_legacy=use_legacy,
+        exp_config_path=exp_config_path,
+    )
     return out_path
 
 
@@ -406,37 +428,42 @@ def gen_illum_calc_cppipe(
     # Default run dir should already be present, otherwise CP raises an error
     out_dir.mkdir(exist_ok=True, parents=True)
 
-    # Get all the generated load data files by batch
-    if not for_sbs:
-        type_suffix = "painting"
-    else:
-        type_suffix = "sbs"
-
-    filename = f"illum_calc_{type_suffix}.cppipe"
-
-    # Write old cppipe and return early if use_old is true
-    if use_legacy:
+    with staged_directory(out_dir, delete=False) as staging_dir:
+        # Get all the generated load data files by batch
         if not for_sbs:
-            ref_cppipe = get_templates_path() / "cppipe/ref_1_CP_Illum.cppipe"
+            type_suffix = "painting"
         else:
-            ref_cppipe = get_templates_path() / "cppipe/ref_5_BC_Illum.cppipe"
-
-        out_dir.joinpath(filename).write_text(ref_cppipe.read_text())
-        return
+            type_suffix = "sbs"
 
-    # get one of the load data for generating cpipe
-    sample_loaddata_file = next(load_data_path.rglob("*.csv"))
-
-    with CellProfilerContext(out_dir=workspace_path) as cpipe:
-        cpipe = generate_illum_calculate_pipeline(
-            cpipe, sample_loaddata_file, for_sbs
-        )
         filename = f"illum_calc_{type_suffix}.cppipe"
-        with out_dir.joinpath(filename).open("w") as f:
-            cpipe.dump(f)
-        filename = f"illum_calc_{type_suffix}.json"
-        with out_dir.joinpath(filename).open("w") as f:
-            dumpit(cpipe, f, version=6)
+
+        # Write old cppipe and return early if use_old is true
+        if use_legacy:
+            if not for_sbs:
+                ref_cppipe = (
+                    get_templates_path() / "cppipe/ref_1_CP_Illum.cppipe"
+                )
+            else:
+                ref_cppipe = (
+                    get_templates_path() / "cppipe/ref_5_BC_Illum.cppipe"
+                )
+
+            staging_dir.joinpath(filename).write_text(ref_cppipe.read_text())
+            return
+
+        # get one of the load data for generating cpipe
+        sample_loaddata_file = next(load_data_path.rglob("*.csv"))
+
+        with CellProfilerContext(out_dir=workspace_path) as cpipe:
+            cpipe = generate_illum_calculate_pipeline(
+                cpipe, sample_loaddata_file, for_sbs
+            )
+            filename = f"illum_calc_{type_suffix}.cppipe"
+            with staging_dir.joinpath(filename).open("w") as f:
+                cpipe.dump(f)
+            filename = f"illum_calc_{type_suffix}.json"
+            with staging_dir.joinpath(filename).open("w") as f:
+                dumpit(cpipe, f, version=6)
 
 
 def write_qc_notebook(
@@ -1,20 +1,78 @@
 """Inventory -> [path parser] -> Index."""
 
+import logging
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
 from pathlib import Path
+from tempfile import TemporaryDirectory
 from typing import Annotated
 
 import polars as pl
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from cloudpathlib import CloudPath
 from lark import Lark
 from pydantic import BaseModel, BeforeValidator, Field
 from tqdm import tqdm
 
-from starrynight.algorithms.inventory import FileInventory
-from starrynight.parsers.common import BaseTransformer
-from starrynight.utils.misc import write_pq
+from starrynight.algorithms.inventory import (
+    BASE_INVENTORY_ID_KEY,
+    INVENTORY_ID_KEY,
+    FileInventory,
+    get_inventory_id,
+    randomword,
+    scan_inventory,
+)
+from starrynight.parsers.common import BaseTransformer, DirectoryCachedParser
+from starrynight.parsers.regex_fast_path import RegexFastPath
+from starrynight.utils.dfutils import (
+    INDEX_CATEGORICAL_COLS,
+    INDEX_NUM_COLS,
+    INDEX_SCHEMA_VERSION,
+    INDEX_SCHEMA_VERSION_KEY,
+    get_index_schema_version,
+    parse_index_num,
+    read_index_summary,
+    with_index_num_cols,
+    write_index_summary,
+)
+from starrynight.utils.misc import (
+    PQ_ROW_GROUP_SIZE,
+    ParquetSink,
+    PartitionedParquetSink,
+    read_pq_metadata,
+    replace_path,
+)
+from starrynight.utils.py_to_pa import get_pyarrow_schema
 
 IMG_FORMATS = ["tiff", "tif", "ndff", "jpeg", "png"]
 
+# Columns the partitioned index is split on
+INDEX_PARTITION_COLS = ["batch_id", "plate_id", "cycle_id"]
+
+# Columns each partition of the index is sorted on
+INDEX_SORT_COLS = ["well_id", "site_id"]
+
+# Number of inventory rows parsed at a time
+INDEX_CHUNK_SIZE = 50_000
+
+# Column paths of the index written with Parquet dictionary encoding.
+# Unique columns like keys and filenames are left plain.
+INDEX_DICTIONARY_COLS = [
+    "channel_dict.list.element" if col == "channel_dict" else col
+    for col in INDEX_CATEGORICAL_COLS
+] + list(INDEX_NUM_COLS)
+
+
+def parse_id_num(v: str | None) -> int | None:
+    """Parse a zero padded ID to an integer, e.g. `0012` -> 12.
+
+    Mirrors `parse_index_num`, IDs that are not plain digits give None.
+    """
+    return int(v) if v is not None and v.isascii() and v.isdigit() else None
+
 
 class PCPIndex(BaseModel):
     """Pooled CellPainting Index.
@@ -36,6 +94,8 @@ class PCPIndex(BaseModel):
     is_sbs_image : Is this file an SBS image?
     is_image : Is this file an image?
     is_dir : Is this file a directory?
+    site_num : File site number, parsed from the site ID.
+    cycle_num : File cycle number, parsed from the cycle ID.
 
     """
 
@@ -66,6 +126,12 @@ class PCPIndex(BaseModel):
     is_dir: Annotated[bool, BeforeValidator(lambda v: not bool(v))] = Field(
         validation_alias="extension", default=True
     )
+    site_num: Annotated[int | None, BeforeValidator(parse_id_num)] = Field(
+        validation_alias="site_id", default=None
+    )
+    cycle_num: Annotated[int | None, BeforeValidator(parse_id_num)] = Field(
+        validation_alias="cycle_id", default=None
+    )
 
 
 class OutputIndex(PCPIndex):
@@ -75,9 +141,25 @@ class OutputIndex(PCPIndex):
     channel_id: str | None = None
 
 
+class UnparsedKey(BaseModel):
+    """Inventory key that could not be parsed.
+
+    Attributes
+    ----------
+    key : File location.
+    prefix : Default prefix for the file.
+    error : Parsing error.
+
+    """
+
+    key: str
+    prefix: str | None = None
+    error: str
+
+
 def ast_to_pcp_index(
     parsed_inv: FileInventory,
-    path_parser: Lark,
+    path_parser: Lark | DirectoryCachedParser,
     ast_transformer: type[BaseTransformer],
 ) -> PCPIndex:
     """Create PCPIndex from AST.
@@ -86,7 +168,7 @@ def ast_to_pcp_index(
     ----------
     parsed_inv : FileInventory
         Parsed inventory.
-    path_parser : Lark
+    path_parser : Lark | DirectoryCachedParser
         Path parser.
     ast_transformer : type[BaseTransformer]
         AST transformer.
@@ -122,14 +204,448 @@ def ast_to_pcp_index(
     )
 
 
+def fast_path_pcp_index(
+    inv_df: pl.DataFrame, fast_path: RegexFastPath
+) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """Create PCPIndex rows with the regex fast path.
+
+    Mirrors `ast_to_pcp_index` on whole columns. Rows that would fail its
+    checks are returned with the unmatched rows, to go through Lark.
+
+    Parameters
+    ----------
+    inv_df : pl.DataFrame
+        Inventory rows, with their position in a `row_idx` column.
+    fast_path : RegexFastPath
+        Regex fast path of the path parser.
+
+    Returns
+    -------
+    tuple[pl.DataFrame, pl.DataFrame]
+        PCPIndex rows with their `row_idx`, and the inventory rows left to
+        Lark.
+
+    """
+    fields_df, _ = fast_path.parse(inv_df["key"])
+    fields_df = fields_df.with_columns(
+        inv_df["row_idx"].gather(fields_df["row_idx"]).alias("row_idx")
+    )
+    # Fields set by the index itself are rejected by `ast_to_pcp_index`
+    fields_df = fields_df.rename({"channel_dict": "_channels"})
+    reserved = [
+        col
+        for col in ["key", "prefix", "filename", "channel_dict"]
+        if col in fields_df.columns
+    ]
+    if reserved:
+        fields_df = fields_df.filter(
+            pl.all_horizontal(pl.col(reserved).is_null())
+        )
+    df = inv_df.join(fields_df.drop(reserved), on="row_idx", how="inner")
+    if "extension" in fields_df.columns:
+        extension = pl.col("extension_right")
+        df = df.filter(
+            extension.is_null()
+            | extension.eq("")
+            | pl.col("extension")
+            .str.replace_all(".", "", literal=True)
+            .eq(extension)
+        )
+    else:
+        extension = pl.lit(None, pl.String)
+
+    schema = get_pyarrow_schema(PCPIndex)
+    has_extension = extension.is_not_null()
+    index_df = df.select(
+        "row_idx",
+        *[
+            (
+                pl.col(name) if name in df.columns else pl.lit(None, pl.String)
+            ).alias(name)
+            for name in [
+                "key",
+                "prefix",
+                "dataset_id",
+                "batch_id",
+                "plate_id",
+                "cycle_id",
+                "magnification",
+                "well_id",
+                "site_id",
+            ]
+        ],
+        pl.col("_channels").alias("channel_dict"),
+        pl.col("filename"),
+        extension.alias("extension"),
+        # Flags are only validated when the parse tree has an extension
+        pl.when(has_extension)
+        .then(
+            extension.is_in(IMG_FORMATS) & pl.col("cycle_id").is_not_null()
+            if "cycle_id" in df.columns
+            else pl.lit(False)
+        )
+        .otherwise(False)
+        .alias("is_sbs_image"),
+        pl.when(has_extension)
+        .then(extension.is_in(IMG_FORMATS))
+        .otherwise(False)
+        .alias("is_image"),
+        pl.when(has_extension)
+        .then(extension.eq(""))
+        .otherwise(True)
+        .alias("is_dir"),
+        *[
+            (
+                parse_index_num(id_col)
+                if id_col in df.columns
+                else pl.lit(None, pl.Int64)
+            ).alias(num_col)
+            for num_col, id_col in INDEX_NUM_COLS.items()
+        ],
+    )
+    rest_df = inv_df.filter(
+        ~pl.col("row_idx").is_in(index_df["row_idx"].implode())
+    )
+    return index_df.select("row_idx", *schema.names), rest_df
+
+
+def get_fast_path(
+    path_parser: Lark, ast_transformer: type[BaseTransformer]
+) -> RegexFastPath | None:
+    """Compile the regex fast path of a parser, if possible.
+
+    Parameters
+    ----------
+    path_parser : Lark
+        Path parser.
+    ast_transformer : type[BaseTransformer]
+        AST transformer.
+
+    Returns
+    -------
+    RegexFastPath | None
+        Regex fast path. None for grammars it cannot compile.
+
+    """
+    if not isinstance(path_parser, Lark):
+        return None
+    try:
+        return RegexFastPath(path_parser, ast_transformer)
+    except Exception as e:
+        logging.warning(f"Regex fast path disabled: {e}")
+        return None
+
+
+def get_directory_parser(path_parser: Lark) -> Lark | DirectoryCachedParser:
+    """Cache the directory prefix parses of a parser, if possible.
+
+    Parameters
+    ----------
+    path_parser : Lark
+        Path parser.
+
+    Returns
+    -------
+    Lark | DirectoryCachedParser
+        Parser with a directory cache, or the path parser for grammars that
+        cannot be resumed at a directory boundary.
+
+    """
+    if not isinstance(path_parser, Lark):
+        return path_parser
+    try:
+        return DirectoryCachedParser(path_parser)
+    except Exception as e:
+        logging.warning(f"Directory parse cache disabled: {e}")
+        return path_parser
+
+
+def parse_inventory(
+    inv_df: pl.DataFrame,
+    path_parser: Lark | DirectoryCachedParser,
+    ast_transformer: type[BaseTransformer],
+    regex_fast_path: RegexFastPath | None = None,
+) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """Create PCPIndex rows for inventory rows.
+
+    Parameters
+    ----------
+    inv_df : pl.DataFrame
+        Inventory rows.
+    path_parser : Lark | DirectoryCachedParser
+        Path parser.
+    ast_transformer : type[BaseTransformer]
+        AST transformer.
+    regex_fast_path : RegexFastPath | None
+        Regex fast path to parse image keys with before Lark.
+
+    Returns
+    -------
+    tuple[pl.DataFrame, pl.DataFrame]
+        PCPIndex rows in inventory order, and the `UnparsedKey` rows of the
+        keys that could not be parsed.
+
+    """
+    inv_df = inv_df.with_row_index("row_idx")
+    if regex_fast_path is None:
+        index_df = None
+    else:
+        index_df, inv_df = fast_path_pcp_index(inv_df, regex_fast_path)
+    parsed_index, row_idxs, errors = [], [], []
+    for row in inv_df.to_dicts():
+        row_idx = row.pop("row_idx")
+        try:
+            parsed_index.append(
+                ast_to_pcp_index(
+                    FileInventory(**row), path_parser, ast_transformer
+                ).model_dump()
+            )
+            row_idxs.append(row_idx)
+        except Exception as e:
+            errors.append(
+                {
+                    "key": row["key"],
+                    "prefix": row.get("prefix"),
+                    "error": repr(e),
+                }
+            )
+
+    schema = get_pyarrow_schema(PCPIndex)
+    lark_df = pl.from_arrow(
+        pa.Table.from_pylist(parsed_index, schema=schema)
+    ).with_columns(row_idx=pl.Series(row_idxs, dtype=pl.UInt32))
+    if index_df is not None:
+        # Keep the inventory order
+        lark_df = pl.concat(
+            [index_df, lark_df.select(index_df.columns)],
+            how="vertical_relaxed",
+        ).sort("row_idx")
+    errors_df = pl.from_arrow(
+        pa.Table.from_pylist(errors, schema=get_pyarrow_schema(UnparsedKey))
+    )
+    return lark_df.drop("row_idx"), errors_df
+
+
+# Parser state of an index worker process
+_worker_parser: dict = {}
+
+
+def init_index_worker(
+    grammar: str,
+    options: dict,
+    ast_transformer: type[BaseTransformer],
+    fast_path: bool,
+) -> None:
+    """Create the parser of an index worker process.
+
+    Lark parsers cannot be pickled, so every worker builds its own from the
+    grammar source.
+
+    Parameters
+    ----------
+    grammar : str
+        Source of the path parser grammar.
+    options : dict
+        Options of the path parser.
+    ast_transformer : type[BaseTransformer]
+        AST transformer.
+    fast_path : bool
+        Parse image keys with the regex fast path.
+
+    """
+    path_parser = Lark(grammar, **options)
+    _worker_parser["path_parser"] = get_directory_parser(path_parser)
+    _worker_parser["ast_transformer"] = ast_transformer
+    _worker_parser["regex_fast_path"] = (
+        get_fast_path(path_parser, ast_transformer) if fast_path else None
+    )
+
+
+def gen_index_shard(
+    inv_df: pl.DataFrame, shard_path: Path
+) -> tuple[int, pl.DataFrame]:
+    """Write the PCPIndex rows of an inventory chunk to a shard.
+
+    Runs in an index worker process, see `init_index_worker`.
+
+    Parameters
+    ----------
+    inv_df : pl.DataFrame
+        Inventory chunk.
+    shard_path : Path
+        Path to save the shard.
+
+    Returns
+    -------
+    tuple[int, pl.DataFrame]
+        Number of inventory rows processed, and the `UnparsedKey` rows of the
+        keys that could not be parsed.
+
+    """
+    index_df, errors_df = parse_inventory(inv_df, **_worker_parser)
+    with ParquetSink(shard_path, PCPIndex) as sink:
+        sink.write(index_df)
+    return len(inv_df), errors_df
+
+
+def write_pcp_index(
+    df: pl.DataFrame,
+    sink: ParquetSink | PartitionedParquetSink,
+    errors_sink: ParquetSink,
+    path_parser: Lark,
+    ast_transformer: type[BaseTransformer],
+    fast_path: bool = True,
+    jobs: int = 1,
+    chunk_size: int = INDEX_CHUNK_SIZE,
+) -> int:
+    """Parse inventory rows into PCPIndex sinks.
+
+    Parameters
+    ----------
+    df : pl.DataFrame
+        Inventory rows.
+    sink : ParquetSink | PartitionedParquetSink
+        Sink of the PCPIndex rows.
+    errors_sink : ParquetSink
+        Sink of the `UnparsedKey` rows.
+    path_parser : Lark
+        Path parser.
+    ast_transformer : type[BaseTransformer]
+        AST transformer.
+    fast_path : bool
+        Parse image keys with the regex fast path.
+    jobs : int
+        Number of worker processes to use.
+    chunk_size : int
+        Number of inventory rows parsed at a time.
+
+    Returns
+    -------
+    int
+        Number of keys that could not be parsed.
+
+    """
+    progress = tqdm(
+        total=len(df), desc="Generating Index", unit="rows", unit_scale=True
+    )
+    num_errors = 0
+    with progress:
+        if jobs <= 1:
+            regex_fast_path = (
+                get_fast_path(path_parser, ast_transformer)
+                if fast_path
+                else None
+            )
+            directory_parser = get_directory_parser(path_parser)
+            for batch in df.iter_slices(chunk_size):
+                index_df, errors_df = parse_inventory(
+                    batch, directory_parser, ast_transformer, regex_fast_path
+                )
+                sink.write(index_df)
+                errors_sink.write(errors_df)
+                num_errors += len(errors_df)
+                progress.update(len(batch))
+        else:
+            with (
+                TemporaryDirectory() as shard_dir,
+                ProcessPoolExecutor(
+                    jobs,
+                    # Forked polars thread pools can deadlock
+                    mp_context=get_context("spawn"),
+                    initializer=init_index_worker,
+                    initargs=(
+                        path_parser.source_grammar,
+                        path_parser.options.options,
+                        ast_transformer,
+                        fast_path,
+                    ),
+                ) as executor,
+            ):
+                shard_paths = []
+                futures = []
+                for idx, batch in enumerate(df.iter_slices(chunk_size)):
+                    shard_paths.append(
+                        Path(shard_dir).joinpath(f"index_{idx}.parquet")
+                    )
+                    futures.append(
+                        executor.submit(gen_index_shard, batch, shard_paths[-1])
+                    )
+                for future in as_completed(futures):
+                    num_rows, errors_df = future.result()
+                    errors_sink.write(errors_df)
+                    num_errors += len(errors_df)
+                    progress.update(num_rows)
+                # Shards are merged in inventory order
+                for shard_path in shard_paths:
+                    for batch in pq.ParquetFile(shard_path).iter_batches(
+                        PQ_ROW_GROUP_SIZE
+                    ):
+                        sink.write(batch)
+    return num_errors
+
+
+def get_index_sink(
+    index_path: Path | CloudPath, partition: bool
+) -> ParquetSink | PartitionedParquetSink:
+    """Open the sink of an index.
+
+    Parameters
+    ----------
+    index_path : Path | CloudPath
+        Path to the index file or dataset. Can be local or a cloud path.
+    partition : bool
+        Write a partitioned dataset instead of a single file.
+
+    Returns
+    -------
+    ParquetSink | PartitionedParquetSink
+        Index sink.
+
+    """
+    schema = get_pyarrow_schema(PCPIndex).with_metadata(
+        {INDEX_SCHEMA_VERSION_KEY: str(INDEX_SCHEMA_VERSION)}
+    )
+    if partition:
+        return PartitionedParquetSink(
+            index_path,
+            schema,
+            INDEX_PARTITION_COLS,
+            INDEX_SORT_COLS,
+            use_dictionary=INDEX_DICTIONARY_COLS,
+        )
+    return ParquetSink(index_path, schema, use_dictionary=INDEX_DICTIONARY_COLS)
+
+
 def gen_pcp_index(
     inv_path: Path | CloudPath,
     out_path: Path | CloudPath,
     path_parser: Lark,
     ast_tansformer: type[BaseTransformer],
+    partition: bool = False,
+    fast_path: bool = True,
+    jobs: int = 1,
+    chunk_size: int = INDEX_CHUNK_SIZE,
 ) -> None:
     """Create PCPIndex from inventory.
 
+    With `partition`, `index.parquet` is written as a Hive-partitioned
+    dataset directory split on batch, plate and cycle (CP images go to the
+    null cycle partition), with every partition sorted on
+    `INDEX_SORT_COLS`. Filters on the hierarchy then only read the matching
+    files. Use `scan_index` to read either layout.
+
+    With `fast_path`, keys matching the image rules of the grammar are
+    parsed with the regexes compiled by `RegexFastPath` and only the
+    others go through Lark. Rows are the same either way.
+
+    With more than one job, chunks of the inventory are parsed by a pool of
+    worker processes, each with its own parser, into local shards that are
+    then streamed into the index in inventory order.
+
+    Keys that cannot be parsed are written to `index_errors.parquet`, and a
+    summary of the index used to configure experiments to
+    `index_summary.json`.
+
     Parameters
     ----------
     inv_path : Path | CloudPath
@@ -140,24 +656,373 @@ def gen_pcp_index(
         Path parser.
     ast_tansformer : type[BaseTransformer]
         AST transformer.
+    partition : bool
+        Write a partitioned dataset instead of a single file.
+    fast_path : bool
+        Parse image keys with the regex fast path.
+    jobs : int
+        Number of worker processes to use.
+    chunk_size : int
+        Number of inventory rows parsed at a time.
 
     """
     df = pl.read_parquet(inv_path.resolve().__str__())
-    parsed_index = {
-        key: [] for key in PCPIndex.model_construct().model_fields.keys()
-    }
-    for batch in tqdm(
-        df.iter_slices(), total=len(df) // 10000, desc="Generating Index"
+    inventory_id = get_inventory_id(inv_path)
+    index_path = out_path.joinpath("index.parquet")
+    errors_path = out_path.joinpath("index_errors.parquet")
+    # The index of the previous run, a file or a dataset, is only replaced
+    # once the new one is complete
+    suffix = randomword(10)
+    staging_path = out_path.joinpath(f".index_{suffix}.parquet")
+    staging_errors_path = out_path.joinpath(f".index_errors_{suffix}.parquet")
+    sink = get_index_sink(staging_path, partition)
+    errors_sink = ParquetSink(staging_errors_path, UnparsedKey)
+    with sink, errors_sink:
+        num_errors = write_pcp_index(
+            df,
+            sink,
+            errors_sink,
+            path_parser,
+            ast_tansformer,
+            fast_path,
+            jobs,
+            chunk_size,
+        )
+    replace_path(staging_path, index_path)
+    replace_path(staging_errors_path, errors_path)
+    write_index_summary(index_path, inventory_id)
+    if num_errors > 0:
+        logging.warning(
+            f"Unable to parse {num_errors} keys, see index_errors.parquet"
+        )
+
+
+def iter_index_batches(index_path: Path | CloudPath) -> Iterator[pa.Table]:
+    """Stream the row groups of an index file or partitioned dataset.
+
+    Parameters
+    ----------
+    index_path : Path | CloudPath
+        Path to index. Can be local or a cloud path.
+
+    Yields
+    ------
+    pa.Table
+        Rows of one row group.
+
+    """
+    if index_path.is_dir():
+        files = sorted(index_path.rglob("*.parquet"))
+    else:
+        files = [index_path]
+    for file in files:
+        with file.open("rb") as f:
+            index_file = pq.ParquetFile(f)
+            for idx in range(index_file.num_row_groups):
+                yield index_file.read_row_group(idx)
+
+
+def get_delta_inventory_id(
+    index_path: Path | CloudPath,
+    inv_path: Path | CloudPath,
+    delta_path: Path | CloudPath,
+) -> str | None:
+    """Check that an inventory delta applies to an index.
+
+    Parameters
+    ----------
+    index_path : Path | CloudPath
+        Path to index. Can be local or a cloud path.
+    inv_path : Path | CloudPath
+        Path to inventory. Can be local or a cloud path.
+    delta_path : Path | CloudPath
+        Path to the inventory delta. Can be local or a cloud path.
+
+    Returns
+    -------
+    str | None
+        Id of the current inventory if the delta was computed against the
+        inventory of the index and leads to the current inventory, None
+        otherwise.
+
+    """
+    summary = read_index_summary(index_path) or {}
+    delta_metadata = read_pq_metadata(delta_path)
+    index_inventory_id = summary.get("inventory_id")
+    inventory_id = get_inventory_id(inv_path)
+    if (
+        index_inventory_id is None
+        or inventory_id is None
+        or delta_metadata.get(BASE_INVENTORY_ID_KEY) != index_inventory_id
+        or delta_metadata.get(INVENTORY_ID_KEY) != inventory_id
     ):
-        row_dicts = batch.to_dicts()
-        for row in row_dicts:
-            try:
-                pdict = ast_to_pcp_index(
-                    FileInventory(**row), path_parser, ast_tansformer
-                ).model_dump()
-                for k, v in pdict.items():
-                    parsed_index[k].append(v)
+        return None
+    return inventory_id
+
+
+def update_pcp_index(
+    inv_path: Path | CloudPath,
+    delta_path: Path | CloudPath,
+    out_path: Path | CloudPath,
+    path_parser: Lark,
+    ast_tansformer: type[BaseTransformer],
+    partition: bool = False,
+    fast_path: bool = True,
+    jobs: int = 1,
+    chunk_size: int = INDEX_CHUNK_SIZE,
+) -> None:
+    """Update a PCPIndex with an inventory delta.
+
+    Only the keys added since the previous inventory are parsed, and the
+    rows of removed keys are dropped. Changed files keep their rows, as
+    index fields only depend on the key. The updated index, in the same
+    layout as the previous one, and its errors table are written next to
+    them and then swapped in with `replace_path`, so readers see either
+    the previous or the updated index. The summary of the index is then
+    rewritten, readers ignore it until then as its row count is stale.
+
+    The delta is only applied if it was computed against the inventory of
+    the index, as recorded in its summary, and if it leads to the current
+    inventory. Otherwise, e.g. after a full inventory run or two incremental
+    runs without an index update, the index is generated again in full.
+
+    Parameters
+    ----------
+    inv_path : Path | CloudPath
+        Path to inventory. Can be local or a cloud path.
+    delta_path : Path | CloudPath
+        Path to the inventory delta. Can be local or a cloud path.
+    out_path : Path | CloudPath
+        Path of the index to update. Can be local or a cloud path.
+    path_parser : Lark
+        Path parser.
+    ast_tansformer : type[BaseTransformer]
+        AST transformer.
+    partition : bool
+        Write a partitioned dataset if there is no previous index. Updated
+        indexes keep their layout.
+    fast_path : bool
+        Parse image keys with the regex fast path.
+    jobs : int
+        Number of worker processes to use.
+    chunk_size : int
+        Number of inventory rows parsed at a time.
+
+    """
+    index_path = out_path.joinpath("index.parquet")
+    errors_path = out_path.joinpath("index_errors.parquet")
+    inventory_id = None
+    if not index_path.exists():
+        print("No previous index found. Creating full index...")
+    else:
+        inventory_id = get_delta_inventory_id(index_path, inv_path, delta_path)
+        if inventory_id is None:
+            print(
+                "Inventory delta does not match the index. Creating full index..."
+            )
+            # Keep the layout of the previous index
+            partition = index_path.is_dir()
+    if inventory_id is None:
+        gen_pcp_index(
+            inv_path,
+            out_path,
+            path_parser,
+            ast_tansformer,
+            partition,
+            fast_path=fast_path,
+            jobs=jobs,
+            chunk_size=chunk_size,
+        )
+        return
+    delta = pl.read_parquet(delta_path.resolve().__str__())
+    added = delta.filter(pl.col("change").eq("added"))["key"]
+    # Re-added keys replace their previous rows
+    stale_keys = pa.array(
+        delta.filter(pl.col("change").is_in(["added", "removed"]))["key"],
+        pa.string(),
+    )
+    df = (
+        scan_inventory(inv_path)
+        .filter(pl.col("key").is_in(added.implode()))
+        .collect()
+    )
+    print(
+        f"Index delta: {len(df)} keys to parse,"
+        f" {len(delta) - len(added)} removed or changed"
+    )
 
-            except Exception as e:
-                print(f"Unable to parse: {row} because of {e}")
-    write_pq(parsed_index, PCPIndex, out_path.joinpath("index.parquet"))
+    suffix = randomword(10)
+    staging_path = out_path.joinpath(f".index_{suffix}.parquet")
+    staging_errors_path = out_path.joinpath(f".index_errors_{suffix}.parquet")
+    sink = get_index_sink(staging_path, index_path.is_dir())
+    errors_sink = ParquetSink(staging_errors_path, UnparsedKey)
+    schema_version = get_index_schema_version(index_path)
+    with sink, errors_sink:
+        for batch in iter_index_batches(index_path):
+            batch = batch.filter(pc.invert(pc.is_in(batch["key"], stale_keys)))
+            # Indexes written before the integer columns get them added
+            sink.write(
+                with_index_num_cols(pl.from_arrow(batch), schema_version)
+            )
+        if errors_path.exists():
+            for batch in iter_index_batches(errors_path):
+                errors_sink.write(
+                    batch.filter(pc.invert(pc.is_in(batch["key"], stale_keys)))
+                )
+        num_errors = write_pcp_index(
+            df,
+            sink,
+            errors_sink,
+            path_parser,
+            ast_tansformer,
+            fast_path,
+            jobs,
+            chunk_size,
+        )
+    replace_path(staging_path, index_path)
+    replace_path(staging_errors_path, errors_path)
+    write_index_summary(index_path, inventory_id)
+    if num_errors > 0:
+        logging.warning(
+            f"Unable to parse {num_errors} keys, see index_errors.parquet"
+        )
+
+
+# LoadData metadata columns of the output index site columns
+LOADDATA_SITE_COLS = {
+    "batch_id": "Metadata_Batch",
+    "plate_id": "Metadata_Plate",
+    "well_id": "Metadata_Well",
+    "site_id": "Metadata_Site",
+}
+
+OUTPUT_TEMPLATE_SCHEMA = {
+    "key": pl.String,
+    "filename": pl.String,
+    "cycle_id": pl.String,
+    "channel_id": pl.String,
+    "extension": pl.String,
+    "file_type": pl.String,
+}
+
+
+def gen_output_index(
+    loaddata_df: pl.DataFrame,
+    outputs: pl.DataFrame | list[dict],
+    prefix: str,
+) -> pl.DataFrame:
+    """Create OutputIndex rows for the outputs of every LoadData row.
+
+    The LoadData rows are crossed with the output templates in one join,
+    instead of validating a model per output file. The `key` and `filename`
+    templates are filled per row from the `{batch_id}`, `{plate_id}`,
+    `{well_id}` and `{site_id}` placeholders.
+
+    Parameters
+    ----------
+    loaddata_df : pl.DataFrame
+        LoadData rows, with the `Metadata_*` columns of the sites.
+    outputs : pl.DataFrame | list[dict]
+        Output templates of a row, with the columns of
+        `OUTPUT_TEMPLATE_SCHEMA`.
+    prefix : str
+        Prefix of the output keys.
+
+    Returns
+    -------
+    pl.DataFrame
+        OutputIndex rows, ordered by LoadData row then output template.
+
+    """
+    sites_df = loaddata_df.select(
+        (
+            pl.col(col).cast(pl.String)
+            if col in loaddata_df.columns
+            else pl.lit(None, pl.String)
+        ).alias(name)
+        for name, col in LOADDATA_SITE_COLS.items()
+    ).with_row_index("site_idx")
+    outputs_df = pl.DataFrame(outputs, schema=OUTPUT_TEMPLATE_SCHEMA)
+    # Built from python lists, as lists nulled by expressions keep their
+    # values, which pyarrow refuses to write to Parquet
+    outputs_df = outputs_df.with_columns(
+        pl.Series(
+            "channel_dict",
+            [
+                [channel] if channel is not None else None
+                for channel in outputs_df["channel_id"]
+            ],
+            dtype=pl.List(pl.String),
+        )
+    )
+    df = sites_df.join(
+        outputs_df.with_row_index("output_idx"), how="cross"
+    ).sort("site_idx", "output_idx")
+
+    def fill(template: str) -> pl.Expr:
+        expr = pl.col(template)
+        for name in LOADDATA_SITE_COLS:
+            # Unset values are formatted as in f-strings
+            expr = expr.str.replace_all(
+                f"{{{name}}}", pl.col(name).fill_null("None"), literal=True
+            )
+        return expr
+
+    extension = pl.col("extension")
+    index_df = df.select(
+        fill("key").alias("key"),
+        pl.lit(prefix, pl.String).alias("prefix"),
+        pl.lit(None, pl.String).alias("dataset_id"),
+        "batch_id",
+        "plate_id",
+        "cycle_id",
+        pl.lit(None, pl.String).alias("magnification"),
+        "well_id",
+        "site_id",
+        "channel_dict",
+        fill("filename").alias("filename"),
+        extension,
+        (extension.is_in(IMG_FORMATS) & pl.col("cycle_id").is_not_null())
+        .fill_null(False)
+        .alias("is_sbs_image"),
+        extension.is_in(IMG_FORMATS).fill_null(False).alias("is_image"),
+        extension.fill_null("").eq("").alias("is_dir"),
+        *[
+            parse_index_num(id_col).alias(num_col)
+            for num_col, id_col in INDEX_NUM_COLS.items()
+        ],
+        "file_type",
+        "channel_id",
+    )
+    return index_df.select(get_pyarrow_schema(OutputIndex).names)
+
+
+def write_loaddata_output_index(
+    loaddata_df: pl.DataFrame,
+    outputs: pl.DataFrame | list[dict],
+    prefix: str,
+    output_index_path: Path | CloudPath,
+) -> None:
+    """Write the output index of the outputs of every LoadData row.
+
+    Parameters
+    ----------
+    loaddata_df : pl.DataFrame
+        LoadData rows, with the `Metadata_*` columns of the sites.
+    outputs : pl.DataFrame | list[dict]
+        Output templates of a row, see `gen_output_index`.
+    prefix : str
+        Prefix of the output keys.
+    output_index_path : Path | CloudPath
+        Path to save the output index. (Including filename)
+
+    """
+    with ParquetSink(output_index_path, OutputIndex) as sink:
+        for offset in range(0, loaddata_df.height, INDEX_CHUNK_SIZE):
+            sink.write(
+                gen_output_index(
+                    loaddata_df.slice(offset, INDEX_CHUNK_SIZE),
+                    outputs,
+                    prefix,
+                )
+            )
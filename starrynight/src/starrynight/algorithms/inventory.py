@@ -3,17 +3,62 @@
 Provides functions to create inventory files.
 """
 
+import json
 import random
+import re
 import shutil
 import string
+from collections.abc import Iterable, Iterator
+from functools import reduce
+from itertools import chain, islice, takewhile
+from multiprocessing import cpu_count
 from pathlib import Path
+from urllib.parse import unquote_plus
+from uuid import uuid4
 
-from cloudpathlib import AnyPath, CloudPath
+import polars as pl
+import pyarrow as pa
+import pyarrow.compute as pc
+from cloudpathlib import AnyPath, CloudPath, S3Path
 from cpgdata.utils import parallel
+from pyarrow import parquet as pq
 from pydantic import BaseModel
 from tqdm import tqdm
 
-from starrynight.utils.misc import merge_pq, write_pq
+from starrynight.utils.globbing import (
+    FileStat,
+    list_dir,
+    scan_file_stats,
+    stat_file,
+)
+from starrynight.utils.misc import ParquetSink, merge_pq, read_pq_metadata
+from starrynight.utils.py_to_pa import get_pyarrow_schema
+
+# Number of files parsed and written per inventory shard
+INVENTORY_CHUNK_SIZE = 100_000
+
+# Max directory depth explored to split the dataset across workers
+# (dataset/source/batch/images/plate)
+MAX_SPLIT_DEPTH = 4
+
+# Columns used to detect changed files between inventories
+INVENTORY_STAT_COLS = ["size", "mtime", "etag"]
+
+# Parquet metadata keys with the id of an inventory, and in a delta the id
+# of the inventory it was computed against
+INVENTORY_ID_KEY = "starrynight.inventory_id"
+BASE_INVENTORY_ID_KEY = "starrynight.base_inventory_id"
+
+# Printable ASCII escapes of URL encoded keys, decoded without a Python UDF.
+# `+` is a space, and `%2B` a literal `+`.
+URL_ASCII_ESCAPES = {"+": " "} | {
+    escape: chr(code)
+    for code in range(0x20, 0x7F)
+    for escape in (f"%{code:02X}", f"%{code:02x}")
+}
+
+# Characters never URL encoded, see RFC 3986
+URL_UNRESERVED_CHARS = set(string.ascii_letters + string.digits + "-_.~")
 
 
 class FileInventory(BaseModel):
@@ -25,6 +70,9 @@ class FileInventory(BaseModel):
     filename : Filename.
     extension : File extension.
     prefix : prefix for the file.
+    size : File size in bytes.
+    mtime : File modification time in seconds since the epoch.
+    etag : File ETag. Only available for S3 paths.
 
     """
 
@@ -32,6 +80,9 @@ class FileInventory(BaseModel):
     filename: str
     extension: str
     prefix: str | None = None
+    size: int | None = None
+    mtime: float | None = None
+    etag: str | None = None
 
 
 def randomword(length: int) -> str:
@@ -53,16 +104,20 @@ def randomword(length: int) -> str:
 
 
 def parse_prefix(
-    prefix_list: list[CloudPath | Path],
+    prefix_list: list[CloudPath | Path] | list[FileStat],
     out_dir: CloudPath | Path,
     prefix: str,
     job_idx: int = 0,
+    stats: bool = False,
 ) -> None:
     """Parse prefix.
 
+    The inventory columns are computed in one go for the whole prefix list
+    with `gen_inventory_cols`.
+
     Parameters
     ----------
-    prefix_list : list[CloudPath | Path]
+    prefix_list : list[CloudPath | Path] | list[FileStat]
         List of prefix to parse.
     out_dir : CloudPath | Path
         Path to output dir.
@@ -70,39 +125,448 @@ def parse_prefix(
         Prefix to use.
     job_idx : int
         Index of job.
+    stats : bool
+        Whether the prefix list holds the resolved file stats yielded by
+        `scan_file_stats` instead of paths. Skips the per-file directory
+        check and path resolution, and fills the size, mtime and etag columns.
 
     """
-    col_dict = {key: [] for key in FileInventory.model_construct().model_fields.keys()}
+    paths, sizes, mtimes, etags = [], [], [], []
     for file in tqdm(prefix_list, desc="Writing inventory: ", position=job_idx):
-        if file.is_dir():
-            continue
-        parsed_local_file = FileInventory(
-            key=file.resolve().relative_to(prefix).__str__(),
-            filename=file.name,
-            extension=file.suffix,
-            prefix=prefix,
+        size = mtime = etag = None
+        if stats:
+            file, size, mtime, etag = file
+        else:
+            if file.is_dir():
+                continue
+            file = file.resolve()
+        paths.append(file.__str__())
+        sizes.append(size)
+        mtimes.append(mtime)
+        etags.append(etag)
+    df = pl.DataFrame(
+        {"path": paths, "size": sizes, "mtime": mtimes, "etag": etags},
+        schema={
+            "path": pl.String,
+            "size": pl.Int64,
+            "mtime": pl.Float64,
+            "etag": pl.String,
+        },
+    ).select(
+        *gen_inventory_cols(pl.col("path"), prefix), "size", "mtime", "etag"
+    )
+    write_inventory(
+        df, out_dir.joinpath(f"inventory_{job_idx}_{randomword(10)}.parquet")
+    )
+
+
+def write_inventory(df: pl.DataFrame, out_path: Path | CloudPath) -> None:
+    """Write inventory rows with the `FileInventory` schema.
+
+    Parameters
+    ----------
+    df : pl.DataFrame
+        Inventory rows.
+    out_path : Path | CloudPath
+        Path to save Parquet file. Can be local or a cloud path.
+
+    """
+    with ParquetSink(out_path, FileInventory) as sink:
+        sink.write(df)
+
+
+def gen_inventory_cols(path: pl.Expr, prefix: str) -> list[pl.Expr]:
+    """Generate expressions computing the inventory columns from file paths.
+
+    The expressions apply the same prefix masking as `parse_prefix` to a
+    whole string column at once.
+
+    Parameters
+    ----------
+    path : pl.Expr
+        Expression for the resolved file paths. Paths must start with the
+        prefix.
+    prefix : str
+        Prefix to use.
+
+    Returns
+    -------
+    list[pl.Expr]
+        Expressions for the key, filename, extension and prefix columns.
+
+    """
+    filename = path.str.extract(r"([^/]*)$", 1)
+    return [
+        path.str.slice(len(prefix.rstrip("/")) + 1).alias("key"),
+        filename.alias("filename"),
+        # Same as the suffix of a pathlib path
+        filename.str.extract(r"^.+(\.[^.]+)$", 1)
+        .fill_null("")
+        .alias("extension"),
+        pl.lit(prefix, dtype=pl.String).alias("prefix"),
+    ]
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[list]:
+    """Split an iterable into lists of at most `size` items.
+
+    Parameters
+    ----------
+    iterable : Iterable
+        Iterable to split.
+    size : int
+        Max number of items in a chunk.
+
+    Yields
+    ------
+    list
+        Next chunk of items.
+
+    """
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def split_dataset_tree(
+    dataset_dir: Path | CloudPath,
+    min_parts: int,
+    max_depth: int = MAX_SPLIT_DEPTH,
+) -> tuple[list[Path | CloudPath], list[Path | CloudPath]]:
+    """Split a dataset tree into independent subtrees.
+
+    Directories are expanded breadth first until there are at least
+    `min_parts` subtrees or `max_depth` is reached, which for the usual
+    dataset layout splits the tree by batch and then by plate directories.
+
+    Parameters
+    ----------
+    dataset_dir : Path | CloudPath
+        Path to dataset. Can be local or a cloud path.
+    min_parts : int
+        Minimum number of subtrees to stop the expansion at.
+    max_depth : int
+        Max directory depth to expand.
+
+    Returns
+    -------
+    tuple[list[Path | CloudPath], list[Path | CloudPath]]
+        Subtree root directories and the files found above them.
+
+    """
+    subtrees = [dataset_dir]
+    loose_files = []
+    for _ in range(max_depth):
+        if len(subtrees) >= min_parts:
+            break
+        next_subtrees = []
+        for subtree in subtrees:
+            for child, is_dir in list_dir(subtree):
+                if is_dir:
+                    next_subtrees.append(child)
+                else:
+                    loose_files.append(child)
+        subtrees = next_subtrees
+        if len(subtrees) == 0:
+            break
+    return sorted(subtrees), loose_files
+
+
+def parse_subtrees(
+    subtrees: list[CloudPath | Path],
+    out_dir: CloudPath | Path,
+    prefix: str,
+    chunk_size: int = INVENTORY_CHUNK_SIZE,
+    job_idx: int = 0,
+) -> None:
+    """Stream files of the subtrees into inventory shards.
+
+    Parameters
+    ----------
+    subtrees : list[CloudPath | Path]
+        List of subtree root directories to scan.
+    out_dir : CloudPath | Path
+        Path to output dir.
+    prefix : str
+        Prefix to use.
+    chunk_size : int
+        Number of files written per inventory shard.
+    job_idx : int
+        Index of job.
+
+    """
+    files = chain.from_iterable(
+        scan_file_stats(subtree) for subtree in subtrees
+    )
+    for chunk in chunked(files, chunk_size):
+        parse_prefix(chunk, out_dir, prefix, job_idx, stats=True)
+
+
+def scan_inventory(inv_path: Path | CloudPath) -> pl.LazyFrame:
+    """Scan an inventory file.
+
+    Stat columns missing in inventories generated before they were added are
+    filled with nulls.
+
+    Parameters
+    ----------
+    inv_path : Path | CloudPath
+        Path to inventory file. Can be local or a cloud path.
+
+    Returns
+    -------
+    pl.LazyFrame
+        Inventory LazyFrame with all the `FileInventory` columns.
+
+    """
+    inv_schema = pl.from_arrow(get_pyarrow_schema(FileInventory).empty_table())
+    inv_df = pl.scan_parquet(inv_path.resolve().__str__())
+    inv_cols = inv_df.collect_schema().names()
+    return inv_df.with_columns(
+        pl.lit(None, dtype=inv_schema.schema[col]).alias(col)
+        for col in INVENTORY_STAT_COLS
+        if col not in inv_cols
+    ).select(inv_schema.columns)
+
+
+def gen_inventory_delta(
+    prev_inv_df: pl.LazyFrame, new_inv_df: pl.LazyFrame
+) -> pl.LazyFrame:
+    """Compare two inventories.
+
+    Files present in both inventories are considered changed if their size,
+    mtime or etag differ. ETags are only compared when both inventories have
+    one, as files outside of the S3 listings are stored without.
+
+    Parameters
+    ----------
+    prev_inv_df : pl.LazyFrame
+        Previous inventory.
+    new_inv_df : pl.LazyFrame
+        New inventory.
+
+    Returns
+    -------
+    pl.LazyFrame
+        Delta with the key, the change (`added`, `removed` or `changed`) and
+        the latest stats of every file that differs between the inventories.
+
+    """
+    cols = ["key", *INVENTORY_STAT_COLS]
+    delta = prev_inv_df.select(*cols, pl.lit(True).alias("in_prev")).join(
+        new_inv_df.select(*cols, pl.lit(True).alias("in_new")),
+        on="key",
+        how="full",
+        coalesce=True,
+        suffix="_new",
+    )
+    is_changed = pl.any_horizontal(
+        pl.col(col).ne(pl.col(f"{col}_new")).fill_null(False)
+        if col == "etag"
+        else pl.col(col).ne_missing(pl.col(f"{col}_new"))
+        for col in INVENTORY_STAT_COLS
+    )
+    return (
+        delta.with_columns(
+            pl.when(pl.col("in_prev").is_null())
+            .then(pl.lit("added"))
+            .when(pl.col("in_new").is_null())
+            .then(pl.lit("removed"))
+            .when(is_changed)
+            .then(pl.lit("changed"))
+            .alias("change")
         )
-        for key, value in parsed_local_file.model_dump().items():
-            col_dict[key].append(value)
-    write_pq(
-        col_dict,
-        FileInventory,
-        out_dir.joinpath(f"inventory_{job_idx}_{randomword(10)}.parquet"),
+        .filter(pl.col("change").is_not_null())
+        .select(
+            "key",
+            "change",
+            *[
+                pl.when(pl.col("in_new"))
+                .then(pl.col(f"{col}_new"))
+                .otherwise(pl.col(col))
+                .alias(col)
+                for col in INVENTORY_STAT_COLS
+            ],
+        )
+        .sort("key")
     )
 
 
-def create_inventory(dataset_dir: Path | CloudPath, out_dir: Path | CloudPath) -> None:
+def get_inventory_id(inv_path: Path | CloudPath) -> str | None:
+    """Get the id of an inventory.
+
+    Every inventory written gets a new id, so deltas and indexes can tell
+    which inventory they were generated from.
+
+    Parameters
+    ----------
+    inv_path : Path | CloudPath
+        Path to inventory or inventory delta. Can be local or a cloud path.
+
+    Returns
+    -------
+    str | None
+        Id of the inventory, None for inventories written before ids.
+
+    """
+    return read_pq_metadata(inv_path).get(INVENTORY_ID_KEY)
+
+
+def write_inventory_delta(
+    delta: pl.DataFrame,
+    delta_path: Path | CloudPath,
+    base_inventory_id: str | None,
+    inventory_id: str,
+) -> None:
+    """Write an inventory delta tied to the inventories it compares.
+
+    Parameters
+    ----------
+    delta : pl.DataFrame
+        Delta, see `gen_inventory_delta`.
+    delta_path : Path | CloudPath
+        Path to save the delta. Can be local or a cloud path.
+    base_inventory_id : str | None
+        Id of the previous inventory, None if it has none.
+    inventory_id : str
+        Id of the new inventory.
+
+    """
+    metadata = {INVENTORY_ID_KEY: inventory_id}
+    if base_inventory_id is not None:
+        metadata[BASE_INVENTORY_ID_KEY] = base_inventory_id
+    with delta_path.open("wb") as f:
+        pq.write_table(delta.to_arrow().replace_schema_metadata(metadata), f)
+
+
+def write_carried_inventory(
+    prev_inv_path: Path | CloudPath,
+    excluded_prefixes: list[str],
+    out_path: Path | CloudPath,
+) -> None:
+    """Copy rows of an inventory that are outside of the given key prefixes.
+
+    The inventory is streamed in record batches, so memory use does not
+    depend on its size.
+
+    Parameters
+    ----------
+    prev_inv_path : Path | CloudPath
+        Path to the inventory to copy from. Can be local or a cloud path.
+    excluded_prefixes : list[str]
+        Key prefixes of the rows to drop.
+    out_path : Path | CloudPath
+        Path to save the copied rows. Can be local or a cloud path.
+
+    """
+    inv_schema = get_pyarrow_schema(FileInventory)
+    with prev_inv_path.open("rb") as f_in:
+        with ParquetSink(out_path, inv_schema) as sink:
+            for batch in pq.ParquetFile(f_in).iter_batches():
+                is_excluded = reduce(
+                    pc.or_,
+                    [
+                        pc.starts_with(batch["key"], prefix)
+                        for prefix in excluded_prefixes
+                    ],
+                )
+                batch = batch.filter(pc.invert(is_excluded))
+                # Inventories generated before stat columns were added
+                columns = [
+                    batch[field.name]
+                    if field.name in batch.schema.names
+                    else pa.nulls(len(batch), field.type)
+                    for field in inv_schema
+                ]
+                sink.write(
+                    pa.RecordBatch.from_arrays(columns, schema=inv_schema)
+                )
+
+
+def list_dataset(
+    roots: list[Path | CloudPath],
+    out_dir: Path | CloudPath,
+    prefix: str,
+    jobs: int,
+    chunk_size: int = INVENTORY_CHUNK_SIZE,
+) -> None:
+    """List dataset directories into inventory shards.
+
+    Every root directory is split into subtrees (by batch and plate
+    directories) that are scanned in parallel. Each worker streams the files
+    of its subtrees into inventory shards of `chunk_size` files, so memory use
+    stays flat regardless of the size of the dataset.
+
+    Parameters
+    ----------
+    roots : list[Path | CloudPath]
+        Resolved directories to list. Can be local or cloud paths.
+    out_dir : Path | CloudPath
+        Path to save the inventory shards. Can be local or a cloud path.
+    prefix : str
+        Prefix to use.
+    jobs : int
+        Number of parallel jobs to use.
+    chunk_size : int
+        Number of files written per inventory shard.
+
+    """
+    subtrees, loose_files = [], []
+    for root in roots:
+        root_subtrees, root_loose_files = split_dataset_tree(root, jobs)
+        subtrees += root_subtrees
+        loose_files += root_loose_files
+    loose_stats = (stat_file(file) for file in loose_files)
+    for chunk in chunked(loose_stats, chunk_size):
+        parse_prefix(chunk, out_dir, prefix, stats=True)
+    if len(subtrees) > 0:
+        parallel(subtrees, parse_subtrees, [out_dir, prefix, chunk_size], jobs)
+
+
+def create_inventory(
+    dataset_dir: Path | CloudPath,
+    out_dir: Path | CloudPath,
+    jobs: int | None = None,
+    chunk_size: int = INVENTORY_CHUNK_SIZE,
+    incremental: bool = False,
+    subtrees: list[Path | CloudPath] | None = None,
+) -> None:
     """Create inventory files from dataset.
 
+    In incremental mode, the new listing is compared with the previous
+    `inventory.parquet` in `out_dir` on the size, mtime and etag of the files,
+    and the differences are written to `inventory_delta.parquet`, tied to
+    both inventories by their ids (see `get_inventory_id`). If subtrees
+    are given, only those are listed again and the rows of the previous
+    inventory outside of them are kept as they are. Changed subtrees are not
+    detected, so without subtrees the whole dataset is listed again. Full
+    listings remove the delta of a previous incremental run.
+
     Parameters
     ----------
     dataset_dir : Path | CloudPath
         Path to dataset. Can be local or a cloud path.
     out_dir : Path | CloudPath
         Path to save generated inventory. Can be local or a cloud path.
+    jobs : int | None
+        Number of parallel jobs to use. Defaults to the number of cpus.
+    chunk_size : int
+        Number of files written per inventory shard.
+    incremental : bool
+        Refresh the previous inventory and write a delta file.
+    subtrees : list[Path | CloudPath] | None
+        Dataset directories to list again in incremental mode.
+
+    Raises
+    ------
+    ValueError
+        If subtrees are given without incremental mode.
 
     """
-    files = [AnyPath(file).resolve() for file in AnyPath(dataset_dir).rglob("*")]
+    if subtrees and not incremental:
+        raise ValueError("Subtrees can only be listed in incremental mode")
+    inventory_id = uuid4().hex
+    dataset_dir = dataset_dir.resolve()
     inv = out_dir.joinpath("inv")
     # Delete files from previous run
     if inv.exists():
@@ -111,8 +575,291 @@ def create_inventory(dataset_dir: Path | CloudPath, out_dir: Path | CloudPath) -
         else:
             shutil.rmtree(inv)
     inv.mkdir(parents=True, exist_ok=True)
-    prefix_mask = "/".join(dataset_dir.resolve().__str__().split("/")[0:-1])
-    parallel(files, parse_prefix, [inv, prefix_mask])
+    prefix_mask = "/".join(dataset_dir.__str__().split("/")[0:-1])
+    inv_path = out_dir.joinpath("inventory.parquet")
+    jobs = jobs or cpu_count()
+
+    if incremental and not inv_path.exists():
+        print("No previous inventory found. Creating full inventory...")
+        incremental = False
+
+    if incremental and subtrees:
+        roots = [subtree.resolve() for subtree in subtrees]
+        # Subtrees removed from the dataset are not listed
+        list_dataset(
+            [root for root in roots if root.exists()],
+            inv,
+            prefix_mask,
+            jobs,
+            chunk_size,
+        )
+        scope_prefixes = [
+            f"{root.relative_to(AnyPath(prefix_mask)).__str__()}/"
+            for root in roots
+        ]
+        write_carried_inventory(
+            inv_path,
+            scope_prefixes,
+            inv.joinpath(f"inventory_carried_{randomword(10)}.parquet"),
+        )
+    else:
+        list_dataset([dataset_dir], inv, prefix_mask, jobs, chunk_size)
+        scope_prefixes = None
+
+    delta_path = out_dir.joinpath("inventory_delta.parquet")
+    if not incremental and delta_path.exists():
+        # A delta against an older inventory would be applied to the new one
+        delta_path.unlink()
 
     out_files = [AnyPath(file) for file in AnyPath(inv).rglob("*.parquet")]
-    merge_pq(out_files, out_dir.joinpath("inventory.parquet"))
+
+    if incremental:
+        prev_inv_df = scan_inventory(inv_path)
+        new_inv_df = pl.scan_parquet(
+            [file.resolve().__str__() for file in out_files]
+        )
+        if scope_prefixes is not None:
+            in_scope = pl.any_horizontal(
+                pl.col("key").str.starts_with(prefix)
+                for prefix in scope_prefixes
+            )
+            prev_inv_df = prev_inv_df.filter(in_scope)
+            new_inv_df = new_inv_df.filter(in_scope)
+        delta = gen_inventory_delta(prev_inv_df, new_inv_df).collect()
+        print(f"Inventory delta: {delta['change'].value_counts().to_dicts()}")
+        write_inventory_delta(
+            delta, delta_path, get_inventory_id(inv_path), inventory_id
+        )
+
+    merge_pq(out_files, inv_path, metadata={INVENTORY_ID_KEY: inventory_id})
+
+
+def unquote_keys(listing: pl.DataFrame) -> pl.DataFrame:
+    """Decode the URL encoded keys of a listing.
+
+    Keys with only printable ASCII escapes are decoded with a vectorized
+    `replace_many`. Only keys with escaped non-ASCII bytes, which need
+    UTF-8 decoding, go through `unquote_plus`. Rows are reordered.
+
+    Parameters
+    ----------
+    listing : pl.DataFrame
+        Object listing with a URL encoded key column.
+
+    Returns
+    -------
+    pl.DataFrame
+        Listing with decoded keys.
+
+    """
+    non_ascii = pl.col("key").str.contains("%[89A-Fa-f][0-9A-Fa-f]")
+    return pl.concat(
+        [
+            listing.filter(~non_ascii).with_columns(
+                pl.col("key").str.replace_many(
+                    list(URL_ASCII_ESCAPES), list(URL_ASCII_ESCAPES.values())
+                )
+            ),
+            listing.filter(non_ascii).with_columns(
+                pl.col("key").map_elements(unquote_plus, return_dtype=pl.String)
+            ),
+        ]
+    )
+
+
+def read_manifest(
+    manifest_path: Path | CloudPath, key_prefix: str = ""
+) -> Iterator[pl.DataFrame]:
+    """Read the listings referenced by an S3 Inventory manifest.
+
+    The manifest can either be the `manifest.json` of an S3 Inventory
+    report, or a listing file (parquet or csv with header) with at least
+    a `key` column. Data files of a report are read one at a time.
+
+    Parameters
+    ----------
+    manifest_path : Path | CloudPath
+        Path to manifest. Can be local or a cloud path.
+    key_prefix : str
+        Prefix of the keys of interest. URL encoded keys that cannot start
+        with it once decoded are dropped before decoding, other keys are
+        kept.
+
+    Yields
+    ------
+    pl.DataFrame
+        Listing of one data file, with snake case column names.
+
+    """
+    if manifest_path.suffix == ".parquet":
+        with manifest_path.open("rb") as f:
+            yield pl.read_parquet(f)
+        return
+    if manifest_path.suffix != ".json":
+        with manifest_path.open("rb") as f:
+            yield pl.read_csv(f.read(), infer_schema=False)
+        return
+
+    manifest = json.loads(manifest_path.read_text())
+    file_format = manifest["fileFormat"].lower()
+    columns = [
+        re.sub(r"(?<!^)(?=[A-Z])", "_", col.strip()).lower()
+        for col in manifest["fileSchema"].split(",")
+    ]
+    dest_bucket = manifest["destinationBucket"].split(":")[-1]
+    # Leading part of the prefix that is the same once URL encoded
+    encoded_prefix = "".join(
+        takewhile(lambda char: char in URL_UNRESERVED_CHARS, key_prefix)
+    )
+    for data_file in manifest["files"]:
+        if isinstance(manifest_path, CloudPath):
+            data_path = AnyPath(f"s3://{dest_bucket}/{data_file['key']}")
+        else:
+            # Local copy of the report: <report>/<date>/manifest.json
+            # next to <report>/data/<file>
+            data_path = manifest_path.parents[1].joinpath(
+                "data", data_file["key"].split("/")[-1]
+            )
+        with data_path.open("rb") as f:
+            if file_format == "csv":
+                # Keys are URL encoded in csv reports
+                df = unquote_keys(
+                    pl.read_csv(
+                        f.read(),
+                        has_header=False,
+                        new_columns=columns,
+                        infer_schema=False,
+                    ).filter(pl.col("key").str.starts_with(encoded_prefix))
+                )
+            elif file_format == "parquet":
+                df = pl.read_parquet(f)
+            elif file_format == "orc":
+                from pyarrow import orc
+
+                df = pl.from_arrow(orc.read_table(f))
+            else:
+                raise ValueError(f"Unsupported inventory format: {file_format}")
+        yield df
+
+
+def gen_manifest_inventory(
+    listing: pl.DataFrame, dataset_dir: Path | CloudPath, prefix: str
+) -> pl.DataFrame:
+    """Generate inventory rows from an object listing.
+
+    Parameters
+    ----------
+    listing : pl.DataFrame
+        Object listing with a key column and optional bucket, size,
+        last_modified_date (or mtime) and e_tag (or etag) columns.
+    dataset_dir : Path | CloudPath
+        Path to dataset. Objects outside of it are dropped.
+    prefix : str
+        Prefix to use.
+
+    Returns
+    -------
+    pl.DataFrame
+        Inventory rows.
+
+    """
+    cols = listing.columns
+    if "bucket" in cols:
+        path = pl.concat_str(pl.lit("s3://"), "bucket", pl.lit("/"), "key")
+    else:
+        path = pl.col("key")
+
+    if "mtime" in cols:
+        mtime = pl.col("mtime").cast(pl.Float64)
+    elif "last_modified_date" in cols:
+        mtime = pl.col("last_modified_date")
+        if listing.schema["last_modified_date"] == pl.String:
+            mtime = mtime.str.to_datetime(time_zone="UTC")
+        mtime = mtime.dt.epoch("ms") / 1000
+    else:
+        mtime = pl.lit(None, dtype=pl.Float64)
+    etag_col = "e_tag" if "e_tag" in cols else "etag"
+    etag = (
+        pl.col(etag_col).cast(pl.String).str.strip_chars('"')
+        if etag_col in cols
+        else pl.lit(None, dtype=pl.String)
+    )
+    size = (
+        pl.col("size").cast(pl.Int64)
+        if "size" in cols
+        else pl.lit(None, dtype=pl.Int64)
+    )
+
+    return (
+        listing.lazy()
+        .select(
+            path.alias("path"),
+            size.alias("size"),
+            mtime.alias("mtime"),
+            etag.alias("etag"),
+        )
+        # Skip directory markers
+        .filter(
+            pl.col("path").str.starts_with(f"{dataset_dir.__str__()}/")
+            & ~pl.col("path").str.ends_with("/")
+        )
+        .select(
+            *gen_inventory_cols(pl.col("path"), prefix),
+            "size",
+            "mtime",
+            "etag",
+        )
+        .collect()
+    )
+
+
+def create_inventory_from_manifest(
+    manifest_path: Path | CloudPath,
+    dataset_dir: Path | CloudPath,
+    out_dir: Path | CloudPath,
+) -> None:
+    """Create inventory files from an S3 Inventory manifest.
+
+    Builds the inventory from a pre-computed object listing instead of
+    listing the dataset, which is much faster for large buckets.
+
+    Parameters
+    ----------
+    manifest_path : Path | CloudPath
+        Path to S3 Inventory `manifest.json` or to a listing file.
+        Can be local or a cloud path.
+    dataset_dir : Path | CloudPath
+        Path to dataset. Can be local or a cloud path.
+    out_dir : Path | CloudPath
+        Path to save generated inventory. Can be local or a cloud path.
+
+    """
+    dataset_dir = dataset_dir.resolve()
+    inv = out_dir.joinpath("inv")
+    # Delete files from previous run
+    if inv.exists():
+        if isinstance(inv, CloudPath):
+            inv.rmtree()
+        else:
+            shutil.rmtree(inv)
+    inv.mkdir(parents=True, exist_ok=True)
+    prefix_mask = "/".join(dataset_dir.__str__().split("/")[0:-1])
+
+    key_prefix = dataset_dir.key if isinstance(dataset_dir, S3Path) else ""
+    # One shard per data file, so only one listing is held in memory
+    out_files = []
+    for job_idx, listing in enumerate(read_manifest(manifest_path, key_prefix)):
+        out_file = inv.joinpath(f"inventory_{job_idx}_{randomword(10)}.parquet")
+        write_inventory(
+            gen_manifest_inventory(listing, dataset_dir, prefix_mask), out_file
+        )
+        out_files.append(out_file)
+    # A delta against an older inventory would be applied to the new one
+    delta_path = out_dir.joinpath("inventory_delta.parquet")
+    if delta_path.exists():
+        delta_path.unlink()
+    merge_pq(
+        out_files,
+        out_dir.joinpath("inventory.parquet"),
+        metadata={INVENTORY_ID_KEY: uuid4().hex},
+    )
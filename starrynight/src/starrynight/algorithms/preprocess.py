@@ -1,6 +1,6 @@
 """Preprocess commands."""
 
-import csv
+import re
 from io import TextIOWrapper
 from pathlib import Path
 
@@ -112,7 +112,10 @@ from starrynight.algorithms.cp_plugin_compensate_colors import (
     CC_OBJECTS,
     CompensateColors,
 )
-from starrynight.algorithms.index import OutputIndex, PCPIndex
+from starrynight.algorithms.index import (
+    PCPIndex,
+    write_loaddata_output_index,
+)
 from starrynight.modules.sbs_illum_apply.constants import (
     SBS_ILLUM_APPLY_OUT_PATH_SUFFIX,
 )
@@ -122,18 +125,21 @@ from starrynight.modules.sbs_preprocess.constants import (
 from starrynight.templates import get_templates_path
 from starrynight.utils.cellprofiler import CellProfilerContext
 from starrynight.utils.dfutils import (
-    filter_df_by_hierarchy,
-    filter_images,
-    gen_image_hierarchy,
     gen_legacy_channel_map,
     get_channels_by_batch_plate,
     get_channels_from_df,
     get_cycles_by_batch_plate,
     get_cycles_from_df,
     get_default_path_prefix,
+    load_images,
+)
+from starrynight.utils.globbing import flatten_dict, get_files_by
+from starrynight.utils.loaddata import (
+    well_value_expr,
+    write_loaddata_csv,
+    write_loaddata_levels,
 )
-from starrynight.utils.globbing import flatten_all, flatten_dict, get_files_by
-from starrynight.utils.misc import resolve_path_loaddata, write_pq
+from starrynight.utils.misc import resolve_path_loaddata, staged_directory
 
 
 def write_output_index(
@@ -156,129 +162,83 @@ def write_output_index(
     # Read the loaddata CSV file
     loaddata_df = pl.read_csv(loaddata_file_path.resolve().__str__())
 
-    # Initialize list to store output index records
-    output_records = []
-
-    # Process each row in the loaddata
-    for row in loaddata_df.iter_rows(named=True):
-        # Extract metadata
-        batch_id = row.get("Metadata_Batch")
-        plate_id = row.get("Metadata_Plate")
-        site_id = row.get("Metadata_Site")
-        well_id = row.get("Metadata_Well")
-
-        # Find all cycle and channel columns
-        cycle_channel_columns = [
-            col
-            for col in loaddata_df.columns
-            if col.startswith("FileName_Cycle")
-        ]
-
-        # Extract unique cycles and channels
-        cycles = list(
-            set(
-                [
-                    int(col.split("_")[1].replace("Cycle", ""))
-                    for col in cycle_channel_columns
-                ]
+    # Extract cycles and channels of the cycle channel columns, e.g.
+    # "FileName_Cycle_1_A" or legacy "FileName_Cycle01_A"
+    cycles = []
+    channels = []
+    for col in loaddata_df.columns:
+        match = re.match(r"FileName_Cycle_?(\d+)_", col)
+        if match is None:
+            continue
+        cycle, channel = int(match.group(1)), col.split("_")[-1]
+        if cycle not in cycles:
+            cycles.append(cycle)
+        if channel not in channels:
+            channels.append(channel)
+
+    # Generate output templates for compensated images
+    outputs = []
+    for cycle in sorted(cycles):
+        for channel in channels:
+            if int(cycle) != 1 and channel == "DNA":
+                print(f"skipping channel DNA for cycle {cycle}")
+                continue
+            # Output filename template, filled per row with the site metadata
+            output_filename = (
+                "Plate_{plate_id}_Well_{well_id}_Site_{site_id}"
+                f"_Cycle{int(cycle):02d}_{channel}.tiff"
             )
-        )
-        channels = list(
-            set([col.split("_")[-1] for col in cycle_channel_columns])
-        )
-
-        # Generate output records for compensated images
-        for cycle in cycles:
-            for channel in channels:
-                if int(cycle) != 1 and channel == "DNA":
-                    print(f"skipping channel DNA for cycle {cycle}")
-                    continue
-                # Generate output filename based on pipeline configuration
-                output_filename = f"Plate_{plate_id}_Well_{well_id}_Site_{site_id}_Cycle{int(cycle):02d}_{channel}.tiff"
-
-                # Create output file path
-                output_key = f"{output_filename}"
-
-                # Create OutputIndex record
-                output_record = OutputIndex(
-                    key=output_key,
-                    prefix=str(generated_output_dir.resolve().absolute()),
-                    dataset_id=None,
-                    batch_id=batch_id,
-                    plate_id=plate_id,
-                    cycle_id=str(cycle),
-                    magnification=None,
-                    well_id=well_id,
-                    site_id=str(site_id),
-                    channel_dict=[channel],
-                    channel_id=channel,
-                    filename=output_filename,
-                    extension="tiff",
-                    file_type="compensated_image",
-                )
-
-                output_records.append(output_record.model_dump())
-
-        # Add measurements CSV outputs
-        measurements_filenames = [
-            "BarcodePreprocessing_AllFoci.csv",
-            "BarcodePreprocessing_BarcodeFoci.csv",
-            "BarcodePreprocessing_Experiment.csv",
-            "BarcodePreprocessing_Foci.csv",
-            "BarcodePreprocessing_Image.csv",
-            "BarcodePreprocessing_Nuclei.csv",
-        ]
-
-        for measurement in measurements_filenames:
-            measurements_record = OutputIndex(
-                key=f"{measurement}",
-                prefix=str(generated_output_dir.resolve().absolute()),
-                dataset_id=None,
-                batch_id=batch_id,
-                plate_id=plate_id,
-                cycle_id=None,
-                magnification=None,
-                well_id=well_id,
-                site_id=str(site_id),
-                channel_dict=None,
-                filename=measurement,
-                extension="csv",
-                file_type="measurements",
+            outputs.append(
+                {
+                    "key": output_filename,
+                    "filename": output_filename,
+                    "cycle_id": str(cycle),
+                    "channel_id": channel,
+                    "extension": "tiff",
+                    "file_type": "compensated_image",
+                }
             )
-            output_records.append(measurements_record.model_dump())
 
-        # Add overlay output
-        overlay_filenames = [
-            f"Plate_{plate_id}_Well_{well_id}_Site_{site_id}_StdDev_Overlay.tiff",
-            # f"Plate_{plate_id}_Well_{well_id}_Site_{site_id}_StdDev_Overlay.png",
-        ]
-
-        for overlay_file in overlay_filenames:
-            overlay_record = OutputIndex(
-                key=f"{batch_id}/{plate_id}/{overlay_file}",
-                prefix=str(generated_output_dir.resolve().absolute()),
-                dataset_id=None,
-                batch_id=batch_id,
-                plate_id=plate_id,
-                cycle_id=None,
-                magnification=None,
-                well_id=well_id,
-                site_id=str(site_id),
-                channel_dict=None,
-                filename=overlay_file,
-                extension=overlay_file.split(".")[-1],
-                file_type="overlay_image",
-            )
-            output_records.append(overlay_record.model_dump())
+    # Add measurements CSV outputs
+    measurements_filenames = [
+        "BarcodePreprocessing_AllFoci.csv",
+        "BarcodePreprocessing_BarcodeFoci.csv",
+        "BarcodePreprocessing_Experiment.csv",
+        "BarcodePreprocessing_Foci.csv",
+        "BarcodePreprocessing_Image.csv",
+        "BarcodePreprocessing_Nuclei.csv",
+    ]
+    outputs += [
+        {
+            "key": measurement,
+            "filename": measurement,
+            "extension": "csv",
+            "file_type": "measurements",
+        }
+        for measurement in measurements_filenames
+    ]
 
-    # Convert to dictionary format for write_pq
-    output_index_dict = {
-        key: [record[key] for record in output_records]
-        for key in output_records[0].keys()
-    }
+    # Add overlay output
+    overlay_filenames = [
+        "Plate_{plate_id}_Well_{well_id}_Site_{site_id}_StdDev_Overlay.tiff",
+        # "Plate_{plate_id}_Well_{well_id}_Site_{site_id}_StdDev_Overlay.png",
+    ]
+    outputs += [
+        {
+            "key": f"{{batch_id}}/{{plate_id}}/{overlay_file}",
+            "filename": overlay_file,
+            "extension": overlay_file.split(".")[-1],
+            "file_type": "overlay_image",
+        }
+        for overlay_file in overlay_filenames
+    ]
 
-    # Write parquet file
-    write_pq(output_index_dict, OutputIndex, output_index_path)
+    write_loaddata_output_index(
+        loaddata_df,
+        outputs,
+        str(generated_output_dir.resolve().absolute()),
+        output_index_path,
+    )
 
 
 ###############################
@@ -296,19 +256,40 @@ def get_filename_header(
 
 
 def get_filename_value(
-    index: PCPIndex,
     cycle: int,
     ch: str,
     use_legacy: bool = False,
     legacy_channel_map: dict = {},
-) -> str:
+) -> pl.Expr:
     if not use_legacy:
         if int(cycle) != 1:
-            return f"{index.batch_id}_{index.plate_id}_{int(cycle)}_Well_{index.well_id}_Site_{int(index.site_id)}_Aligned{ch}.tiff"
+            suffix = f"_Aligned{ch}.tiff"
         else:
-            return f"{index.batch_id}_{index.plate_id}_{int(cycle)}_Well_{index.well_id}_Site_{int(index.site_id)}_Corr{ch}.tiff"
+            suffix = f"_Corr{ch}.tiff"
+        return pl.concat_str(
+            [
+                pl.col("batch_id"),
+                pl.lit("_"),
+                pl.col("plate_id"),
+                pl.lit(f"_{int(cycle)}_Well_"),
+                pl.col("well_id"),
+                pl.lit("_Site_"),
+                pl.col("site_num"),
+                pl.lit(suffix),
+            ]
+        )
     else:
-        return f"Plate_{index.plate_id}_Well_{index.well_id}_Site_{int(index.site_id)}_Cycle{int(cycle):02d}_{legacy_channel_map[ch]}.tiff"
+        return pl.concat_str(
+            [
+                pl.lit("Plate_"),
+                pl.col("plate_id"),
+                pl.lit("_Well_"),
+                pl.col("well_id"),
+                pl.lit("_Site_"),
+                pl.col("site_num"),
+                pl.lit(f"_Cycle{int(cycle):02d}_{legacy_channel_map[ch]}.tiff"),
+            ]
+        )
 
 
 def get_pathname_header(
@@ -332,7 +313,6 @@ def write_loaddata(
     use_legacy: bool = False,
     exp_config_path: Path | CloudPath | None = None,
 ) -> None:
-    loaddata_writer = csv.writer(f, delimiter=",", quoting=csv.QUOTE_MINIMAL)
     legacy_channel_map = {}
 
     if use_legacy:
@@ -359,68 +339,126 @@ def write_loaddata(
         for cycle in plate_cycles_list
         for ch in plate_channel_list
     ]
-    loaddata_writer.writerow(
-        [
-            *metadata_heads,
-            *filename_heads,
-            *pathname_heads,
-        ]
-    )
     index = images_df.first().collect().to_dicts()[0]
     index = PCPIndex(**index)
-    wells_sites = (
-        images_df.collect()
-        .group_by("well_id")
-        .agg(pl.col("site_id").unique())
-        .to_dicts()
+    assert index.cycle_id is not None
+    assert index.key is not None
+
+    # Match the order of iteration in filename_heads to ensure correct alignment
+    filenames = [
+        get_filename_value(cycle, ch, use_legacy, legacy_channel_map)
+        for cycle in plate_cycles_list
+        for ch in plate_channel_list
+    ]
+    if index.cycle_num != 1:
+        pathname = resolve_path_loaddata(AnyPath(path_mask), align_images_path)
+    else:
+        pathname = resolve_path_loaddata(AnyPath(path_mask), corr_images_path)
+
+    # One row per well and site, batch and plate are taken from the first image
+    wells_sites = images_df.select("well_id", "site_id", "site_num").unique(
+        maintain_order=True
+    )
+    write_loaddata_csv(
+        wells_sites.with_columns(
+            batch_id=pl.lit(index.batch_id, pl.String),
+            plate_id=pl.lit(index.plate_id, pl.String),
+        ),
+        [*metadata_heads, *filename_heads, *pathname_heads],
+        [
+            # Metadata heads
+            pl.col("batch_id"),
+            pl.col("plate_id"),
+            pl.col("site_id"),
+            pl.col("well_id"),
+            well_value_expr(),
+            # Filename heads
+            *filenames,
+            # Pathname heads
+            *[pl.lit(str(pathname)) for _ in pathname_heads],
+        ],
+        f,
     )
-    for well_sites in wells_sites:
-        index.well_id = well_sites["well_id"]
-        for site_id in well_sites["site_id"]:
-            index.site_id = site_id
-            assert index.cycle_id is not None
-            assert index.site_id is not None
-            # Match the order of iteration in filename_heads to ensure correct alignment
-            filenames = [
-                get_filename_value(
-                    index, cycle, ch, use_legacy, legacy_channel_map
-                )
-                for cycle in plate_cycles_list
-                for ch in plate_channel_list
-            ]
-            if int(index.cycle_id) != 1:
-                pathnames = [
-                    resolve_path_loaddata(AnyPath(path_mask), align_images_path)
-                    for _ in range(len(pathname_heads))
-                ]
-            else:
-                pathnames = [
-                    resolve_path_loaddata(AnyPath(path_mask), corr_images_path)
-                    for _ in range(len(pathname_heads))
-                ]
-
-            well_value = (
-                index.well_id[4:]
-                if index.well_id.startswith("Well")
-                else index.well_id
-            )
 
-            # make sure frame heads are matched with their order in the filenames
-            assert index.key is not None
-            loaddata_writer.writerow(
-                [
-                    # Metadata heads
-                    index.batch_id,
-                    index.plate_id,
-                    index.site_id,
-                    index.well_id,
-                    well_value,
-                    # Filename heads
-                    *filenames,
-                    # Pathname heads
-                    *pathnames,
-                ]
-            )
+
+def write_level_loaddata(
+    level: list[str],
+    level_df: pl.LazyFrame,
+    out_path: Path | CloudPath,
+    path_mask: str,
+    corr_images_path: Path | CloudPath,
+    align_images_path: Path | CloudPath,
+    nuclei_channel: str,
+    index_out_dir: Path | CloudPath,
+    generated_output_dir: Path | CloudPath,
+    use_legacy: bool = False,
+    exp_config_path: Path | CloudPath | None = None,
+) -> None:
+    """Write the preprocess LoadData and output index of a unit of work.
+
+    Parameters
+    ----------
+    level : list[str]
+        Level values of the unit of work.
+    level_df : pl.LazyFrame
+        Images of the unit of work.
+    out_path : Path | CloudPath
+        Path to the LoadData directory.
+    path_mask : str
+        Path prefix mask to use.
+    corr_images_path : Path | CloudPath
+        Path to corrected images.
+    align_images_path : Path | CloudPath
+        Path to aligned images.
+    nuclei_channel : str
+        Channel to use for nuclei segmentation.
+    index_out_dir : Path | CloudPath
+        Path to the output index directory.
+    generated_output_dir : Path | CloudPath
+        Path to generated output.
+    use_legacy : bool
+        Use legacy cppipe and loaddata.
+    exp_config_path : Path | CloudPath
+        Path to experiment config json path.
+
+    """
+    # Setup channel list for this level
+    plate_channel_list = get_channels_from_df(level_df)
+
+    # Setup cycles list
+    plate_cycles_list = get_cycles_from_df(level_df)
+
+    # Construct filename for the loaddata csv
+    level_out_path = out_path.joinpath(f"{'^'.join(level)}#preprocess_sbs.csv")
+
+    # Construct corr images path for this level
+    corr_images_path_level = corr_images_path.joinpath("-".join(level))
+
+    # Construct align images path for this level
+    align_images_path_level = align_images_path.joinpath("-".join(level))
+
+    # Construct filename for the output index parquet
+    output_index_path = index_out_dir.joinpath(
+        f"{'^'.join(level)}#illum_apply_output_index.parquet"
+    )
+    with level_out_path.open("w") as f:
+        write_loaddata(
+            level_df,
+            plate_channel_list,
+            plate_cycles_list,
+            corr_images_path_level,
+            align_images_path_level,
+            nuclei_channel,
+            path_mask,
+            f,
+            use_legacy,
+            exp_config_path,
+        )
+    write_output_index(
+        level_out_path,
+        generated_output_dir.joinpath("-".join(level)),
+        output_index_path,
+    )
 
 
 def gen_preprocess_load_data(
@@ -434,6 +472,7 @@ def gen_preprocess_load_data(
     exp_config_path: Path | CloudPath | None = None,
     uow_hierarchy: list[str] = None,
     generated_output_dir: Path | CloudPath | None = None,
+    jobs: int = 1,
 ) -> None:
     """Generate load data for preprocess pipeline.
 
@@ -459,6 +498,8 @@ def gen_preprocess_load_data(
         Unit of work list
     generated_output_dir : Path | CloudPath | None
         Path to generated output.
+    jobs : int
+        Number of parallel jobs to use.
 
     """
     # Construct illum path if not given
@@ -471,14 +512,13 @@ def gen_preprocess_load_data(
             SBS_ILLUM_APPLY_OUT_PATH_SUFFIX
         )
 
-    # Load index
-    df = pl.scan_parquet(index_path.resolve().__str__())
-
-    # Filter for relevant images
-    images_df = filter_images(df, True)
+    # Load relevant images, shared by the stages run in this process
+    images_df = load_images(index_path, True)
 
     # Query default path prefix
-    default_path_prefix: str = get_default_path_prefix(images_df)
+    default_path_prefix: str = get_default_path_prefix(
+        images_df.lazy(), index_path, True
+    )
 
     # Setup path mask (required for resolving pathnames during the execution)
     if path_mask is None:
@@ -491,12 +531,8 @@ def gen_preprocess_load_data(
         "well_id",
         "site_id",
     ]
-    images_hierarchy_dict = gen_image_hierarchy(images_df, uow_hierarchy)
-    levels = flatten_all(images_hierarchy_dict)
-
     # Create dir for output index
     index_out_dir = index_path.parent.joinpath("sbs_preprocess")
-    index_out_dir.mkdir(parents=True, exist_ok=True)
 
     # Construct generated_output_dir
     if generated_output_dir is None:
@@ -504,49 +540,24 @@ def gen_preprocess_load_data(
             SBS_PREPROCESS_OUT_PATH_SUFFIX
         )
 
-    # Setup chunking and write loaddata for each batch/plate
-    for level in levels:
-        # setup filtered df for chunked levels
-        level_df = filter_df_by_hierarchy(images_df, level, False)
-
-        # Setup channel list for this level
-        plate_channel_list = get_channels_from_df(level_df)
-
-        # Setup cycles list
-        plate_cycles_list = get_cycles_from_df(level_df)
-
-        # Construct filename for the loaddata csv
-        level_out_path = out_path.joinpath(
-            f"{'^'.join(level)}#preprocess_sbs.csv"
-        )
-
-        # Construct corr images path for this level
-        corr_images_path_level = corr_images_path.joinpath("-".join(level))
-
-        # Construct align images path for this level
-        align_images_path_level = align_images_path.joinpath("-".join(level))
-
-        # Construct filename for the output index parquet
-        output_index_path = index_out_dir.joinpath(
-            f"{'^'.join(level)}#illum_apply_output_index.parquet"
-        )
-        with level_out_path.open("w") as f:
-            write_loaddata(
-                level_df,
-                plate_channel_list,
-                plate_cycles_list,
-                corr_images_path_level,
-                align_images_path_level,
-                nuclei_channel,
-                path_mask,
-                f,
-                use_legacy,
-                exp_config_path,
-            )
-        write_output_index(
-            level_out_path,
-            generated_output_dir.joinpath("-".join(level)),
-            output_index_path,
+    # Setup chunking and write loaddata for each batch/plate. Output indexes
+    # are staged like the LoadData files, so that unchanged ones keep their
+    # modification times
+    with staged_directory(index_out_dir, delete=False) as index_staging_dir:
+        write_loaddata_levels(
+            images_df,
+            uow_hierarchy,
+            write_level_loaddata,
+            jobs=jobs,
+            out_path=out_path,
+            path_mask=path_mask,
+            corr_images_path=corr_images_path,
+            align_images_path=align_images_path,
+            nuclei_channel=nuclei_channel,
+            index_out_dir=index_staging_dir,
+            generated_output_dir=generated_output_dir,
+            use_legacy=use_legacy,
+            exp_config_path=exp_config_path,
         )
 
 
@@ -1359,29 +1370,30 @@ def gen_preprocess_cppipe(
     # Default run dir should already be present, otherwise CP raises an error
     out_dir.mkdir(exist_ok=True, parents=True)
 
-    filename = "preprocess_sbs.cppipe"
-
-    # Write old cppipe and return early if use_old is true
-    if use_legacy:
-        ref_cppipe = Template(
-            text=get_templates_path()
-            .joinpath("cppipe/ref_7_BC_Preprocess.cppipe.mako")
-            .read_text(),
-            output_encoding="utf-8",
-        ).render(barcode_csv_path=barcode_csv_path)
-        ref_cppipe = ref_cppipe.decode("utf-8")
-        out_dir.joinpath(filename).write_text(ref_cppipe)
-        return
-
-    # get one of the load data file for generating cppipe
-    sample_loaddata_file = next(load_data_path.rglob("*.csv"))
-
-    with CellProfilerContext(out_dir=workspace_path) as cpipe:
-        cpipe = generate_preprocess_pipeline(
-            cpipe, sample_loaddata_file, barcode_csv_path, nuclei_channel
-        )
-        with out_dir.joinpath(filename).open("w") as f:
-            cpipe.dump(f)
-        filename = "illum_apply_painting.json"
-        with out_dir.joinpath(filename).open("w") as f:
-            dumpit(cpipe, f, version=6)
+    with staged_directory(out_dir, delete=False) as staging_dir:
+        filename = "preprocess_sbs.cppipe"
+
+        # Write old cppipe and return early if use_old is true
+        if use_legacy:
+            ref_cppipe = Template(
+                text=get_templates_path()
+                .joinpath("cppipe/ref_7_BC_Preprocess.cppipe.mako")
+                .read_text(),
+                output_encoding="utf-8",
+            ).render(barcode_csv_path=barcode_csv_path)
+            ref_cppipe = ref_cppipe.decode("utf-8")
+            staging_dir.joinpath(filename).write_text(ref_cppipe)
+            return
+
+        # get one of the load data file for generating cppipe
+        sample_loaddata_file = next(load_data_path.rglob("*.csv"))
+
+        with CellProfilerContext(out_dir=workspace_path) as cpipe:
+            cpipe = generate_preprocess_pipeline(
+                cpipe, sample_loaddata_file, barcode_csv_path, nuclei_channel
+            )
+            with staging_dir.joinpath(filename).open("w") as f:
+                cpipe.dump(f)
+            filename = "illum_apply_painting.json"
+            with staging_dir.joinpath(filename).open("w") as f:
+                dumpit(cpipe, f, version=6)
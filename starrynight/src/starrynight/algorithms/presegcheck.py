@@ -48,12 +48,12 @@ from cloudpathlib import AnyPath, CloudPath
 from starrynight.algorithms.index import PCPIndex
 from starrynight.utils.cellprofiler import CellProfilerContext
 from starrynight.utils.dfutils import (
-    gen_image_hierarchy,
     get_channels_by_batch_plate,
-    get_cycles_by_batch_plate,
+    load_index,
 )
 from starrynight.utils.globbing import flatten_dict, get_files_by
-from starrynight.utils.misc import resolve_path_loaddata
+from starrynight.utils.loaddata import write_loaddata_levels
+from starrynight.utils.misc import resolve_path_loaddata, staged_directory
 
 ###############################
 ## Load data generation
@@ -84,7 +84,7 @@ def write_loaddata(
     for index in images_df.to_dicts():
         index = PCPIndex(**index)
         filenames = [
-            f"{index.batch_id}_{index.plate_id}_Well_{index.well_id}_Site_{int(index.site_id)}_Corr{col}.tiff"
+            f"{index.batch_id}_{index.plate_id}_Well_{index.well_id}_Site_{index.site_num}_Corr{col}.tiff"
             for col in plate_channel_list
         ]
         pathnames = [
@@ -171,12 +171,48 @@ def write_loaddata_csv_by_batch_plate_cycle(
         )
 
 
+def write_level_loaddata(
+    level: list[str],
+    level_df: pl.LazyFrame,
+    out_path: Path | CloudPath,
+    corr_images_path: Path | CloudPath,
+    path_mask: str,
+) -> None:
+    """Write the pre-segcheck LoadData of a batch and plate, or of a cycle.
+
+    Parameters
+    ----------
+    level : list[str]
+        Batch and plate of the unit of work, and cycle for SBS images.
+    level_df : pl.LazyFrame
+        Images of the unit of work.
+    out_path : Path | CloudPath
+        Path to the LoadData directory.
+    corr_images_path : Path | CloudPath
+        Path | CloudPath to corr images directory.
+    path_mask : str
+        Path prefix mask to use.
+
+    """
+    if len(level) == 2:
+        # Write loaddata assuming no image nesting with cycles
+        write_loaddata_csv_by_batch_plate(
+            level_df.collect(), out_path, corr_images_path, path_mask, *level
+        )
+    else:
+        # Write loaddata assuming image nesting with cycles
+        write_loaddata_csv_by_batch_plate_cycle(
+            level_df.collect(), out_path, corr_images_path, path_mask, *level
+        )
+
+
 def gen_pre_segcheck_load_data_by_batch_plate(
     index_path: Path | CloudPath,
     out_path: Path | CloudPath,
     path_mask: str | None,
     corr_images_path: Path | CloudPath | None = None,
     for_sbs: bool = False,
+    jobs: int = 1,
 ) -> None:
     """Generate load data for pre-segcheck pipeline.
 
@@ -192,6 +228,8 @@ def gen_pre_segcheck_load_data_by_batch_plate(
         Path | CloudPath to corr images directory.
     for_sbs : str | None
         Generate illums for SBS images.
+    jobs : int
+        Number of parallel jobs to use.
 
     """
     # Construct illum path if not given
@@ -199,7 +237,7 @@ def gen_pre_segcheck_load_data_by_batch_plate(
         corr_images_path = index_path.parents[1].joinpath("illum/cp/illum_apply")
     elif corr_images_path is None and for_sbs:
         corr_images_path = index_path.parents[1].joinpath("illum/sbs/illum_apply")
-    df = pl.read_parquet(index_path.resolve().__str__())
+    df = load_index(index_path)
 
     # Filter for relevant images
     if not for_sbs:
@@ -215,8 +253,6 @@ def gen_pre_segcheck_load_data_by_batch_plate(
     if len(images_df) > 10:
         images_df = images_df.sample(fraction=0.1)
 
-    images_hierarchy_dict = gen_image_hierarchy(images_df)
-
     # Query default path prefix
     default_path_prefix = images_df.select("prefix").unique().to_series().to_list()[0]
 
@@ -224,27 +260,19 @@ def gen_pre_segcheck_load_data_by_batch_plate(
     if path_mask is None:
         path_mask = default_path_prefix
 
-    # Setup chunking and write loaddata for each batch/plate
-    for batch in images_hierarchy_dict.keys():
-        for plate in images_hierarchy_dict[batch].keys():
-            if not for_sbs:
-                # Write loaddata assuming no image nesting with cycles
-                write_loaddata_csv_by_batch_plate(
-                    images_df, out_path, corr_images_path, path_mask, batch, plate
-                )
-            else:
-                # Write loaddata assuming image nesting with cycles
-                plate_cycles_list = get_cycles_by_batch_plate(images_df, batch, plate)
-                for cycle in plate_cycles_list:
-                    write_loaddata_csv_by_batch_plate_cycle(
-                        images_df,
-                        out_path,
-                        corr_images_path,
-                        path_mask,
-                        batch,
-                        plate,
-                        cycle,
-                    )
+    # Setup chunking and write loaddata for each batch/plate (and cycle)
+    uow_hierarchy = ["batch_id", "plate_id"]
+    if for_sbs:
+        uow_hierarchy.append("cycle_id")
+    write_loaddata_levels(
+        images_df,
+        uow_hierarchy,
+        write_level_loaddata,
+        jobs=jobs,
+        out_path=out_path,
+        corr_images_path=corr_images_path,
+        path_mask=path_mask,
+    )
 
 
 ###################################
@@ -490,20 +518,21 @@ def gen_pre_segcheck_cppipe_by_batch_plate(
     # Default run dir should already be present, otherwise CP raises an error
     out_dir.mkdir(exist_ok=True, parents=True)
 
-    # Get all the generated load data files by batch
-    if not for_sbs:
-        type_suffix = "painting"
-        files_by_hierarchy = get_files_by(["batch"], load_data_path, "*.csv")
-    else:
-        type_suffix = "sbs"
-        files_by_hierarchy = get_files_by(["batch", "plate"], load_data_path, "*.csv")
-
-    # get one of the load data file for generating cppipe
-    _, files = flatten_dict(files_by_hierarchy)[0]
-    with CellProfilerContext(out_dir=workspace_path) as cpipe:
-        cpipe = generate_pre_segcheck_pipeline(
-            cpipe, files[0], nuclei_channel, cell_channel, for_sbs
-        )
-        filename = f"presegcheck_{type_suffix}.cppipe"
-        with out_dir.joinpath(filename).open("w") as f:
-            cpipe.dump(f)
+    with staged_directory(out_dir, delete=False) as staging_dir:
+        # Get all the generated load data files by batch
+        if not for_sbs:
+            type_suffix = "painting"
+            files_by_hierarchy = get_files_by(["batch"], load_data_path, "*.csv")
+        else:
+            type_suffix = "sbs"
+            files_by_hierarchy = get_files_by(["batch", "plate"], load_data_path, "*.csv")
+
+        # get one of the load data file for generating cppipe
+        _, files = flatten_dict(files_by_hierarchy)[0]
+        with CellProfilerContext(out_dir=workspace_path) as cpipe:
+            cpipe = generate_pre_segcheck_pipeline(
+                cpipe, files[0], nuclei_channel, cell_channel, for_sbs
+            )
+            filename = f"presegcheck_{type_suffix}.cppipe"
+            with staging_dir.joinpath(filename).open("w") as f:
+                cpipe.dump(f)
@@ -1,6 +1,5 @@
 """Segmenation check commands."""
 
-import csv
 from io import TextIOWrapper
 from pathlib import Path
 
@@ -67,24 +66,27 @@ from cellprofiler_core.pipeline.io import dump as dumpit
 from cellprofiler_core.preferences import json
 from cloudpathlib import AnyPath, CloudPath
 
-from starrynight.algorithms.index import PCPIndex
 from starrynight.modules.cp_illum_apply.constants import (
     CP_ILLUM_APPLY_OUT_PATH_SUFFIX,
 )
 from starrynight.templates import get_templates_path
 from starrynight.utils.cellprofiler import CellProfilerContext
 from starrynight.utils.dfutils import (
-    filter_df_by_hierarchy,
-    filter_images,
-    gen_image_hierarchy,
     gen_legacy_channel_map,
     get_channels_by_batch_plate,
     get_channels_from_df,
     get_cycles_by_batch_plate,
     get_default_path_prefix,
+    load_images,
+    parse_index_num,
 )
-from starrynight.utils.globbing import flatten_all, flatten_dict, get_files_by
-from starrynight.utils.misc import resolve_path_loaddata
+from starrynight.utils.globbing import flatten_dict, get_files_by
+from starrynight.utils.loaddata import (
+    well_value_expr,
+    write_loaddata_csv,
+    write_loaddata_levels,
+)
+from starrynight.utils.misc import resolve_path_loaddata, staged_directory
 
 ###############################
 ## Load data generation
@@ -101,15 +103,25 @@ def get_filename_header(
 
 
 def get_filename_value(
-    index: PCPIndex,
     ch: str,
     use_legacy: bool = False,
     legacy_channel_map: dict = {},
-) -> str:
+) -> pl.Expr:
     if not use_legacy:
-        return f"Plate_{index.plate_id}_Well_{index.well_id}_Site_{int(index.site_id)}_Corr{ch}.tiff"
+        suffix = f"_Corr{ch}.tiff"
     else:
-        return f"Plate_{index.plate_id}_Well_{index.well_id}_Site_{int(index.site_id)}_Corr{legacy_channel_map[ch]}.tiff"
+        suffix = f"_Corr{legacy_channel_map[ch]}.tiff"
+    return pl.concat_str(
+        [
+            pl.lit("Plate_"),
+            pl.col("plate_id"),
+            pl.lit("_Well_"),
+            pl.col("well_id"),
+            pl.lit("_Site_"),
+            parse_index_num("site_id"),
+            pl.lit(suffix),
+        ]
+    )
 
 
 def get_pathname_header(
@@ -132,8 +144,6 @@ def write_loaddata_segcheck(
     use_legacy: bool = False,
     exp_config_path: Path | CloudPath | None = None,
 ) -> None:
-    # setup csv headers and write the header first
-    loaddata_writer = csv.writer(f, delimiter=",", quoting=csv.QUOTE_MINIMAL)
     legacy_channel_map = {}
 
     if use_legacy:
@@ -159,46 +169,86 @@ def write_loaddata_segcheck(
         get_pathname_header(ch, use_legacy, legacy_channel_map)
         for ch in plate_channel_list
     ]
-    loaddata_writer.writerow(
+    filenames = [
+        get_filename_value(ch, use_legacy, legacy_channel_map)
+        for ch in plate_channel_list
+    ]
+    pathname = str(resolve_path_loaddata(AnyPath(path_mask), corr_images_path))
+
+    # Build all the rows from the index in one go
+    write_loaddata_csv(
+        images_df,
+        [*metadata_heads, *filename_heads, *pathname_heads],
         [
-            *metadata_heads,
-            *filename_heads,
-            *pathname_heads,
-        ]
+            # Metadata heads
+            pl.col("batch_id"),
+            pl.col("plate_id"),
+            pl.col("site_id"),
+            pl.col("well_id"),
+            well_value_expr(),
+            # Filename heads
+            *filenames,
+            # Pathname heads
+            *[pl.lit(pathname) for _ in pathname_heads],
+        ],
+        f,
     )
-    for index in images_df.collect().to_dicts():
-        index = PCPIndex(**index)
-        filenames = [
-            get_filename_value(index, ch, use_legacy, legacy_channel_map)
-            for ch in plate_channel_list
-        ]
-        pathnames = [
-            resolve_path_loaddata(AnyPath(path_mask), corr_images_path)
-            for _ in range(len(pathname_heads))
-        ]
 
-        # Extract well value from well_id by stripping 'Well' prefix if present
-        well_value = (
-            index.well_id[4:]
-            if index.well_id.startswith("Well")
-            else index.well_id
-        )
 
-        # make sure frame heads are matched with their order in the filenames
-        assert index.key is not None
-        loaddata_writer.writerow(
-            [
-                # Metadata heads
-                index.batch_id,
-                index.plate_id,
-                index.site_id,
-                index.well_id,
-                well_value,
-                # Filename heads
-                *filenames,
-                # Pathname heads
-                *pathnames,
-            ]
+def write_level_loaddata(
+    level: list[str],
+    level_df: pl.LazyFrame,
+    out_path: Path | CloudPath,
+    path_mask: str,
+    corr_images_path: Path | CloudPath,
+    nuclei_channel: str,
+    cell_channel: str,
+    use_legacy: bool = False,
+    exp_config_path: Path | CloudPath | None = None,
+) -> None:
+    """Write the segcheck LoadData of a unit of work.
+
+    Parameters
+    ----------
+    level : list[str]
+        Level values of the unit of work.
+    level_df : pl.LazyFrame
+        Images of the unit of work.
+    out_path : Path | CloudPath
+        Path to the LoadData directory.
+    path_mask : str
+        Path prefix mask to use.
+    corr_images_path : Path | CloudPath
+        Path to corrected images.
+    nuclei_channel : str
+        Channel to use for nuclei segmentation.
+    cell_channel : str
+        Channel to use for cell segmentation.
+    use_legacy : bool
+        Use legacy cppipe and loaddata.
+    exp_config_path : Path | CloudPath
+        Path to experiment config json path.
+
+    """
+    # Setup channel list for this level
+    plate_channel_list = get_channels_from_df(level_df)
+
+    # Construct filename for the loaddata csv
+    level_out_path = out_path.joinpath(f"{'^'.join(level)}#segcheck.csv")
+
+    # Construct corr images path for this level
+    corr_images_path_level = corr_images_path.joinpath("-".join(level))
+    with level_out_path.open("w") as f:
+        write_loaddata_segcheck(
+            level_df,
+            plate_channel_list,
+            corr_images_path_level,
+            nuclei_channel,
+            cell_channel,
+            path_mask,
+            f,
+            use_legacy,
+            exp_config_path,
         )
 
 
@@ -212,6 +262,7 @@ def gen_segcheck_load_data(
     use_legacy: bool = False,
     exp_config_path: Path | CloudPath | None = None,
     uow_hierarchy: list[str] = None,
+    jobs: int = 1,
 ) -> None:
     """Generate load data for segcheck pipeline.
 
@@ -235,6 +286,8 @@ def gen_segcheck_load_data(
         Path to experiment config json path.
     uow_hierarchy : list[str] | None
         Unit of work list
+    jobs : int
+        Number of parallel jobs to use.
 
     """
     # Construct corr images path if not given
@@ -243,10 +296,8 @@ def gen_segcheck_load_data(
             CP_ILLUM_APPLY_OUT_PATH_SUFFIX
         )
 
-    df = pl.scan_parquet(index_path.resolve().__str__())
-
-    # Filter for relevant images
-    images_df = filter_images(df, False)
+    # Load relevant images, shared by the stages run in this process
+    images_df = load_images(index_path, False)
 
     # Only subsample if df is large
     # TODO: implement contiguous sampling
@@ -254,7 +305,7 @@ def gen_segcheck_load_data(
     #     images_df = images_df.sample(fraction=0.1)
 
     # Query default path prefix
-    default_path_prefix = get_default_path_prefix(images_df)
+    default_path_prefix = get_default_path_prefix(images_df.lazy(), index_path)
 
     # Setup path mask (required for resolving pathnames during the execution)
     if path_mask is None:
@@ -267,33 +318,19 @@ def gen_segcheck_load_data(
         "well_id",
         "site_id",
     ]
-    images_hierarchy_dict = gen_image_hierarchy(images_df, uow_hierarchy)
-
-    levels = flatten_all(images_hierarchy_dict)
-    for level in levels:
-        # setup filtered df for chunked levels
-        level_df = filter_df_by_hierarchy(images_df, level, False)
-
-        # Setup channel list for this level
-        plate_channel_list = get_channels_from_df(level_df)
-
-        # Construct filename for the loaddata csv
-        level_out_path = out_path.joinpath(f"{'^'.join(level)}#segcheck.csv")
-
-        # Construct corr images path for this level
-        corr_images_path_level = corr_images_path.joinpath("-".join(level))
-        with level_out_path.open("w") as f:
-            write_loaddata_segcheck(
-                level_df,
-                plate_channel_list,
-                corr_images_path_level,
-                nuclei_channel,
-                cell_channel,
-                path_mask,
-                f,
-                use_legacy,
-                exp_config_path,
-            )
+    write_loaddata_levels(
+        images_df,
+        uow_hierarchy,
+        write_level_loaddata,
+        jobs=jobs,
+        out_path=out_path,
+        path_mask=path_mask,
+        corr_images_path=corr_images_path,
+        nuclei_channel=nuclei_channel,
+        cell_channel=cell_channel,
+        use_legacy=use_legacy,
+        exp_config_path=exp_config_path,
+    )
     return out_path
 
 
@@ -640,26 +677,28 @@ def gen_segcheck_cppipe(
     # Default run dir should already be present, otherwise CP raises an error
     out_dir.mkdir(exist_ok=True, parents=True)
 
-    filename = "segcheck_painting.cppipe"
+    with staged_directory(out_dir, delete=False) as staging_dir:
+        filename = "segcheck_painting.cppipe"
 
-    # Write old cppipe and return early if use_old is true
-    if use_legacy:
-        ref_cppipe = (
-            get_templates_path() / "cppipe/ref_3_CP_SegmentationCheck.cppipe"
-        )
+        # Write old cppipe and return early if use_old is true
+        if use_legacy:
+            ref_cppipe = (
+                get_templates_path()
+                / "cppipe/ref_3_CP_SegmentationCheck.cppipe"
+            )
 
-        out_dir.joinpath(filename).write_text(ref_cppipe.read_text())
-        return
+            staging_dir.joinpath(filename).write_text(ref_cppipe.read_text())
+            return
 
-    # get one of the load data file for generating cppipe
-    sample_loaddata_file = next(load_data_path.rglob("*.csv"))
+        # get one of the load data file for generating cppipe
+        sample_loaddata_file = next(load_data_path.rglob("*.csv"))
 
-    with CellProfilerContext(out_dir=workspace_path) as cpipe:
-        cpipe = generate_segcheck_pipeline(
-            cpipe, sample_loaddata_file, nuclei_channel, cell_channel
-        )
-        with out_dir.joinpath(filename).open("w") as f:
-            cpipe.dump(f)
-        filename = "segcheck_painting.json"
-        with out_dir.joinpath(filename).open("w") as f:
-            dumpit(cpipe, f, version=6)
+        with CellProfilerContext(out_dir=workspace_path) as cpipe:
+            cpipe = generate_segcheck_pipeline(
+                cpipe, sample_loaddata_file, nuclei_channel, cell_channel
+            )
+            with staging_dir.joinpath(filename).open("w") as f:
+                cpipe.dump(f)
+            filename = "segcheck_painting.json"
+            with staging_dir.joinpath(filename).open("w") as f:
+                dumpit(cpipe, f, version=6)
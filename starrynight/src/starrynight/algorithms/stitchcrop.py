@@ -12,11 +12,12 @@ from cloudpathlib import AnyPath, CloudPath
 
 from starrynight.algorithms.index import PCPIndex
 from starrynight.utils.dfutils import (
-    gen_image_hierarchy,
     get_channels_by_batch_plate,
     get_cycles_by_batch_plate,
+    load_index,
 )
 from starrynight.utils.globbing import flatten_dict, get_files_by
+from starrynight.utils.loaddata import write_loaddata_levels
 from starrynight.utils.misc import resolve_path_loaddata
 from starrynight.utils.pyimagej import ImagejContext
 
@@ -60,8 +61,12 @@ def write_loaddata(
 
     index = images_df[0].to_dicts()[0]
     index = PCPIndex(**index)
+    # Wells and sites are sorted, so that the rows do not depend on the index
     wells_sites = (
-        images_df.group_by("well_id").agg(pl.col("site_id").unique()).to_dicts()
+        images_df.group_by("well_id")
+        .agg(pl.col("site_id").unique().sort())
+        .sort("well_id")
+        .to_dicts()
     )
     for well_sites in wells_sites:
         index.well_id = well_sites["well_id"]
@@ -132,12 +137,52 @@ def write_loaddata_csv_by_batch_plate_cycle(
         )
 
 
+def write_level_loaddata(
+    level: list[str],
+    level_df: pl.LazyFrame,
+    out_path: Path | CloudPath,
+    corr_images_path: Path | CloudPath,
+    nuclei_channel: str,
+    path_mask: str,
+) -> None:
+    """Write the stitch and crop LoadData of a batch and plate.
+
+    Parameters
+    ----------
+    level : list[str]
+        Batch and plate of the unit of work.
+    level_df : pl.LazyFrame
+        Images of the unit of work.
+    out_path : Path | CloudPath
+        Path to the LoadData directory.
+    corr_images_path : Path | CloudPath
+        Path | CloudPath to corr images directory.
+    nuclei_channel: str
+        Channel to use for doing nuclei segmentation
+    path_mask : str
+        Path prefix mask to use.
+
+    """
+    batch, plate = level
+    out_path.joinpath(batch, plate).mkdir(parents=True, exist_ok=True)
+    write_loaddata_csv_by_batch_plate_cycle(
+        level_df.collect(),
+        out_path,
+        corr_images_path,
+        nuclei_channel,
+        path_mask,
+        batch,
+        plate,
+    )
+
+
 def gen_align_load_data_by_batch_plate(
     index_path: Path | CloudPath,
     out_path: Path | CloudPath,
     path_mask: str | None,
     nuclei_channel: str,
     corr_images_path: Path | CloudPath | None = None,
+    jobs: int = 1,
 ) -> None:
     """Generate load data for stitch and crop pipeline.
 
@@ -153,6 +198,8 @@ def gen_align_load_data_by_batch_plate(
         Channel to use for doing nuclei segmentation
     corr_images_path : Path | CloudPath
         Path | CloudPath to corr images directory.
+    jobs : int
+        Number of parallel jobs to use.
 
     """
     # Construct illum path if not given
@@ -161,15 +208,13 @@ def gen_align_load_data_by_batch_plate(
             "illum/sbs/illum_apply"
         )
 
-    df = pl.read_parquet(index_path.resolve().__str__())
+    df = load_index(index_path)
 
     # Filter for relevant images
     images_df = df.filter(
         pl.col("is_sbs_image").eq(True), pl.col("is_image").eq(True)
     )
 
-    images_hierarchy_dict = gen_image_hierarchy(images_df)
-
     # Query default path prefix
     default_path_prefix = (
         images_df.select("prefix").unique().to_series().to_list()[0]
@@ -180,17 +225,16 @@ def gen_align_load_data_by_batch_plate(
         path_mask = default_path_prefix
 
     # Setup chunking and write loaddata for each batch/plate
-    for batch in images_hierarchy_dict.keys():
-        for plate in images_hierarchy_dict[batch].keys():
-            write_loaddata_csv_by_batch_plate_cycle(
-                images_df,
-                out_path,
-                corr_images_path,
-                nuclei_channel,
-                path_mask,
-                batch,
-                plate,
-            )
+    write_loaddata_levels(
+        images_df,
+        ["batch_id", "plate_id"],
+        write_level_loaddata,
+        jobs=jobs,
+        out_path=out_path,
+        corr_images_path=corr_images_path,
+        nuclei_channel=nuclei_channel,
+        path_mask=path_mask,
+    )
 
 
 ###################################
@@ -65,7 +65,6 @@ from starrynight.templates import get_templates_path
 from starrynight.utils.cellprofiler import CellProfilerContext
 from starrynight.utils.dfutils import (
     filter_df_by_hierarchy,
-    filter_images,
     gen_image_hierarchy,
     gen_legacy_channel_map,
     get_channels_by_batch_plate,
@@ -73,6 +72,7 @@ from starrynight.utils.dfutils import (
     get_cycles_by_batch_plate,
     get_cycles_from_df,
     get_default_path_prefix,
+    load_images,
 )
 from starrynight.utils.globbing import flatten_all, flatten_dict, get_files_by
 from starrynight.utils.misc import resolve_path_loaddata
@@ -164,14 +164,13 @@ def gen_stitchcrop_pipeline(
         exp_config_path = index_path.parents[1].joinpath(
             "experiment/experiment.json"
         )
-    # Load index
-    df = pl.scan_parquet(index_path.resolve().__str__())
-
-    # Filter for relevant images
-    images_df = filter_images(df, for_sbs)
+    # Load relevant images, shared by the stages run in this process
+    images_df = load_images(index_path, for_sbs).lazy()
 
     # Query default path prefix
-    default_path_prefix: str = get_default_path_prefix(images_df)
+    default_path_prefix: str = get_default_path_prefix(
+        images_df, index_path, for_sbs
+    )
 
     # Setup path mask (required for resolving pathnames during the execution)
     if path_mask is None:
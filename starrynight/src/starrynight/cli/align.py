@@ -1,5 +1,7 @@
 """Align module cli wrapper."""
 
+from multiprocessing import cpu_count
+
 import click
 from cloudpathlib import AnyPath
 
@@ -15,12 +17,14 @@ from starrynight.algorithms.align import (
 @click.option("-c", "--corr_images", required=True)
 @click.option("-n", "--nuclei", required=True)
 @click.option("-m", "--path_mask", default=None)
+@click.option("-j", "--jobs", default=None, type=int)
 def gen_align_load_data(
     index: str,
     out: str,
     corr_images: str,
     nuclei: str,
     path_mask: str | None,
+    jobs: int | None,
 ) -> None:
     """Generate align loaddata file.
 
@@ -36,10 +40,17 @@ def gen_align_load_data(
         Channel to use for nuceli segmentation
     path_mask : str | Mask
         Path prefix mask to use. Can be local or a cloud path.
+    jobs : int | None
+        Number of parallel jobs. Defaults to the number of cpus.
 
     """
     gen_align_load_data_by_batch_plate(
-        AnyPath(index), AnyPath(out), path_mask, nuclei, AnyPath(corr_images)
+        AnyPath(index),
+        AnyPath(out),
+        path_mask,
+        nuclei,
+        AnyPath(corr_images),
+        jobs=jobs or cpu_count(),
     )
 
 
@@ -5,7 +5,7 @@ from pathlib import Path
 import click
 from cloudpathlib import AnyPath, CloudPath
 
-from starrynight.algorithms.cp import run_cp_parallel
+from starrynight.algorithms.cp import benchmark_cp_startup, run_cp_parallel
 
 
 @click.command(name="cp")
@@ -15,6 +15,8 @@ from starrynight.algorithms.cp import run_cp_parallel
 @click.option("-d", "--plugin_dir", default=None)
 @click.option("-j", "--jobs", default=180)
 @click.option("--sbs", is_flag=True, default=False)
+@click.option("--warm_start/--no_warm_start", default=True)
+@click.option("--benchmark_startup", is_flag=True, default=False)
 def invoke_cp(
     cppipe: str | Path | CloudPath,
     loaddata: str | Path | CloudPath,
@@ -22,6 +24,8 @@ def invoke_cp(
     plugin_dir: str | Path | None,
     jobs: int,
     sbs: bool,
+    warm_start: bool,
+    benchmark_startup: bool,
 ) -> None:
     """Invoke cellprofiler.
 
@@ -39,6 +43,11 @@ def invoke_cp(
         Number of jobs to launch.
     sbs : bool
         Flag for treating as sbs images.
+    warm_start : bool
+        Fork the workers from a process with CellProfiler preloaded.
+    benchmark_startup : bool
+        Print the time to the first image set of cold and warm started
+        workers instead of running the pipeline.
 
     """
     # Check if cppipe path is not a dir
@@ -61,4 +70,9 @@ def invoke_cp(
     if len(uow) == 0:
         print("Found 0 cppipe files. No work to be done. Exiting...")
         return
-    run_cp_parallel(uow, AnyPath(out), plugin_dir, jobs)  # pyright: ignore
+    if benchmark_startup:
+        timings = benchmark_cp_startup(uow, plugin_dir, jobs)  # pyright: ignore
+        for name, seconds in timings.items():
+            print(f"{name} start: {seconds:.2f}s to the first image set")
+        return
+    run_cp_parallel(uow, AnyPath(out), plugin_dir, jobs, warm_start)  # pyright: ignore
@@ -1,5 +1,6 @@
 """Illum Calculate module cli wrapper."""
 
+from multiprocessing import cpu_count
 from pathlib import Path
 
 import click
@@ -30,6 +31,7 @@ from starrynight.algorithms.illum_calc import (
 @click.option("--use_legacy", is_flag=True, default=False)
 @click.option("--exp_config", default=None)
 @click.option("--uow", default=None)
+@click.option("-j", "--jobs", default=None, type=int)
 def gen_illum_calc_load_data_cli(
     index: str,
     out: str,
@@ -38,6 +40,7 @@ def gen_illum_calc_load_data_cli(
     use_legacy: bool,
     exp_config: str | None,
     uow: str | None,
+    jobs: int | None,
 ) -> None:
     """Generate illum calc loaddata file.
 
@@ -57,6 +60,8 @@ def gen_illum_calc_load_data_cli(
         Experiment config json path. Can be local or a cloud path.
     uow : list[str] | None
         Unit of work list
+    jobs : int | None
+        Number of parallel jobs. Defaults to the number of cpus.
 
     """
     if uow is not None:
@@ -74,6 +79,7 @@ def gen_illum_calc_load_data_cli(
         use_legacy,
         exp_config,
         uow,
+        jobs=jobs or cpu_count(),
     )
 
 
@@ -138,6 +144,7 @@ def run_illum_calc_qc_cli(exp: str, out: str, sbs: bool) -> None:
 @click.option("--use_legacy", is_flag=True, default=False)
 @click.option("--exp_config", default=None)
 @click.option("--uow", default=None)
+@click.option("-j", "--jobs", default=None, type=int)
 def gen_illum_apply_load_data_cli(
     index: str,
     out: str,
@@ -148,6 +155,7 @@ def gen_illum_apply_load_data_cli(
     use_legacy: bool,
     exp_config: str | None,
     uow: str | None,
+    jobs: int | None,
 ) -> None:
     """Generate illum apply loaddata file.
 
@@ -171,6 +179,8 @@ def gen_illum_apply_load_data_cli(
         Experiment config json path. Can be local or a cloud path.
     uow : list[str] | None
         Unit of work list
+    jobs : int | None
+        Number of parallel jobs. Defaults to the number of cpus.
 
     """
     if uow is not None:
@@ -193,6 +203,7 @@ def gen_illum_apply_load_data_cli(
             use_legacy,
             exp_config,
             uow,
+            jobs=jobs or cpu_count(),
         )
     else:
         if use_legacy is False:
@@ -206,6 +217,7 @@ def gen_illum_apply_load_data_cli(
             use_legacy,
             exp_config,
             uow,
+            jobs=jobs or cpu_count(),
         )
 
 
@@ -1,9 +1,11 @@
 """Generate index cli wrapper."""
 
+from multiprocessing import cpu_count
+
 import click
 from cloudpathlib import AnyPath
 
-from starrynight.algorithms.index import gen_pcp_index
+from starrynight.algorithms.index import gen_pcp_index, update_pcp_index
 from starrynight.parsers.common import ParserType, get_parser
 from starrynight.parsers.transformer_vincent import VincentAstToIR
 
@@ -12,10 +14,16 @@ from starrynight.parsers.transformer_vincent import VincentAstToIR
 @click.option("-i", "--inv", required=True)
 @click.option("-o", "--out", required=True)
 @click.option("-p", "--parser", default=None)
+@click.option("--partition", is_flag=True, default=False)
+@click.option("-j", "--jobs", default=None, type=int)
+@click.option("--incremental", is_flag=True, default=False)
 def gen_index(
     inv: str,
     out: str,
     parser: str | None,
+    partition: bool,
+    jobs: int | None,
+    incremental: bool,
 ) -> None:
     """Generate index files.
 
@@ -29,16 +37,42 @@ def gen_index(
         Output path. Can be local or a cloud path.
     parser : str
         Custom parser to parse the file paths.
+    partition : bool
+        Write the index as a dataset partitioned by batch, plate and cycle.
+    jobs : int | None
+        Number of parallel jobs. Defaults to the number of cpus.
+    incremental : bool
+        Update the previous index with the `inventory_delta.parquet` next
+        to the inventory. The previous layout is kept. The index is
+        generated in full if there is no previous index, or if the delta
+        was not computed from the inventory of the index to the current one.
 
     """
     if parser is not None:
         parser = AnyPath(parser)
     path_parser = get_parser(ParserType.OPS_VINCENT, parser)
+    delta_path = AnyPath(inv).parent.joinpath("inventory_delta.parquet")
+    if incremental and not delta_path.exists():
+        print("No inventory delta found. Creating full index...")
+        incremental = False
+    if incremental:
+        update_pcp_index(
+            AnyPath(inv),
+            delta_path,
+            AnyPath(out),
+            path_parser,
+            VincentAstToIR,
+            partition,
+            jobs=jobs or cpu_count(),
+        )
+        return
     gen_pcp_index(
         AnyPath(inv),
         AnyPath(out),
         path_parser,
         VincentAstToIR,
+        partition,
+        jobs=jobs or cpu_count(),
     )
 
 
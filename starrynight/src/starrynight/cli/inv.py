@@ -3,13 +3,27 @@
 import click
 from cloudpathlib import AnyPath
 
-from starrynight.algorithms.inventory import create_inventory
+from starrynight.algorithms.inventory import (
+    create_inventory,
+    create_inventory_from_manifest,
+)
 
 
 @click.command(name="gen")
 @click.option("-d", "--dataset", required=True)
 @click.option("-o", "--out", required=True)
-def gen_inv(dataset: str, out: str) -> None:
+@click.option("-j", "--jobs", default=None, type=int)
+@click.option("--incremental", is_flag=True, default=False)
+@click.option("--subtree", multiple=True)
+@click.option("--manifest", default=None)
+def gen_inv(
+    dataset: str,
+    out: str,
+    jobs: int | None,
+    incremental: bool,
+    subtree: tuple[str, ...],
+    manifest: str | None,
+) -> None:
     """Generate inventory files.
 
     Parameters
@@ -18,8 +32,36 @@ def gen_inv(dataset: str, out: str) -> None:
         Dataset path. Can be local or a cloud path.
     out : str
         Output path. Can be local or a cloud path.
+    jobs : int | None
+        Number of parallel jobs. Defaults to the number of cpus.
+    incremental : bool
+        Refresh the previous inventory and write a delta file. Changed
+        directories are not detected: without --subtree the whole dataset
+        is listed again, only the delta is incremental.
+    subtree : tuple[str, ...]
+        Dataset directories to list again, requires --incremental.
+        Can be local or cloud paths.
+    manifest : str | None
+        S3 Inventory manifest.json or listing file to build the inventory
+        from instead of listing the dataset. Can be local or a cloud path.
+
     """
-    create_inventory(AnyPath(dataset), AnyPath(out))  # pyright: ignore
+    if subtree and not incremental:
+        raise click.UsageError("--subtree requires --incremental")
+    if manifest is not None:
+        create_inventory_from_manifest(
+            AnyPath(manifest),  # pyright: ignore
+            AnyPath(dataset),  # pyright: ignore
+            AnyPath(out),  # pyright: ignore
+        )
+        return
+    create_inventory(
+        AnyPath(dataset),  # pyright: ignore
+        AnyPath(out),  # pyright: ignore
+        jobs,
+        incremental=incremental,
+        subtrees=[AnyPath(path) for path in subtree],  # pyright: ignore
+    )
 
 
 @click.group()
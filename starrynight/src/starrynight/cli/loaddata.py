@@ -0,0 +1,46 @@
+"""LoadData cli wrapper."""
+
+from multiprocessing import cpu_count
+
+import click
+from cloudpathlib import AnyPath
+
+from starrynight.utils.loaddata import validate_loaddata
+
+
+@click.command(name="validate")
+@click.option("-i", "--loaddata", required=True)
+@click.option("-o", "--out", required=True)
+@click.option("-j", "--jobs", default=None, type=int)
+def validate_loaddata_cli(loaddata: str, out: str, jobs: int | None) -> None:
+    """Check that the files of LoadData csvs exist.
+
+    Fails if any file is missing, after writing them to the report.
+
+    Parameters
+    ----------
+    loaddata : str
+        LoadData csv or dir. Can be local or a cloud path.
+    out : str
+        Missing files report csv path. Can be local or a cloud path.
+    jobs : int | None
+        Number of directories checked at a time. Defaults to the number of
+        cpus.
+
+    """
+    missing_df = validate_loaddata(
+        AnyPath(loaddata), AnyPath(out), jobs=jobs or cpu_count()
+    )
+    if not missing_df.is_empty():
+        raise click.ClickException(
+            f"{missing_df.height} LoadData files are missing, see {out}"
+        )
+
+
+@click.group()
+def loaddata() -> None:
+    """LoadData commands."""
+    pass
+
+
+loaddata.add_command(validate_loaddata_cli)
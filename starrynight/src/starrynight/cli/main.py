@@ -9,6 +9,7 @@ from starrynight.cli.exp import exp
 from starrynight.cli.illum import illum
 from starrynight.cli.index import index
 from starrynight.cli.inv import inventory
+from starrynight.cli.loaddata import loaddata
 from starrynight.cli.preprocess import preprocess
 from starrynight.cli.presegcheck import presegcheck
 from starrynight.cli.segcheck import segcheck
@@ -32,3 +33,4 @@ main.add_command(preprocess)
 main.add_command(analysis)
 main.add_command(exp)
 main.add_command(stitchcrop)
+main.add_command(loaddata)
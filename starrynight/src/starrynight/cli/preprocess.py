@@ -1,5 +1,7 @@
 """Preprocess module cli wrapper."""
 
+from multiprocessing import cpu_count
+
 import click
 from cloudpathlib import AnyPath
 
@@ -19,6 +21,7 @@ from starrynight.algorithms.preprocess import (
 @click.option("--use_legacy", is_flag=True, default=False)
 @click.option("--exp_config", default=None)
 @click.option("--uow", default=None)
+@click.option("-j", "--jobs", default=None, type=int)
 def gen_preprocess_load_data_cli(
     index: str,
     out: str,
@@ -29,6 +32,7 @@ def gen_preprocess_load_data_cli(
     use_legacy: bool,
     exp_config: str | None,
     uow: str | None,
+    jobs: int | None,
 ) -> None:
     """Generate preprocess loaddata file.
 
@@ -52,6 +56,8 @@ def gen_preprocess_load_data_cli(
         Experiment config json path. Can be local or a cloud path.
     uow : list[str] | None
         Unit of work list
+    jobs : int | None
+        Number of parallel jobs. Defaults to the number of cpus.
 
     """
     if uow is not None:
@@ -73,6 +79,7 @@ def gen_preprocess_load_data_cli(
         use_legacy,
         exp_config,
         uow,
+        jobs=jobs or cpu_count(),
     )
 
 
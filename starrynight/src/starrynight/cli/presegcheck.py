@@ -1,5 +1,7 @@
 """Pre segcheck module cli wrapper."""
 
+from multiprocessing import cpu_count
+
 import click
 from cloudpathlib import AnyPath
 
@@ -15,8 +17,14 @@ from starrynight.algorithms.presegcheck import (
 @click.option("-c", "--corr_images", required=True)
 @click.option("-m", "--path_mask", default=None)
 @click.option("--sbs", is_flag=True, default=False)
+@click.option("-j", "--jobs", default=None, type=int)
 def gen_pre_segcheck_load_data(
-    index: str, out: str, corr_images: str, path_mask: str | None, sbs: bool
+    index: str,
+    out: str,
+    corr_images: str,
+    path_mask: str | None,
+    sbs: bool,
+    jobs: int | None,
 ) -> None:
     """Generate pre segcheck loaddata file.
 
@@ -32,10 +40,17 @@ def gen_pre_segcheck_load_data(
         Path prefix mask to use. Can be local or a cloud path.
     sbs : str | Mask
         Flag for treating as sbs images.
+    jobs : int | None
+        Number of parallel jobs. Defaults to the number of cpus.
 
     """
     gen_pre_segcheck_load_data_by_batch_plate(
-        AnyPath(index), AnyPath(out), path_mask, AnyPath(corr_images), sbs
+        AnyPath(index),
+        AnyPath(out),
+        path_mask,
+        AnyPath(corr_images),
+        sbs,
+        jobs=jobs or cpu_count(),
     )
 
 
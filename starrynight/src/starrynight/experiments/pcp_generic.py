@@ -13,9 +13,9 @@ from starrynight.experiments.common import (
     ImageFrameType,
 )
 from starrynight.utils.dfutils import (
-    filter_images,
-    get_channels_from_df,
-    select_column_unique_vals,
+    gen_index_summary,
+    read_index_summary,
+    scan_index,
 )
 
 
@@ -98,34 +98,24 @@ class PCPGeneric(Experiment):
             init_config["cp_custom_channel_map"] = None
 
         init_config_parsed = PCPGenericInitConfig.model_validate(init_config)
+        # Read the summary sidecar of the index, or summarize the index
         if index_path.name.endswith(".csv"):
-            index_df = pl.scan_csv(index_path)
+            summary = gen_index_summary(pl.scan_csv(index_path))
         else:
-            index_df = pl.scan_parquet(index_path)
+            summary = read_index_summary(index_path)
+            if summary is None:
+                summary = gen_index_summary(scan_index(index_path))
 
         # Get dataset_id from index
-        dataset_id = select_column_unique_vals(index_df, "dataset_id")[0]
-
-        # Filter for CP images
-        cp_images_df = filter_images(index_df)
-
-        # Filter for sbs images
-        sbs_images_df = filter_images(index_df, True)
+        dataset_id = summary["dataset_ids"][0]
 
         # Construct CP config
 
         # Extract images per well
-        cp_im_per_well = (
-            cp_images_df.group_by("batch_id", "plate_id", "well_id")
-            .agg(pl.col("key").count())
-            .collect()
-            .select(pl.col("key"))
-            .unique()
-            .rows()[0][0]
-        )
+        cp_im_per_well = summary["cp"]["im_per_well"][0]
 
         # Extract channel list
-        cp_channel_list = get_channels_from_df(cp_images_df)
+        cp_channel_list = summary["cp"]["channels"]
 
         # Check custom channel map
         if init_config_parsed.cp_custom_channel_map is not None:
@@ -137,25 +127,13 @@ class PCPGeneric(Experiment):
         # Construct SBS config
 
         # Extract images per well
-        sbs_im_per_well = (
-            sbs_images_df.group_by(
-                "batch_id", "plate_id", "cycle_id", "well_id"
-            )
-            .agg(pl.col("key").count())
-            .collect()
-            .select(pl.col("key"))
-            .unique()
-            .rows()[0][0]
-        )
+        sbs_im_per_well = summary["sbs"]["im_per_well"][0]
+
         # Extract number of cycles
-        sbs_n_cycles = (
-            sbs_images_df.select(pl.col("cycle_id").unique().count())
-            .collect()
-            .rows()[0][0]
-        )
+        sbs_n_cycles = summary["sbs"]["n_cycles"]
 
         # Extract channel list
-        sbs_channel_list = get_channels_from_df(sbs_images_df)
+        sbs_channel_list = summary["sbs"]["channels"]
 
         # Check custom channel map
         if init_config_parsed.sbs_custom_channel_map is not None:
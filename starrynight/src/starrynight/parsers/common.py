@@ -3,13 +3,20 @@
 import logging
 from abc import abstractmethod
 from enum import Enum
+from functools import lru_cache
 from pathlib import Path
 
+import interegular
 from cloudpathlib.cloudpath import CloudPathT
-from lark import Lark, Transformer
+from lark import Lark, Transformer, Tree
+from lark.exceptions import UnexpectedInput
+from lark.parsers.lalr_parser_state import ParserState
 
 logging.basicConfig(level=logging.INFO)
 
+# Number of directory prefixes with a cached parser state
+DIR_CACHE_SIZE = 4096
+
 
 class ParserType(Enum):
     """Parser types.
@@ -72,3 +79,95 @@ class BaseTransformer(Transformer):
         """Initialize base Lark transformer."""
         super().__init__(visit_tokens)
         self.channel_dict: dict[str, list[str]] = {"channel_dict": []}
+
+
+class DirectoryCachedParser:
+    """LALR path parser that parses every directory prefix only once.
+
+    The parser state after the directory prefix of a key (up to its last
+    `/`) is kept in a bounded LRU cache, so files of the same directory
+    only lex and parse their file name. The resulting trees are the same as
+    the ones of the wrapped parser.
+
+    Resuming from the prefix state is only exact if every token ends at a
+    `/` boundary, so grammars with terminals other than a literal `/`
+    that can match a `/` are rejected.
+
+    Parameters
+    ----------
+    path_parser : Lark
+        LALR path parser.
+    maxsize : int
+        Maximum number of cached directory prefixes.
+
+    """
+
+    def __init__(
+        self, path_parser: Lark, maxsize: int = DIR_CACHE_SIZE
+    ) -> None:
+        """Check the grammar and initialize the cache."""
+        if path_parser.options.parser != "lalr":
+            raise ValueError("Only LALR parsers can be resumed")
+        regexes = {
+            term.name: term.pattern.to_regexp()
+            for term in path_parser.terminals
+            if not (term.pattern.type == "str" and term.pattern.value == "/")
+        }
+        comparator = interegular.Comparator.from_regexes(
+            {**regexes, "/": ".*/.*"}
+        )
+        crossing = [
+            name for name in regexes if not comparator.isdisjoint(name, "/")
+        ]
+        if crossing:
+            raise ValueError(f"Terminals can match a separator: {crossing}")
+        self.path_parser = path_parser
+        self.prefix_state = lru_cache(maxsize)(self.parse_prefix)
+
+    def parse_prefix(self, prefix: str) -> ParserState | None:
+        """Get the parser state after a directory prefix.
+
+        Parameters
+        ----------
+        prefix : str
+            Directory prefix, ending with `/`.
+
+        Returns
+        -------
+        ParserState | None
+            Parser state. None if the prefix cannot be parsed.
+
+        """
+        interactive = self.path_parser.parse_interactive(prefix)
+        try:
+            interactive.exhaust_lexer()
+        except UnexpectedInput:
+            return None
+        return interactive.parser_state
+
+    def parse(self, key: str) -> Tree:
+        """Parse a key.
+
+        Parameters
+        ----------
+        key : str
+            Key to parse.
+
+        Returns
+        -------
+        Tree
+            Parse tree.
+
+        """
+        boundary = key.rfind("/") + 1
+        state = self.prefix_state(key[:boundary]) if boundary > 0 else None
+        if state is None:
+            # Also raises the errors of the full parse
+            return self.path_parser.parse(key)
+        interactive = self.path_parser.parse_interactive(key)
+        interactive.lexer_thread.state.line_ctr.feed(key[:boundary])
+        # Trees of the prefix are shared between keys, only the stacks
+        # are copied
+        interactive.parser_state.state_stack = list(state.state_stack)
+        interactive.parser_state.value_stack = list(state.value_stack)
+        return interactive.resume_parse()
@@ -0,0 +1,602 @@
+"""Regex fast path for Lark path grammars.
+
+Compiles the rules of a path grammar that most keys match into regular
+expressions that can be applied to whole Polars string columns. Values of
+the captured rules are still computed by Lark and the AST transformer, but
+only once for every distinct matched span.
+"""
+
+import re
+from dataclasses import dataclass, field
+
+import polars as pl
+from lark import Lark, Token, Tree
+from lark.exceptions import LarkError
+from lark.grammar import NonTerminal, Terminal
+from lark.lexer import Pattern
+from lark.load_grammar import _literal_to_pattern, load_grammar
+
+from starrynight.parsers.common import BaseTransformer
+
+# Rules of the vincent grammar matched by image keys
+FAST_PATH_RULES = ["_sbs_images", "_cp_images"]
+
+# Characters escaped in literals, valid for both python and rust regexes
+REGEX_META = set("\\.+*?()|[]{}^$#&-~")
+
+
+def escape_regex(value: str) -> str:
+    """Escape a literal for python and polars (rust) regexes.
+
+    Parameters
+    ----------
+    value : str
+        Literal string.
+
+    Returns
+    -------
+    str
+        Escaped literal.
+
+    """
+    return "".join(f"\\{c}" if c in REGEX_META else c for c in value)
+
+
+def get_keyword(pattern: Pattern) -> str | None:
+    """Get the regex counting a keyword of the grammar in a key.
+
+    Parameters
+    ----------
+    pattern : Pattern
+        Pattern of a grammar literal.
+
+    Returns
+    -------
+    str | None
+        Regex of the literal if it is a string of more than one character.
+
+    """
+    if pattern.type != "str" or len(pattern.value) < 2:
+        return None
+    flags = "".join(f"(?{flag})" for flag in sorted(pattern.flags))
+    return f"{flags}{escape_regex(pattern.value)}"
+
+
+@dataclass
+class RegexGroup:
+    """Capture group of a compiled rule.
+
+    Attributes
+    ----------
+    name : Name of the group in the regex.
+    rule : Grammar rule captured by the group. None for repetitions.
+    body : Python regex of one repetition, with its own capture groups.
+    items : Capture groups of the repetition body.
+
+    """
+
+    name: str
+    rule: str | None = None
+    body: re.Pattern | None = None
+    items: list["RegexGroup"] = field(default_factory=list)
+
+
+@dataclass
+class RulePattern:
+    """Regex matching the keys that go through a grammar rule.
+
+    Attributes
+    ----------
+    rule : Grammar rule.
+    regex : Anchored regex with a named group for every captured rule.
+    groups : Capture groups in textual order.
+    keywords : Expected count of every multi-character literal in a key.
+
+    """
+
+    rule: str
+    regex: str
+    groups: list[RegexGroup]
+    keywords: dict[str, int]
+
+
+class RegexBuilder:
+    """Translate the EBNF trees of a Lark grammar to a regex.
+
+    Alternatives and optional items that do not lead to the target rule are
+    dropped, so that the regex only matches keys going through it. Named
+    rules become capture groups, `_` rules are inlined.
+
+    Parameters
+    ----------
+    rule_defs : dict[str, tuple[Tree, object]]
+        Rule trees and options by name.
+    term_defs : dict[str, Tree]
+        Terminal trees by name.
+    target : str
+        Rule the keys must go through.
+
+    """
+
+    def __init__(
+        self,
+        rule_defs: dict[str, tuple[Tree, object]],
+        term_defs: dict[str, Tree],
+        target: str,
+    ) -> None:
+        """Initialize the builder."""
+        self.rule_defs = rule_defs
+        self.term_defs = term_defs
+        self.target = target
+        self.keywords: dict[str, int] = {}
+        self._reaches: dict[str, bool] = {}
+        self._captures: dict[str, bool] = {}
+        self._stack: list[str] = []
+        self._group_idx = 0
+
+    def reaches(self, node: Tree | Token | NonTerminal | Terminal) -> bool:
+        """Check if the target rule is reachable from a node."""
+        if isinstance(node, NonTerminal):
+            if node.name == self.target:
+                return True
+            if node.name not in self._reaches:
+                # Guard against recursive rules
+                self._reaches[node.name] = False
+                self._reaches[node.name] = self.reaches(
+                    self.rule_defs[node.name][0]
+                )
+            return self._reaches[node.name]
+        if isinstance(node, Tree):
+            return any(self.reaches(child) for child in node.children)
+        return False
+
+    def captures(self, node: Tree | Token | NonTerminal | Terminal) -> bool:
+        """Check if a node contains captured rules."""
+        if isinstance(node, NonTerminal):
+            if not node.name.startswith("_"):
+                return True
+            if node.name not in self._captures:
+                self._captures[node.name] = False
+                self._captures[node.name] = self.captures(
+                    self.rule_defs[node.name][0]
+                )
+            return self._captures[node.name]
+        if isinstance(node, Tree):
+            return any(self.captures(child) for child in node.children)
+        return False
+
+    def build(
+        self,
+        node: Tree | NonTerminal | Terminal,
+        groups: list[RegexGroup] | None,
+        must: bool = False,
+        fixed: bool = True,
+    ) -> str:
+        """Build the regex of a node.
+
+        Parameters
+        ----------
+        node : Tree | NonTerminal | Terminal
+            Node of a rule or terminal tree.
+        groups : list[RegexGroup] | None
+            Capture groups found so far. None to not capture rules.
+        must : bool
+            Whether the node has to go through the target rule.
+        fixed : bool
+            Whether the node is matched exactly once. Used to count the
+            keywords of the rule.
+
+        Returns
+        -------
+        str
+            Regex.
+
+        """
+        if isinstance(node, NonTerminal):
+            return self.build_rule(node.name, groups, must, fixed)
+        if isinstance(node, Terminal):
+            return f"(?:{self.build(self.term_defs[node.name], None)})"
+        if not isinstance(node, Tree):
+            raise ValueError(f"Unsupported grammar node: {node}")
+
+        if node.data == "expansions":
+            alternatives = node.children
+            if must:
+                alternatives = [
+                    alt for alt in alternatives if self.reaches(alt)
+                ]
+            if len(alternatives) == 1:
+                return self.build(alternatives[0], groups, must, fixed)
+            return "(?:{})".format(
+                "|".join(
+                    self.build(alt, groups, False, False)
+                    for alt in alternatives
+                )
+            )
+        if node.data == "expansion":
+            return "".join(
+                self.build(child, groups, must and self.reaches(child), fixed)
+                for child in node.children
+            )
+        if node.data == "value":
+            (child,) = node.children
+            return self.build(child, groups, must, fixed)
+        if node.data == "maybe":
+            (child,) = node.children
+            if must and self.reaches(child):
+                return self.build(child, groups, True, fixed)
+            return f"(?:{self.build(child, groups, False, False)})?"
+        if node.data == "expr":
+            return self.build_expr(node, groups, must, fixed)
+        if node.data == "literal":
+            (token,) = node.children
+            pattern = _literal_to_pattern(token)
+            keyword = get_keyword(pattern)
+            if keyword is not None:
+                # Keywords in repeated or optional items cannot be
+                # counted, -1 disables the check
+                count = self.keywords.get(keyword, 0)
+                self.keywords[keyword] = (
+                    count + 1 if fixed and count >= 0 else -1
+                )
+            if pattern.type == "str":
+                value = escape_regex(pattern.value)
+            else:
+                value = pattern.value
+            if pattern.flags:
+                return f"(?{''.join(pattern.flags)}:{value})"
+            return f"(?:{value})"
+        if node.data == "range":
+            start, end = (
+                escape_regex(_literal_to_pattern(token).value)
+                for token in node.children
+            )
+            return f"[{start}-{end}]"
+        raise ValueError(f"Unsupported grammar construct: {node.data}")
+
+    def build_expr(
+        self,
+        node: Tree,
+        groups: list[RegexGroup] | None,
+        must: bool,
+        fixed: bool,
+    ) -> str:
+        """Build the regex of a repeated or optional node."""
+        child, op, *counts = node.children
+        if op.type == "OP":
+            quantifier = op.value
+        elif len(counts) == 1:
+            quantifier = f"{{{counts[0]}}}"
+        else:
+            quantifier = f"{{{counts[0]},{counts[1]}}}"
+
+        if must and self.reaches(child):
+            if quantifier != "?":
+                raise ValueError(f"Target rule repeated in {node}")
+            return self.build(child, groups, True, fixed)
+        if groups is None or not self.captures(child):
+            return f"(?:{self.build(child, None)}){quantifier}"
+        if quantifier == "?":
+            return f"(?:{self.build(child, groups, False, False)})?"
+
+        # Repeated captures are matched as a whole, then split with the
+        # python regex of one repetition
+        name = f"_repeat_{self._group_idx}"
+        self._group_idx += 1
+        items: list[RegexGroup] = []
+        body = self.build(child, items, False, False)
+        groups.append(RegexGroup(name, body=re.compile(body), items=items))
+        return f"(?P<{name}>(?:{self.build(child, None)}){quantifier})"
+
+    def build_rule(
+        self,
+        name: str,
+        groups: list[RegexGroup] | None,
+        must: bool,
+        fixed: bool,
+    ) -> str:
+        """Build the regex of a rule."""
+        if name in self._stack:
+            raise ValueError(f"Recursive rule: {name}")
+        tree, options = self.rule_defs[name]
+        self._stack.append(name)
+        try:
+            if name.startswith("_"):
+                return self.build(
+                    tree, groups, must and name != self.target, fixed
+                )
+            inner = self.build(tree, None, must, fixed)
+        finally:
+            self._stack.pop()
+        if groups is None:
+            return f"(?:{inner})"
+        group_name = f"{name}__{self._group_idx}"
+        self._group_idx += 1
+        groups.append(RegexGroup(group_name, rule=name))
+        return f"(?P<{group_name}>{inner})"
+
+
+class RegexFastPath:
+    """Parse keys with regexes compiled from a Lark grammar.
+
+    Keys that go through one of the fast path rules are matched with the
+    compiled regex of that rule on whole Polars columns. The spans of the
+    captured rules are then parsed and transformed individually, once per
+    distinct value, to get exactly the values of the full Lark parse.
+
+    Lark tokenizes keywords eagerly, so keys in which a keyword appears a
+    different number of times than in the rule are left to Lark.
+
+    Parameters
+    ----------
+    path_parser : Lark
+        Path parser.
+    ast_transformer : type[BaseTransformer]
+        AST transformer.
+    rules : list[str]
+        Grammar rules to compile. Missing rules are skipped.
+
+    """
+
+    def __init__(
+        self,
+        path_parser: Lark,
+        ast_transformer: type[BaseTransformer],
+        rules: list[str] = FAST_PATH_RULES,
+    ) -> None:
+        """Compile the fast path rules."""
+        grammar, _ = load_grammar(
+            path_parser.source_grammar,
+            "<path_parser>",
+            path_parser.options.import_paths,
+            path_parser.options.keep_all_tokens,
+        )
+        if grammar.ignore:
+            raise ValueError(
+                "Grammars with ignored terminals are not supported"
+            )
+        rule_defs = {
+            name.value: (tree, options)
+            for name, params, tree, options in grammar.rule_defs
+            if not params
+        }
+        term_defs = {name: tree for name, (tree, _) in grammar.term_defs}
+        start = path_parser.options.start[0]
+        keywords = {
+            get_keyword(_literal_to_pattern(literal.children[0]))
+            for tree in [tree for tree, _ in rule_defs.values()]
+            + list(term_defs.values())
+            for literal in tree.find_data("literal")
+        }
+        keywords.discard(None)
+
+        self.patterns: list[RulePattern] = []
+        for rule in rules:
+            if rule not in rule_defs:
+                continue
+            builder = RegexBuilder(rule_defs, term_defs, rule)
+            groups: list[RegexGroup] = []
+            # The start rule is not captured, its items make up the IR
+            regex = (
+                f"^{builder.build(rule_defs[start][0], groups, True, True)}$"
+            )
+            # Fails on regex features that polars does not support
+            pl.Series([""]).str.contains(regex)
+            self.patterns.append(
+                RulePattern(
+                    rule=rule,
+                    regex=regex,
+                    groups=groups,
+                    # Keywords of other rules must not appear in the key
+                    keywords={
+                        keyword: builder.keywords.get(keyword, 0)
+                        for keyword in keywords
+                        if builder.keywords.get(keyword, 0) >= 0
+                    },
+                )
+            )
+        self.ast_transformer = ast_transformer
+        self.sub_parser = Lark(
+            path_parser.source_grammar,
+            parser="lalr",
+            start=sorted(
+                name for name in rule_defs if not name.startswith("_")
+            ),
+            import_paths=path_parser.options.import_paths,
+        )
+        self._values: dict[tuple[str, str], tuple[dict, list[str]] | None] = {}
+
+    def eval_rule(self, rule: str, span: str) -> tuple[dict, list[str]] | None:
+        """Parse and transform the span of a rule.
+
+        Parameters
+        ----------
+        rule : str
+            Grammar rule.
+        span : str
+            Text matched by the rule.
+
+        Returns
+        -------
+        tuple[dict, list[str]] | None
+            Fields of the rule and channels found in it. None if the span
+            cannot be parsed or transformed.
+
+        """
+        if (rule, span) not in self._values:
+            transformer = self.ast_transformer()
+            try:
+                value = transformer.transform(
+                    self.sub_parser.parse(span, start=rule)
+                )
+            except (LarkError, AssertionError, IndexError, ValueError):
+                self._values[(rule, span)] = None
+                return None
+            fields = value if isinstance(value, dict) else {}
+            if all(isinstance(v, str) for v in fields.values()):
+                self._values[(rule, span)] = (
+                    fields,
+                    list(transformer.channel_dict["channel_dict"]),
+                )
+            else:
+                self._values[(rule, span)] = None
+        return self._values[(rule, span)]
+
+    def eval_groups(
+        self, groups: list[RegexGroup], match: re.Match
+    ) -> tuple[dict, list[str]] | None:
+        """Merge the values of the groups of a python regex match."""
+        fields: dict = {}
+        channels: list[str] = []
+        for group in groups:
+            span = match.group(group.name)
+            if span is None:
+                continue
+            value = self.eval_group(group, span)
+            if value is None:
+                return None
+            fields.update(value[0])
+            channels.extend(value[1])
+        return fields, channels
+
+    def eval_repeat(
+        self, group: RegexGroup, span: str
+    ) -> tuple[dict, list[str]] | None:
+        """Merge the values of the repetitions matched by a group."""
+        fields: dict = {}
+        channels: list[str] = []
+        pos = 0
+        while pos < len(span):
+            match = group.body.match(span, pos)
+            if match is None or match.end() == pos:
+                return None
+            value = self.eval_groups(group.items, match)
+            if value is None:
+                return None
+            fields.update(value[0])
+            channels.extend(value[1])
+            pos = match.end()
+        return fields, channels
+
+    def eval_group(
+        self, group: RegexGroup, span: str
+    ) -> tuple[dict, list[str]] | None:
+        """Get the values of a span captured by a group."""
+        if group.rule is not None:
+            return self.eval_rule(group.rule, span)
+        return self.eval_repeat(group, span)
+
+    def parse(self, keys: pl.Series) -> tuple[pl.DataFrame, pl.Series]:
+        """Parse keys with the fast path rules.
+
+        Parameters
+        ----------
+        keys : pl.Series
+            Keys to parse.
+
+        Returns
+        -------
+        tuple[pl.DataFrame, pl.Series]
+            Fields of the parsed keys, with their channels in a
+            `channel_dict` column and their position in `keys` in a
+            `row_idx` column, and the mask of the keys left to Lark.
+
+        """
+        df = keys.alias("key").to_frame().with_row_index("row_idx")
+        parsed = []
+        for pattern in self.patterns:
+            matched = pl.col("key").str.contains(pattern.regex)
+            for keyword, count in pattern.keywords.items():
+                matched = matched & pl.col("key").str.count_matches(keyword).eq(
+                    count
+                )
+            rule_df = df.filter(matched)
+            df = df.filter(~matched)
+            if len(rule_df) == 0:
+                continue
+            rule_df = rule_df.with_columns(
+                pl.col("key").str.extract_groups(pattern.regex).struct.unnest()
+            )
+            parsed.append(self.eval_columns(rule_df, pattern.groups))
+
+        parsed = [rule_df for rule_df in parsed if len(rule_df) > 0]
+        if parsed:
+            parsed_df = pl.concat(parsed, how="diagonal_relaxed")
+        else:
+            parsed_df = pl.DataFrame(
+                schema={
+                    "row_idx": pl.UInt32,
+                    "channel_dict": pl.List(pl.String),
+                }
+            )
+        mask = ~pl.int_range(len(keys), dtype=pl.UInt32, eager=True).is_in(
+            parsed_df["row_idx"].implode()
+        )
+        return parsed_df, mask
+
+    def eval_columns(
+        self, rule_df: pl.DataFrame, groups: list[RegexGroup]
+    ) -> pl.DataFrame:
+        """Join the values of the captured spans of a rule to its keys."""
+        field_cols: dict[str, list[str]] = {}
+        channel_cols = []
+        for group in groups:
+            values = {
+                span: self.eval_group(group, span)
+                for span in rule_df[group.name].drop_nulls().unique()
+            }
+            # Keys with spans that cannot be transformed are left to Lark
+            bad_spans = [
+                span for span, value in values.items() if value is None
+            ]
+            rule_df = rule_df.filter(
+                ~pl.col(group.name).is_in(bad_spans).fill_null(False)
+            )
+            values = {
+                span: value
+                for span, value in values.items()
+                if value is not None
+            }
+            names = sorted(
+                {name for fields, _ in values.values() for name in fields}
+            )
+            value_df = pl.DataFrame(
+                {
+                    group.name: list(values),
+                    **{
+                        f"{group.name}.{name}": [
+                            fields.get(name) for fields, _ in values.values()
+                        ]
+                        for name in names
+                    },
+                    f"{group.name}.channels": [
+                        channels for _, channels in values.values()
+                    ],
+                },
+                schema={
+                    group.name: pl.String,
+                    **{f"{group.name}.{name}": pl.String for name in names},
+                    f"{group.name}.channels": pl.List(pl.String),
+                },
+            )
+            rule_df = rule_df.join(value_df, on=group.name, how="left")
+            for name in names:
+                field_cols.setdefault(name, []).append(f"{group.name}.{name}")
+            channel_cols.append(
+                pl.col(f"{group.name}.channels").fill_null(
+                    pl.lit([], dtype=pl.List(pl.String))
+                )
+            )
+        return rule_df.select(
+            "row_idx",
+            # Later fields override earlier ones, as when merging the IR
+            *[
+                pl.coalesce(cols[::-1]).alias(name)
+                for name, cols in field_cols.items()
+            ],
+            (
+                pl.concat_list(channel_cols)
+                if channel_cols
+                else pl.lit([], dtype=pl.List(pl.String))
+            ).alias("channel_dict"),
+        )
@@ -9,8 +9,30 @@ import cellprofiler_core.preferences
 import cellprofiler_core.utilities.java
 from cellprofiler_core.pipeline import Event, Pipeline, RunException
 from cellprofiler_core.preferences import LOGGER
+from cellprofiler_core.utilities.core.modules import fill_modules
 from cloudpathlib import CloudPath
 
+# Plugin directory preloaded by the forkserver of the CellProfiler workers
+CP_PLUGIN_DIR_ENV = "STARRYNIGHT_CP_PLUGIN_DIR"
+
+# Plugin directory the modules of the current process were filled with
+_cp_modules: dict = {}
+
+
+def fill_cp_modules(plugin_dir: str | None = None) -> None:
+    """Fill the CellProfiler module registry, including plugins.
+
+    Parameters
+    ----------
+    plugin_dir : str, optional
+        Directory containing plugins. If None, no plugin directory is set.
+
+    """
+    if plugin_dir is not None:
+        cellprofiler_core.preferences.set_plugin_directory(plugin_dir, False)
+    fill_modules()
+    _cp_modules["plugin_dir"] = plugin_dir
+
 
 class CellProfilerContext:
     """Context manager for setting up a CellProfiler environment.
@@ -99,3 +121,95 @@ class CellProfilerContext:
         """
         if self.require_jvm:
             cellprofiler_core.utilities.java.stop_java()
+
+
+class CellProfilerWorker:
+    """Run CellProfiler pipelines on LoadData files, loading each pipeline once.
+
+    CellProfiler is set up when the worker is created and pipelines are
+    parsed on first use, so running a unit of work only swaps the LoadData
+    file and the output directory.
+
+    Modules already filled with another plugin directory, e.g. by the
+    forkserver the worker was forked from, are filled again.
+
+    Parameters
+    ----------
+    plugin_dir : Path | CloudPath, optional
+        Directory containing plugins. If None, no plugins are loaded.
+
+    """
+
+    def __init__(
+        self: Self, plugin_dir: Path | CloudPath | None = None
+    ) -> None:
+        """Initialize the worker.
+
+        Sets up CellProfiler preferences and readers once for all the runs.
+        """
+        LOGGER.setLevel(logging.CRITICAL)
+        cellprofiler_core.preferences.set_headless()
+        cellprofiler_core.reader.fill_readers(check_config=False)  # pyright: ignore[reportAttributeAccessIssue]
+        cellprofiler_core.reader.filter_active_readers(["bioformats_reader"])  # pyright: ignore[reportAttributeAccessIssue]
+        if plugin_dir is not None:
+            plugin_dir = plugin_dir.resolve().__str__()
+            if _cp_modules.get("plugin_dir", plugin_dir) != plugin_dir:
+                fill_cp_modules(plugin_dir)
+            else:
+                cellprofiler_core.preferences.set_plugin_directory(
+                    plugin_dir, False
+                )
+        self.pipelines: dict[str, Pipeline] = {}
+
+    def get_pipeline(self: Self, pipe_path: Path | CloudPath) -> Pipeline:
+        """Get a pipeline, parsing it on first use.
+
+        Parameters
+        ----------
+        pipe_path : Path | CloudPath
+            Path to the cppipe file.
+
+        Returns
+        -------
+        Pipeline
+            The loaded CellProfiler pipeline.
+
+        """
+        pipe_path = pipe_path.resolve().__str__()
+        if pipe_path not in self.pipelines:
+            pipeline = Pipeline()
+            pipeline.add_listener(CellProfilerContext.handle_error_event)
+            pipeline.load(pipe_path)
+            self.pipelines[pipe_path] = pipeline
+        return self.pipelines[pipe_path]
+
+    def run(
+        self: Self,
+        pipe_path: Path | CloudPath,
+        loaddata_path: Path | CloudPath,
+        out_dir: Path | CloudPath,
+        image_set_end: int | None = None,
+    ) -> None:
+        """Run a pipeline on a LoadData file.
+
+        Parameters
+        ----------
+        pipe_path : Path | CloudPath
+            Path to the cppipe file.
+        loaddata_path : Path | CloudPath
+            Path to the LoadData file.
+        out_dir : Path | CloudPath
+            Output directory where data will be written.
+        image_set_end : int, optional
+            Last image set to run. If None, all image sets are run.
+
+        """
+        pipeline = self.get_pipeline(pipe_path)
+        out_dir.mkdir(exist_ok=True, parents=True)
+        cellprofiler_core.preferences.set_default_output_directory(
+            out_dir.resolve().__str__()
+        )
+        cellprofiler_core.preferences.set_data_file(
+            loaddata_path.resolve().__str__()
+        )
+        pipeline.run(image_set_end=image_set_end)
@@ -0,0 +1,23 @@
+"""Preload CellProfiler in the forkserver of the CellProfiler workers.
+
+Importing this module imports CellProfiler, its readers and its module
+registry, including the plugins of the directory in the `CP_PLUGIN_DIR_ENV`
+environment variable. The forkserver started by
+`starrynight.algorithms.cp.run_cp_parallel` imports it once, so the workers
+forked from it start with CellProfiler ready.
+
+The forkserver only starts once per process, later runs with another plugin
+directory fork from the same preloaded modules. Their workers fill the modules
+again, see `starrynight.utils.cellprofiler.CellProfilerWorker`.
+"""
+
+import os
+
+import cellprofiler_core.preferences
+import cellprofiler_core.reader
+
+from starrynight.utils.cellprofiler import CP_PLUGIN_DIR_ENV, fill_cp_modules
+
+cellprofiler_core.preferences.set_headless()
+cellprofiler_core.reader.fill_readers(check_config=False)  # pyright: ignore[reportAttributeAccessIssue]
+fill_cp_modules(os.environ.get(CP_PLUGIN_DIR_ENV) or None)
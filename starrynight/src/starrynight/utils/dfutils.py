@@ -1,7 +1,15 @@
 """Common dataframe operations."""
 
+import json
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Iterator
+from pathlib import Path
+
 import polars as pl
-from cloudpathlib import AnyPath
+from cloudpathlib import AnyPath, CloudPath
+
+from starrynight.utils.misc import read_pq_metadata
 
 HIERARCHY_COLUMN_MAP_CP = {
     0: "batch_id",
@@ -18,6 +26,162 @@ HIERARCHY_COLUMN_MAP_SBS = {
     4: "site_id",
 }
 
+# Low cardinality index columns, stored and optionally read dictionary encoded
+INDEX_CATEGORICAL_COLS = [
+    "prefix",
+    "dataset_id",
+    "batch_id",
+    "plate_id",
+    "cycle_id",
+    "magnification",
+    "well_id",
+    "site_id",
+    "channel_dict",
+    "extension",
+]
+
+# Integer columns of the index and the id columns they are parsed from
+INDEX_NUM_COLS = {"site_num": "site_id", "cycle_num": "cycle_id"}
+
+# Key of the index schema version in the Parquet key-value metadata
+INDEX_SCHEMA_VERSION_KEY = "starrynight.index_schema_version"
+
+# Version of the index schema. Indexes without a version are version 1,
+# version 2 adds the integer columns.
+INDEX_SCHEMA_VERSION = 2
+
+# Version of the index summary sidecar, summaries of other versions are ignored
+INDEX_SUMMARY_VERSION = 1
+
+# Bounds of the frames kept by the process-wide index cache
+INDEX_CACHE_MAXSIZE = 8
+INDEX_CACHE_MAX_BYTES = 2 * 1024**3
+
+
+def parse_index_num(col: str | pl.Expr) -> pl.Expr:
+    """Parse a zero padded index id to an integer, e.g. `0012` -> 12.
+
+    Ids that are not plain digits are parsed to null.
+
+    Parameters
+    ----------
+    col : str | pl.Expr
+        Id column.
+
+    Returns
+    -------
+    pl.Expr
+        Int64 expression.
+
+    """
+    if isinstance(col, str):
+        col = pl.col(col)
+    return (
+        pl.when(col.str.contains(r"^[0-9]+$"))
+        .then(col.cast(pl.Int64, strict=False))
+        .otherwise(None)
+    )
+
+
+def get_index_schema_version(index_path: Path | CloudPath) -> int:
+    """Get the schema version of an index file or partitioned index dataset.
+
+    Parameters
+    ----------
+    index_path : Path | CloudPath
+        Path to index. Can be local or a cloud path.
+
+    Returns
+    -------
+    int
+        Schema version, see `INDEX_SCHEMA_VERSION`.
+
+    """
+    if index_path.is_dir():
+        # Partitions are written together and share the version
+        index_path = next(index_path.rglob("*.parquet"), None)
+        if index_path is None:
+            return INDEX_SCHEMA_VERSION
+    return int(read_pq_metadata(index_path).get(INDEX_SCHEMA_VERSION_KEY, 1))
+
+
+def with_index_num_cols(
+    df: pl.DataFrame | pl.LazyFrame, schema_version: int
+) -> pl.DataFrame | pl.LazyFrame:
+    """Add the integer columns to the rows of an index predating them.
+
+    Parameters
+    ----------
+    df : pl.DataFrame | pl.LazyFrame
+        Index rows.
+    schema_version : int
+        Schema version of the index, see `get_index_schema_version`.
+
+    Returns
+    -------
+    pl.DataFrame | pl.LazyFrame
+        Index rows with the integer columns, see `INDEX_NUM_COLS`.
+
+    """
+    if schema_version >= 2:
+        return df
+    return df.with_columns(
+        parse_index_num(id_col).alias(num_col)
+        for num_col, id_col in INDEX_NUM_COLS.items()
+    )
+
+
+def scan_index(
+    index_path: Path | CloudPath, categorical: bool = False
+) -> pl.LazyFrame:
+    """Scan an index file or a partitioned index dataset.
+
+    Partition columns are read from the files rather than from the
+    directory names, as Hive null partitions are not filtered correctly
+    by polars. Files of other partitions are still skipped using their
+    row group statistics.
+
+    Indexes written before the integer columns were added get them parsed
+    from their id columns, so all schema versions read the same.
+
+    Parameters
+    ----------
+    index_path : Path | CloudPath
+        Path to index. Can be local or a cloud path.
+    categorical : bool
+        Read the low cardinality columns as `pl.Categorical`, see
+        `INDEX_CATEGORICAL_COLS`. This cuts the memory of large collected
+        indexes, but categoricals of different frames can only be compared
+        or concatenated under a `pl.StringCache`, so strings are kept by
+        default and for the cached index frames.
+
+    Returns
+    -------
+    pl.LazyFrame
+        Index LazyFrame.
+
+    """
+    index_path = index_path.resolve()
+    if index_path.is_dir():
+        df = pl.scan_parquet(
+            f"{index_path.__str__()}/**/*.parquet", hive_partitioning=False
+        )
+    else:
+        df = pl.scan_parquet(index_path.__str__())
+    df = with_index_num_cols(df, get_index_schema_version(index_path))
+    if categorical:
+        schema = df.collect_schema()
+        df = df.with_columns(
+            pl.col(col).cast(
+                pl.List(pl.Categorical)
+                if isinstance(schema[col], pl.List)
+                else pl.Categorical
+            )
+            for col in INDEX_CATEGORICAL_COLS
+            if col in schema
+        )
+    return df
+
 
 def gen_legacy_channel_map(
     plate_channel_list: list[str],
@@ -66,21 +230,200 @@ def filter_images(df: pl.LazyFrame, for_sbs: bool = False) -> pl.LazyFrame:
         )
 
 
+def get_index_version(index_path: Path | CloudPath) -> tuple:
+    """Get the version of an index file or partitioned dataset.
+
+    Local files are versioned on their modification time and size, cloud
+    files on their ETag.
+
+    Parameters
+    ----------
+    index_path : Path | CloudPath
+        Path to index. Can be local or a cloud path.
+
+    Returns
+    -------
+    tuple
+        Path and version of every file of the index.
+
+    """
+    if index_path.is_dir():
+        files = sorted(index_path.rglob("*.parquet"))
+    else:
+        files = [index_path]
+    version = []
+    for file in files:
+        if isinstance(file, CloudPath):
+            version.append((str(file), file.etag))
+        else:
+            stat = file.stat()
+            version.append((str(file), stat.st_mtime_ns, stat.st_size))
+    return tuple(version)
+
+
+class IndexCache:
+    """LRU cache of collected index frames.
+
+    Frames are keyed on the index path and version, so an index rewritten
+    on disk is read again. The least recently used frames are evicted once
+    there are more than `maxsize` of them or their estimated size exceeds
+    `max_bytes`. Frames larger than `max_bytes` are not kept.
+
+    Cached frames are shared by all callers, and must not be modified.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of frames.
+    max_bytes : int
+        Maximum estimated size of the frames.
+
+    """
+
+    def __init__(
+        self,
+        maxsize: int = INDEX_CACHE_MAXSIZE,
+        max_bytes: int = INDEX_CACHE_MAX_BYTES,
+    ) -> None:
+        """Create an empty cache."""
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._frames: OrderedDict[tuple, pl.DataFrame] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        """Estimated size of the cached frames."""
+        return sum(df.estimated_size() for df in self._frames.values())
+
+    def get(
+        self,
+        index_path: Path | CloudPath,
+        name: str,
+        load: Callable[[], pl.DataFrame],
+    ) -> pl.DataFrame:
+        """Get a frame of an index, loading it on a miss.
+
+        Parameters
+        ----------
+        index_path : Path | CloudPath
+            Path to index. Can be local or a cloud path.
+        name : str
+            Name of the frame of the index.
+        load : Callable[[], pl.DataFrame]
+            Loader of the frame.
+
+        Returns
+        -------
+        pl.DataFrame
+            Frame of the current version of the index.
+
+        """
+        index_path = index_path.resolve()
+        key = (str(index_path), name, get_index_version(index_path))
+        with self._lock:
+            if key in self._frames:
+                self.hits += 1
+                self._frames.move_to_end(key)
+                return self._frames[key]
+            self.misses += 1
+        df = load()
+        with self._lock:
+            # Older versions of the frame are never read again
+            for stale_key in [
+                k for k in self._frames if k[:2] == key[:2] and k != key
+            ]:
+                del self._frames[stale_key]
+            if df.estimated_size() <= self.max_bytes:
+                self._frames[key] = df
+                while (
+                    len(self._frames) > self.maxsize
+                    or self.nbytes > self.max_bytes
+                ):
+                    self._frames.popitem(last=False)
+        return df
+
+    def clear(self) -> None:
+        """Remove all the frames."""
+        with self._lock:
+            self._frames.clear()
+
+
+INDEX_CACHE = IndexCache()
+
+
+def load_index(index_path: Path | CloudPath) -> pl.DataFrame:
+    """Load an index through the process-wide `INDEX_CACHE`.
+
+    Stages run in the same process share the collected index, instead of
+    scanning and decoding it again.
+
+    Parameters
+    ----------
+    index_path : Path | CloudPath
+        Path to index. Can be local or a cloud path.
+
+    Returns
+    -------
+    pl.DataFrame
+        Index DataFrame, shared with other callers.
+
+    """
+    return INDEX_CACHE.get(
+        index_path, "index", lambda: scan_index(index_path).collect()
+    )
+
+
+def load_images(
+    index_path: Path | CloudPath, for_sbs: bool = False
+) -> pl.DataFrame:
+    """Load the images of an index through the process-wide `INDEX_CACHE`.
+
+    Parameters
+    ----------
+    index_path : Path | CloudPath
+        Path to index. Can be local or a cloud path.
+    for_sbs : bool, optional
+        Whether to load the sbs images or not. Defaults to False.
+
+    Returns
+    -------
+    pl.DataFrame
+        Images of the index, see `filter_images`, shared with other callers.
+
+    """
+    return INDEX_CACHE.get(
+        index_path,
+        "sbs_images" if for_sbs else "cp_images",
+        lambda: filter_images(load_index(index_path).lazy(), for_sbs).collect(),
+    )
+
+
 def filter_df_by_hierarchy_cp(
     df: pl.LazyFrame, levels: list[str]
 ) -> pl.LazyFrame:
-    for i, level in enumerate(levels):
+    for level in levels:
         print(f"LEVEL FILTERING: {level}")
-        df = df.filter(pl.col(HIERARCHY_COLUMN_MAP_CP[i]).eq(level))
-    return df
+    # Single predicate so that it is pushed down to the index scan
+    return df.filter(
+        *[
+            pl.col(HIERARCHY_COLUMN_MAP_CP[i]).eq(level)
+            for i, level in enumerate(levels)
+        ]
+    )
 
 
 def filter_df_by_hierarchy_sbs(
     df: pl.LazyFrame, levels: list[str]
 ) -> pl.LazyFrame:
-    for i, level in enumerate(levels):
-        df = df.filter(pl.col(HIERARCHY_COLUMN_MAP_SBS[i]).eq(level))
-    return df
+    return df.filter(
+        *[
+            pl.col(HIERARCHY_COLUMN_MAP_SBS[i]).eq(level)
+            for i, level in enumerate(levels)
+        ]
+    )
 
 
 def filter_df_by_hierarchy(
@@ -337,6 +680,9 @@ def gen_image_hierarchy(
 ) -> dict[str, dict] | list[str]:
     """Generate a hierarchical dictionary representing the image structure.
 
+    The unique level combinations are queried once and folded into the
+    nested dict. Level values are in order of first occurrence.
+
     Parameters
     ----------
     df : pl.LazyFrame
@@ -356,31 +702,242 @@ def gen_image_hierarchy(
     if len(levels) == 0:
         return []
 
-    # get the current level values
-    current_level_vals = select_column_unique_vals(df, levels[0])
+    level_vals = (
+        df.filter(pl.col(levels[0]).is_not_null())
+        .select(levels)
+        .unique(maintain_order=True)
+        .collect()
+    )
 
     # If only one level, then last level to recurse, return a list
     if len(levels) == 1:
-        hierarchy = current_level_vals
+        return level_vals.to_series().to_list()
 
     # Multiple levels to recurse, return a dict
-    else:
-        hierarchy = {}
-        for val in current_level_vals:
-            next_level_df = filter_df_by_column_val(df, levels[0], val)
-            hierarchy[val] = gen_image_hierarchy(next_level_df, levels[1:])
+    hierarchy = {}
+    for vals in level_vals.iter_rows():
+        node = hierarchy
+        for depth, val in enumerate(vals):
+            # Unset levels have no children
+            if val is None:
+                break
+            if depth == len(levels) - 1:
+                node.append(val)
+            else:
+                if val not in node:
+                    node[val] = {} if depth < len(levels) - 2 else []
+                node = node[val]
     return hierarchy
 
 
+class IndexHierarchy:
+    """Index rows grouped by hierarchy levels, e.g. batch -> plate -> well.
+
+    The rows are collected once and sorted on the levels, so that every node
+    of the hierarchy is a contiguous range of rows. The ranges are found in a
+    single `group_by` pass, and node lookups slice the collected rows instead
+    of querying the index again. Nodes only include rows where all of their
+    levels are set, like `filter_df_by_hierarchy`.
+
+    Parameters
+    ----------
+    df : pl.LazyFrame | pl.DataFrame
+        Index rows.
+    levels : list[str] | None
+        Hierarchy columns, from the top level down. Defaults to
+        batch -> plate -> cycle -> well -> site.
+
+    """
+
+    _row_col = "__hierarchy_row"
+
+    def __init__(
+        self,
+        df: pl.LazyFrame | pl.DataFrame,
+        levels: list[str] | None = None,
+    ) -> None:
+        """Collect the rows and find the row range of every node."""
+        self.levels = levels or list(HIERARCHY_COLUMN_MAP_SBS.values())
+        if isinstance(df, pl.LazyFrame):
+            df = df.collect()
+        # Stable sort, rows of a leaf keep their index order
+        self.df = df.with_row_index(self._row_col).sort(
+            self.levels, nulls_last=True, maintain_order=True
+        )
+        groups = self.df.group_by(self.levels, maintain_order=True).len()
+
+        self._ranges: dict[tuple[str, ...], tuple[int, int]] = {}
+        self._children: dict[tuple[str, ...], list[str]] = {}
+        self._channels: dict[tuple[str, ...], list[str]] = {}
+        start = 0
+        for *values, length in groups.iter_rows():
+            stop = start + length
+            for depth in range(1, len(values) + 1):
+                if values[depth - 1] is None:
+                    break
+                node = tuple(values[:depth])
+                if node in self._ranges:
+                    self._ranges[node] = (self._ranges[node][0], stop)
+                else:
+                    self._ranges[node] = (start, stop)
+                    self._children.setdefault(node[:-1], []).append(node[-1])
+            start = stop
+
+    def paths(self, depth: int | None = None) -> list[list[str]]:
+        """List the nodes at a depth of the hierarchy.
+
+        Parameters
+        ----------
+        depth : int | None
+            Number of levels of the nodes. Defaults to all levels.
+
+        Returns
+        -------
+        list[list[str]]
+            Level values of the nodes, sorted.
+
+        """
+        depth = depth or len(self.levels)
+        return [list(node) for node in self._ranges if len(node) == depth]
+
+    def partitions(self) -> Iterator[tuple[list[str], pl.DataFrame]]:
+        """Split the rows into the leaves of the hierarchy in one pass.
+
+        Yields
+        ------
+        tuple[list[str], pl.DataFrame]
+            Level values of a leaf, in the order of `paths`, and its rows in
+            index order.
+
+        """
+        df = self.df.drop_nulls(self.levels)
+        for values, part in df.partition_by(
+            self.levels, as_dict=True, maintain_order=True
+        ).items():
+            yield list(values), part.drop(self._row_col)
+
+    def to_dict(self) -> dict[str, dict] | list[str]:
+        """Nest the nodes like `gen_image_hierarchy`.
+
+        Returns
+        -------
+        dict[str, dict] | list[str]
+            Nested dict of the level values, with lists of the values of the
+            last level as leaves.
+
+        """
+
+        def nest(node: tuple[str, ...]) -> dict[str, dict] | list[str]:
+            children = self._children.get(node, [])
+            if len(node) == len(self.levels) - 1:
+                return list(children)
+            return {child: nest((*node, child)) for child in children}
+
+        return nest(())
+
+    def get_df(self, path: list[str] | tuple[str, ...] = ()) -> pl.DataFrame:
+        """Get the rows of a node, in index order.
+
+        Parameters
+        ----------
+        path : list[str] | tuple[str, ...]
+            Level values of the node. Defaults to the root, i.e. all rows.
+
+        Returns
+        -------
+        pl.DataFrame
+            Rows of the node. Empty for unknown nodes.
+
+        """
+        path = tuple(path)
+        if not path:
+            df = self.df.sort(self._row_col)
+        else:
+            start, stop = self._ranges.get(path, (0, 0))
+            df = self.df.slice(start, stop - start)
+            # Inner nodes span several leaves
+            if len(path) < len(self.levels):
+                df = df.sort(self._row_col)
+        return df.drop(self._row_col)
+
+    def get_channels(self, path: list[str] | tuple[str, ...] = ()) -> list[str]:
+        """Get the channels of a node, like `get_channels_from_df`.
+
+        Parameters
+        ----------
+        path : list[str] | tuple[str, ...]
+            Level values of the node.
+
+        Returns
+        -------
+        list[str]
+            Unique channels, in order of first occurrence.
+
+        """
+        path = tuple(path)
+        if path not in self._channels:
+            self._channels[path] = (
+                self.get_df(path)
+                .filter(pl.col("channel_dict").is_not_null())
+                .select(
+                    pl.col("channel_dict").explode().unique(maintain_order=True)
+                )
+                .to_series()
+                .to_list()
+            )
+        return self._channels[path]
+
+    def get_cycles(self, path: list[str] | tuple[str, ...] = ()) -> list[str]:
+        """Get the cycle IDs of a node, like `get_cycles_from_df`.
+
+        Parameters
+        ----------
+        path : list[str] | tuple[str, ...]
+            Level values of the node.
+
+        Returns
+        -------
+        list[str]
+            Unique cycle IDs, in numeric order.
+
+        """
+        return (
+            self.get_df(path)
+            .filter(pl.col("cycle_id").is_not_null())
+            .select(pl.col("cycle_id").unique())
+            .sort(parse_index_num("cycle_id"), "cycle_id", nulls_last=True)
+            .to_series()
+            .to_list()
+        )
+
+    def get_filenames(
+        self, path: list[str] | tuple[str, ...] = ()
+    ) -> list[str]:
+        """Get the filenames of a node, in index order.
+
+        Parameters
+        ----------
+        path : list[str] | tuple[str, ...]
+            Level values of the node.
+
+        Returns
+        -------
+        list[str]
+            Filenames.
+
+        """
+        return self.get_df(path)["filename"].to_list()
+
+
 def get_channels_by_batch_plate(
-    df: pl.LazyFrame, batch_id: str, plate_id: str
+    df: pl.DataFrame | pl.LazyFrame, batch_id: str, plate_id: str
 ) -> list[str]:
     """Extract a list of unique channels for a given batch and plate ID.
 
     Parameters
     ----------
-    df : pl.LazyFrame
-        The input Polars LazyFrame.
+    df : pl.DataFrame | pl.LazyFrame
+        The input Polars DataFrame or LazyFrame.
     batch_id : str
         The batch ID to filter by.
     plate_id : str
@@ -393,7 +950,8 @@ def get_channels_by_batch_plate(
 
     """
     channels = (
-        df.filter(
+        df.lazy()
+        .filter(
             pl.col("batch_id").eq(batch_id)
             & pl.col("plate_id").eq(plate_id)
             & pl.col("channel_dict").is_not_null()
@@ -406,13 +964,13 @@ def get_channels_by_batch_plate(
     return channels
 
 
-def get_channels_from_df(df: pl.LazyFrame) -> list[str]:
+def get_channels_from_df(df: pl.DataFrame | pl.LazyFrame) -> list[str]:
     """Extract a list of unique channels for a LazyFrame.
 
     Parameters
     ----------
-    df : pl.LazyFrame
-        The input Polars LazyFrame.
+    df : pl.DataFrame | pl.LazyFrame
+        The input Polars DataFrame or LazyFrame.
 
     Returns
     -------
@@ -421,7 +979,8 @@ def get_channels_from_df(df: pl.LazyFrame) -> list[str]:
 
     """
     channels = (
-        df.filter(pl.col("channel_dict").is_not_null())
+        df.lazy()
+        .filter(pl.col("channel_dict").is_not_null())
         .select(pl.col("channel_dict").explode().unique(maintain_order=True))
         .collect()
         .to_series()
@@ -430,24 +989,26 @@ def get_channels_from_df(df: pl.LazyFrame) -> list[str]:
     return channels
 
 
-def get_cycles_from_df(df: pl.LazyFrame) -> list[str]:
+def get_cycles_from_df(df: pl.DataFrame | pl.LazyFrame) -> list[str]:
     """Extract a list of unique cycle IDs for a given LazyFrame.
 
     Parameters
     ----------
-    df : pl.LazyFrame
-        The input Polars LazyFrame.
+    df : pl.DataFrame | pl.LazyFrame
+        The input Polars DataFrame or LazyFrame.
 
     Returns
     -------
     list[str]
-        A list of unique cycle IDs for the given LazyFrame.
+        A list of unique cycle IDs for the given LazyFrame, in numeric order.
 
     """
     cycles = (
-        df.filter(pl.col("cycle_id").is_not_null())
+        df.lazy()
+        .filter(pl.col("cycle_id").is_not_null())
         .select(pl.col("cycle_id"))
         .unique()
+        .sort(parse_index_num("cycle_id"), "cycle_id", nulls_last=True)
         .collect()
         .to_series()
         .to_list()
@@ -456,14 +1017,14 @@ def get_cycles_from_df(df: pl.LazyFrame) -> list[str]:
 
 
 def get_cycles_by_batch_plate(
-    df: pl.LazyFrame, batch_id: str, plate_id: str
+    df: pl.DataFrame | pl.LazyFrame, batch_id: str, plate_id: str
 ) -> list[str]:
     """Extract a list of unique cycle IDs for a given batch and plate ID.
 
     Parameters
     ----------
-    df : pl.LazyFrame
-        The input Polars LazyFrame.
+    df : pl.DataFrame | pl.LazyFrame
+        The input Polars DataFrame or LazyFrame.
     batch_id : str
         The batch ID to filter by.
     plate_id : str
@@ -472,17 +1033,20 @@ def get_cycles_by_batch_plate(
     Returns
     -------
     list[str]
-        A list of unique cycle IDs for the given batch and plate ID.
+        A list of unique cycle IDs for the given batch and plate ID, in
+        numeric order.
 
     """
     cycles = (
-        df.filter(
+        df.lazy()
+        .filter(
             pl.col("batch_id").eq(batch_id)
             & pl.col("plate_id").eq(plate_id)
             & pl.col("cycle_id").is_not_null()
         )
         .select(pl.col("cycle_id"))
         .unique()
+        .sort(parse_index_num("cycle_id"), "cycle_id", nulls_last=True)
         .collect()
         .to_series()
         .to_list()
@@ -490,13 +1054,172 @@ def get_cycles_by_batch_plate(
     return cycles
 
 
-def get_default_path_prefix(df: pl.LazyFrame) -> str:
+def get_index_summary_path(index_path: Path | CloudPath) -> Path | CloudPath:
+    """Get the path of the summary sidecar of an index.
+
+    Parameters
+    ----------
+    index_path : Path | CloudPath
+        Path to index, e.g. `index.parquet`.
+
+    Returns
+    -------
+    Path | CloudPath
+        Path to the summary, e.g. `index_summary.json` next to the index.
+
+    """
+    return index_path.with_name(f"{index_path.stem}_summary.json")
+
+
+def gen_index_summary(df: pl.LazyFrame) -> dict:
+    """Summarize an index for configuring experiments.
+
+    The CP and SBS images get their prefixes, channels, images per well and
+    number of cycles, and every batch, plate and cycle its image counts,
+    channels and prefixes. Each query only reads the columns it needs.
+
+    Parameters
+    ----------
+    df : pl.LazyFrame
+        Index LazyFrame.
+
+    Returns
+    -------
+    dict
+        JSON serializable summary of the index.
+
+    """
+    queries = [
+        df.select(pl.len().alias("num_rows")),
+        df.filter(pl.col("dataset_id").is_not_null()).select(
+            pl.col("dataset_id").unique(maintain_order=True)
+        ),
+        df.filter(pl.col("is_image").eq(True))
+        .group_by(
+            "batch_id",
+            "plate_id",
+            "cycle_id",
+            "is_sbs_image",
+            maintain_order=True,
+        )
+        .agg(
+            pl.len().alias("num_images"),
+            pl.col("well_id").n_unique().alias("num_wells"),
+            pl.col("channel_dict")
+            .explode()
+            .drop_nulls()
+            .unique(maintain_order=True)
+            .alias("channels"),
+            pl.col("prefix").unique(maintain_order=True).alias("prefixes"),
+        ),
+    ]
+    for for_sbs in [False, True]:
+        images_df = filter_images(df, for_sbs)
+        well_cols = ["batch_id", "plate_id", "cycle_id", "well_id"]
+        if not for_sbs:
+            well_cols.remove("cycle_id")
+        queries += [
+            images_df.select(pl.col("prefix").unique(maintain_order=True)),
+            images_df.filter(pl.col("channel_dict").is_not_null()).select(
+                pl.col("channel_dict").explode().unique(maintain_order=True)
+            ),
+            images_df.group_by(well_cols, maintain_order=True)
+            .agg(pl.len().alias("im_per_well"))
+            .select(pl.col("im_per_well").unique(maintain_order=True)),
+            images_df.select(pl.col("cycle_id").unique().count()),
+        ]
+    num_rows, dataset_ids, groups, *images = [
+        query.collect() for query in queries
+    ]
+
+    summary = {
+        "version": INDEX_SUMMARY_VERSION,
+        "num_rows": num_rows.item(),
+        "dataset_ids": dataset_ids.to_series().to_list(),
+    }
+    for name, (prefixes, channels, im_per_well, n_cycles) in zip(
+        ["cp", "sbs"], [images[:4], images[4:]]
+    ):
+        summary[name] = {
+            "prefixes": prefixes.to_series().to_list(),
+            "channels": channels.to_series().to_list(),
+            "im_per_well": im_per_well.to_series().to_list(),
+            "n_cycles": n_cycles.item(),
+        }
+    summary["groups"] = groups.to_dicts()
+    return summary
+
+
+def write_index_summary(
+    index_path: Path | CloudPath, inventory_id: str | None = None
+) -> dict:
+    """Write the summary sidecar of an index.
+
+    Parameters
+    ----------
+    index_path : Path | CloudPath
+        Path to index. Can be local or a cloud path.
+    inventory_id : str | None
+        Id of the inventory the index was generated from, used to check
+        that an inventory delta applies to the index.
+
+    Returns
+    -------
+    dict
+        Summary of the index, see `gen_index_summary`, with the inventory id.
+
+    """
+    summary = gen_index_summary(scan_index(index_path))
+    summary["inventory_id"] = inventory_id
+    get_index_summary_path(index_path).write_text(json.dumps(summary, indent=2))
+    return summary
+
+
+def read_index_summary(index_path: Path | CloudPath) -> dict | None:
+    """Read the summary sidecar of an index.
+
+    The summary is only used if it was written for the current rows of the
+    index, which are counted from the Parquet metadata alone.
+
+    Parameters
+    ----------
+    index_path : Path | CloudPath
+        Path to index. Can be local or a cloud path.
+
+    Returns
+    -------
+    dict | None
+        Summary of the index, None if it is missing or out of date.
+
+    """
+    summary_path = get_index_summary_path(index_path)
+    if not summary_path.exists():
+        return None
+    summary = json.loads(summary_path.read_text())
+    if summary.get("version") != INDEX_SUMMARY_VERSION:
+        return None
+    num_rows = scan_index(index_path).select(pl.len()).collect().item()
+    if summary.get("num_rows") != num_rows:
+        return None
+    return summary
+
+
+def get_default_path_prefix(
+    df: pl.LazyFrame,
+    index_path: Path | CloudPath | None = None,
+    for_sbs: bool = False,
+) -> str:
     """Extract the default path prefix from a Polars LazyFrame.
 
     Parameters
     ----------
     df : pl.LazyFrame
         The input Polars LazyFrame.
+    index_path : Path | CloudPath | None
+        Path to the index of the dataframe. If it has an up to date summary,
+        the prefix is read from it instead of the dataframe.
+    for_sbs : bool
+        Whether the dataframe holds the sbs images of the index or not.
 
     Returns
     -------
@@ -504,6 +1227,9 @@ def get_default_path_prefix(df: pl.LazyFrame) -> str:
         The default path prefix for the given dataframe.
 
     """
+    summary = None if index_path is None else read_index_summary(index_path)
+    if summary is not None:
+        return summary["sbs" if for_sbs else "cp"]["prefixes"][0]
     default_path_prefix = (
         df.select(pl.col("prefix")).unique().collect().to_series().to_list()[0]
     )
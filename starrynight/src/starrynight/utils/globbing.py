@@ -1,9 +1,23 @@
 """File globbing utils."""
 
+import os
+from collections.abc import Iterator
 from enum import Enum
+from importlib.metadata import version
 from pathlib import Path
 
-from cloudpathlib import CloudPath
+from cloudpathlib import CloudPath, S3Path
+from cloudpathlib.client import Client
+
+# (path, size in bytes, modification time in seconds, etag)
+FileStat = tuple[Path | CloudPath, int | None, float | None, str | None]
+
+# cloudpathlib releases, [min, max), whose private listing API is used:
+# `Client._list_dir` and the boto3 client of `S3Client`
+CLOUDPATHLIB_PRIVATE_API_VERSIONS = ((0, 18), (1, 0))
+CLOUDPATHLIB_VERSION = tuple(
+    int(part) for part in version("cloudpathlib").split(".")[:2]
+)
 
 
 class HierarchyType(Enum):
@@ -155,3 +169,220 @@ def flatten_all(nested_dict: dict) -> list[list[str]]:
         for leaf in leaves:
             combined.append(level + [leaf])
     return combined
+
+
+def has_private_listing(client: Client) -> bool:
+    """Check if the private listing API of a cloudpathlib client can be used.
+
+    Parameters
+    ----------
+    client : Client
+        cloudpathlib client.
+
+    Returns
+    -------
+    bool
+        True if the installed cloudpathlib release is one the private API is
+        known to work with, and the client has it.
+
+    """
+    min_version, max_version = CLOUDPATHLIB_PRIVATE_API_VERSIONS
+    return min_version <= CLOUDPATHLIB_VERSION < max_version and hasattr(
+        client, "_list_dir"
+    )
+
+
+def list_cloud_dir(
+    root_dir: CloudPath, recursive: bool
+) -> Iterator[tuple[CloudPath, bool]]:
+    """List the children of a cloud directory.
+
+    `Client._list_dir` pages through the listing API, whereas `rglob` builds
+    the complete subtree in memory before yielding anything. The public
+    `iterdir` and `rglob` are used on cloudpathlib releases without it.
+
+    Parameters
+    ----------
+    root_dir : CloudPath
+        Directory to list.
+    recursive : bool
+        List the whole subtree instead of the immediate children.
+
+    Yields
+    ------
+    tuple[CloudPath, bool]
+        Child path and a flag that is True if the child is a directory.
+
+    """
+    if has_private_listing(root_dir.client):
+        yield from root_dir.client._list_dir(root_dir, recursive=recursive)
+        return
+    for child in root_dir.rglob("*") if recursive else root_dir.iterdir():
+        yield child, child.is_dir()
+
+
+def list_dir(
+    root_dir: Path | CloudPath,
+) -> Iterator[tuple[Path | CloudPath, bool]]:
+    """List the immediate children of a directory.
+
+    Parameters
+    ----------
+    root_dir : Path | CloudPath
+        Directory to list. Can be local or a cloud path.
+
+    Yields
+    ------
+    tuple[Path | CloudPath, bool]
+        Child path and a flag that is True if the child is a directory.
+        Symlinked directories are skipped.
+
+    """
+    if isinstance(root_dir, CloudPath):
+        for child, is_dir in list_cloud_dir(root_dir, recursive=False):
+            # some backends include the directory itself
+            if child != root_dir:
+                yield child, is_dir
+        return
+
+    with os.scandir(root_dir) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    yield Path(entry.path), True
+                continue
+            yield Path(entry.path), False
+
+
+def scan_files(root_dir: Path | CloudPath) -> Iterator[Path | CloudPath]:
+    """Lazily yield all the files under a directory.
+
+    Unlike `rglob`, files are yielded while the tree is being listed, so the
+    memory used does not grow with the size of the tree. Local trees are
+    walked with `os.scandir`, which gets the file type from the directory
+    listing without an extra stat call per file. Cloud trees are listed with
+    a single recursive, paginated listing of the prefix.
+
+    Parameters
+    ----------
+    root_dir : Path | CloudPath
+        Directory to scan. Can be local or a cloud path.
+
+    Yields
+    ------
+    Path | CloudPath
+        Path of every file under `root_dir`.
+
+    """
+    if isinstance(root_dir, CloudPath):
+        for child, is_dir in list_cloud_dir(root_dir, recursive=True):
+            if not is_dir:
+                yield child
+        return
+
+    stack = [root_dir]
+    while stack:
+        for child, is_dir in list_dir(stack.pop()):
+            if is_dir:
+                stack.append(child)
+            else:
+                yield child
+
+
+def stat_file(file: Path | CloudPath) -> FileStat:
+    """Get the stats of a single file.
+
+    Parameters
+    ----------
+    file : Path | CloudPath
+        File path. Can be local or a cloud path.
+
+    Returns
+    -------
+    FileStat
+        Path, size, modification time and ETag (always None) of the file.
+        Broken local symlinks have no stats.
+
+    """
+    try:
+        stat = file.stat()
+    except FileNotFoundError:
+        # Broken symlinks are listed like files, but cannot be followed
+        if isinstance(file, Path) and file.is_symlink():
+            return file, None, None, None
+        raise
+    return file, stat.st_size, stat.st_mtime, None
+
+
+def _scan_s3_file_stats(root_dir: S3Path) -> Iterator[FileStat]:
+    """Lazily yield all the files under an S3 prefix with their stats.
+
+    The size, modification time and ETag of the files come with the
+    `list_objects_v2` pages of the boto3 client. On cloudpathlib releases
+    where that client is not known to be available, files are listed
+    without stats.
+
+    Parameters
+    ----------
+    root_dir : S3Path
+        Directory to scan.
+
+    Yields
+    ------
+    FileStat
+        Path, size, modification time and ETag of every file under
+        `root_dir`.
+
+    """
+    if not has_private_listing(root_dir.client) or not hasattr(
+        root_dir.client, "client"
+    ):
+        for file in scan_files(root_dir):
+            yield file, None, None, None
+        return
+    prefix = root_dir.key
+    if prefix and not prefix.endswith("/"):
+        prefix += "/"
+    paginator = root_dir.client.client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=root_dir.bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            # skip s3 fake directories
+            if obj["Key"].endswith("/"):
+                continue
+            yield (
+                root_dir.client.CloudPath(
+                    f"{root_dir.cloud_prefix}{root_dir.bucket}/{obj['Key']}"
+                ),
+                obj["Size"],
+                obj["LastModified"].timestamp(),
+                obj["ETag"].strip('"'),
+            )
+
+
+def scan_file_stats(root_dir: Path | CloudPath) -> Iterator[FileStat]:
+    """Lazily yield all the files under a directory with their stats.
+
+    Same as `scan_files`, but also yields the size and modification time of
+    every file. For S3 paths the stats (and the ETag) come with the listing
+    itself. Other cloud backends are listed without stats.
+
+    Parameters
+    ----------
+    root_dir : Path | CloudPath
+        Directory to scan. Can be local or a cloud path.
+
+    Yields
+    ------
+    FileStat
+        Path, size, modification time and ETag of every file under
+        `root_dir`. Unavailable stats are None.
+
+    """
+    if isinstance(root_dir, S3Path):
+        yield from _scan_s3_file_stats(root_dir)
+    elif isinstance(root_dir, CloudPath):
+        for file in scan_files(root_dir):
+            yield file, None, None, None
+    else:
+        for file in scan_files(root_dir):
+            yield stat_file(file)
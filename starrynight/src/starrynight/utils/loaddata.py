@@ -0,0 +1,532 @@
+"""Shared LoadData generation."""
+
+import csv
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from io import TextIOWrapper
+from pathlib import Path
+
+import polars as pl
+from cloudpathlib import AnyPath, CloudPath
+from cpgdata.utils import parallel
+
+from starrynight.utils.dfutils import IndexHierarchy, parse_index_num
+from starrynight.utils.misc import staged_directory
+
+# Directories with at least this many LoadData files are listed once,
+# instead of checking every file on its own
+LOADDATA_LIST_MIN_FILES = 32
+
+LOADDATA_FILES_SCHEMA = {
+    "loaddata": pl.String,
+    "column": pl.String,
+    "pathname": pl.String,
+    "filename": pl.String,
+}
+
+
+def write_levels(
+    partitions: list[tuple[list[str], pl.DataFrame]],
+    write_level: Callable[..., None],
+    kwargs: dict,
+    job_idx: int = 0,
+) -> None:
+    """Write the LoadData files of a chunk of units of work.
+
+    Parameters
+    ----------
+    partitions : list[tuple[list[str], pl.DataFrame]]
+        Level values and images of the units of work.
+    write_level : Callable[..., None]
+        Writer of one unit of work.
+    kwargs : dict
+        Arguments passed on to `write_level`.
+    job_idx : int, optional
+        Job index (default is 0).
+
+    """
+    for level, level_df in partitions:
+        write_level(level, level_df.lazy(), **kwargs)
+
+
+def write_partitions(
+    partitions: list[tuple[list[str], pl.DataFrame]],
+    write_level: Callable[..., None],
+    jobs: int,
+    kwargs: dict,
+) -> None:
+    """Write units of work, in parallel when there are several of them.
+
+    Parameters
+    ----------
+    partitions : list[tuple[list[str], pl.DataFrame]]
+        Level values and images of the units of work.
+    write_level : Callable[..., None]
+        Writer of one unit of work, see `write_loaddata_levels`.
+    jobs : int
+        Number of parallel jobs to use.
+    kwargs : dict
+        Arguments passed on to `write_level`.
+
+    """
+    if jobs <= 1 or len(partitions) <= 1:
+        write_levels(partitions, write_level, kwargs)
+    else:
+        parallel(partitions, write_levels, [write_level, kwargs], jobs)
+
+
+def write_loaddata_levels(
+    images_df: pl.LazyFrame | pl.DataFrame | IndexHierarchy,
+    uow_hierarchy: list[str],
+    write_level: Callable[..., None],
+    jobs: int = 1,
+    clean: bool = False,
+    **kwargs: object,
+) -> list[list[str]]:
+    """Write the LoadData files of every unit of work.
+
+    The images are collected once and split into the units of work in a
+    single pass, instead of filtering the index for every level. The units of
+    work are independent, so with more than one job they are written in
+    parallel by a process pool.
+
+    The files are written to a staging directory and only the files whose
+    content changed replace the files of `out_path`, see `staged_directory`.
+    Re-running a generator then keeps the modification times of the units
+    of work that did not change.
+
+    Parameters
+    ----------
+    images_df : pl.LazyFrame | pl.DataFrame | IndexHierarchy
+        Images to write, or their hierarchy on the unit of work levels.
+    uow_hierarchy : list[str]
+        Unit of work levels, e.g. `["batch_id", "plate_id"]`.
+    write_level : Callable[..., None]
+        Writer of one unit of work, called as
+        `write_level(level, level_df, **kwargs)` with the level values and
+        the images of the unit of work. It must be importable by the worker
+        processes, i.e. defined at module level.
+    jobs : int
+        Number of parallel jobs to use.
+    clean : bool
+        Remove the files of `out_path` that were not written.
+    **kwargs : object
+        Arguments passed on to `write_level`, with the LoadData directory as
+        `out_path`.
+
+    Returns
+    -------
+    list[list[str]]
+        Level values of the units of work written.
+
+    """
+    if isinstance(images_df, IndexHierarchy):
+        images_hierarchy = images_df
+        if images_hierarchy.levels != uow_hierarchy:
+            raise ValueError(
+                f"Hierarchy levels {images_hierarchy.levels} do not match"
+                f" the unit of work {uow_hierarchy}"
+            )
+    else:
+        images_hierarchy = IndexHierarchy(images_df, uow_hierarchy)
+
+    partitions = list(images_hierarchy.partitions())
+    if "out_path" not in kwargs:
+        write_partitions(partitions, write_level, jobs, kwargs)
+    else:
+        with staged_directory(kwargs["out_path"], delete=clean) as staging_path:
+            kwargs = {**kwargs, "out_path": staging_path}
+            write_partitions(partitions, write_level, jobs, kwargs)
+    return [level for level, _ in partitions]
+
+
+def frame_index_expr(channels: list[str]) -> pl.Expr:
+    """Build the frame of a channel in multichannel images.
+
+    Parameters
+    ----------
+    channels : list[str]
+        Index channels of the LoadData channel, more than one when several
+        channels map to the same legacy channel.
+
+    Returns
+    -------
+    pl.Expr
+        First position of the channels in `channel_dict`, null if missing.
+
+    """
+    return (
+        pl.col("channel_dict")
+        .list.eval(pl.arg_where(pl.element().is_in(channels)))
+        .list.first()
+    )
+
+
+def key_dir_expr(path_mask: str) -> pl.Expr:
+    """Build the directory of the image keys under a path mask.
+
+    Parameters
+    ----------
+    path_mask : str
+        Path prefix mask to use.
+
+    Returns
+    -------
+    pl.Expr
+        Directory of `key` with a trailing slash (expected by cellprofiler).
+
+    """
+    return pl.concat_str(
+        [
+            pl.lit(f"{path_mask.rstrip('/')}/"),
+            pl.col("key").str.replace(r"(^|/)[^/]*$", ""),
+            pl.lit("/"),
+        ]
+    )
+
+
+def well_value_expr() -> pl.Expr:
+    """Build the well value by stripping the 'Well' prefix if present.
+
+    Returns
+    -------
+    pl.Expr
+        Well value of `well_id`.
+
+    """
+    return pl.col("well_id").str.strip_prefix("Well")
+
+
+def lookup_index_files(
+    sites_df: pl.DataFrame,
+    index_df: pl.LazyFrame,
+    channels: list[str],
+    cycles: list[str] | None = None,
+    fallback_cycle: str | None = None,
+) -> pl.DataFrame:
+    """Look up the files of every site in an output index with one join.
+
+    The sites are crossed with the requested channels (and cycles) and joined
+    against the files of the index on well, site, channel and cycle. Sites are
+    matched on their number, so zero padded ids match the ids of the output
+    indexes written from LoadData csvs. When a cycle has no file, the file of
+    `fallback_cycle` is used instead.
+
+    Parameters
+    ----------
+    sites_df : pl.DataFrame
+        Sites to look up, with `well_id` and `site_id` columns.
+    index_df : pl.LazyFrame
+        Output index with the files of the sites.
+    channels : list[str]
+        Channel of each file to look up.
+    cycles : list[str] | None
+        Cycle of each file to look up, None to match on channels only.
+    fallback_cycle : str | None
+        Cycle to use for files missing from their cycle.
+
+    Returns
+    -------
+    pl.DataFrame
+        The sites with `filename` and `pathname` list columns, holding the
+        files in the order of `channels`.
+
+    """
+    keys = ["well_id", "site_num", "channel_id"]
+    lookups = pl.DataFrame(
+        {"channel_id": channels}, schema={"channel_id": pl.String}
+    )
+    if cycles is not None:
+        keys.append("cycle_id")
+        lookups = lookups.with_columns(
+            cycle_id=pl.Series(cycles, dtype=pl.String)
+        )
+    lookups = lookups.with_row_index("lookup")
+
+    files = (
+        index_df.filter(pl.col("filename").is_not_null())
+        .select(
+            pl.col("well_id"),
+            parse_index_num("site_id").alias("site_num"),
+            pl.col("channel_id"),
+            pl.col("cycle_id"),
+            pl.col("filename"),
+            # Parent directory of the file
+            pl.concat_str([pl.col("prefix"), pl.lit("/"), pl.col("key")])
+            .str.replace(r"/[^/]*$", "")
+            .alias("pathname"),
+        )
+        .unique(subset=keys, keep="first", maintain_order=True)
+        .select(*keys, "filename", "pathname")
+        .collect()
+    )
+    sites_df = sites_df.select(
+        "well_id", "site_id", parse_index_num("site_id").alias("site_num")
+    )
+    site_files = sites_df.join(lookups, how="cross").join(
+        files, on=keys, how="left", nulls_equal=True
+    )
+    if fallback_cycle is not None and cycles is not None:
+        fallback_keys = [*keys[:-1], "fallback_cycle_id"]
+        site_files = site_files.with_columns(
+            fallback_cycle_id=pl.lit(fallback_cycle, pl.String)
+        ).join(
+            files.rename(
+                {
+                    "cycle_id": "fallback_cycle_id",
+                    "filename": "fallback_filename",
+                    "pathname": "fallback_pathname",
+                }
+            ),
+            on=fallback_keys,
+            how="left",
+            nulls_equal=True,
+        )
+        site_files = site_files.with_columns(
+            filename=pl.coalesce("filename", "fallback_filename"),
+            pathname=pl.coalesce("pathname", "fallback_pathname"),
+        )
+
+    missing = site_files.filter(pl.col("filename").is_null())
+    if not missing.is_empty():
+        row = missing.row(0, named=True)
+        cycle = f" cycle {row['cycle_id']}" if cycles is not None else ""
+        raise ValueError(
+            f"No file for channel {row['channel_id']}{cycle} of well"
+            f" {row['well_id']} site {row['site_id']} in the output index"
+        )
+    return sites_df.drop("site_num").join(
+        site_files.group_by("well_id", "site_id").agg(
+            pl.col("filename").sort_by("lookup"),
+            pl.col("pathname").sort_by("lookup"),
+        ),
+        on=["well_id", "site_id"],
+        how="left",
+        nulls_equal=True,
+        maintain_order="left",
+    )
+
+
+def write_loaddata_csv(
+    images_df: pl.LazyFrame | pl.DataFrame,
+    heads: list[str],
+    values: list[pl.Expr],
+    f: TextIOWrapper,
+) -> None:
+    """Write a LoadData csv with a row per image.
+
+    The rows are computed from the images in a single query and written with
+    one `write_csv`, matching the output of `csv.writer`: CRLF line endings,
+    minimal quoting and empty or unset values left unquoted.
+
+    Parameters
+    ----------
+    images_df : pl.LazyFrame | pl.DataFrame
+        Images of the rows.
+    heads : list[str]
+        LoadData column headers.
+    values : list[pl.Expr]
+        Column values, in the order of `heads`.
+    f : TextIOWrapper
+        Handle of the csv file.
+
+    """
+    if len(heads) != len(values):
+        raise ValueError(
+            f"Got {len(values)} values for {len(heads)} LoadData columns"
+        )
+    # Headers may repeat, so the rows are built on positional names
+    rows = (
+        images_df.lazy()
+        .select(
+            value.cast(pl.String).replace("", None).alias(str(i))
+            for i, value in enumerate(values)
+        )
+        .collect()
+    )
+    for head, col in zip(heads, rows.columns):
+        if head.startswith("Frame_") and rows[col].null_count() > 0:
+            raise ValueError(f"Channel of {head} is missing from the images")
+
+    loaddata_writer = csv.writer(f, delimiter=",", quoting=csv.QUOTE_MINIMAL)
+    loaddata_writer.writerow(heads)
+    f.write(rows.write_csv(include_header=False, line_terminator="\r\n"))
+
+
+def get_loaddata_files(loaddata_path: Path | CloudPath) -> pl.DataFrame:
+    """Collect the files referenced by LoadData csvs.
+
+    Parameters
+    ----------
+    loaddata_path : Path | CloudPath
+        LoadData csv, or directory searched for LoadData csvs.
+
+    Returns
+    -------
+    pl.DataFrame
+        Unique `loaddata`, `column`, `pathname` and `filename` of the
+        `FileName_*` columns and their `PathName_*` columns.
+
+    """
+    if loaddata_path.is_dir():
+        csv_paths = sorted(loaddata_path.rglob("*.csv"))
+    else:
+        csv_paths = [loaddata_path]
+    files = [pl.DataFrame(schema=LOADDATA_FILES_SCHEMA)]
+    for csv_path in csv_paths:
+        with csv_path.open("rb") as f:
+            loaddata_df = pl.read_csv(f, infer_schema=False)
+        for col in loaddata_df.columns:
+            if not col.startswith("FileName_"):
+                continue
+            pathname_col = col.replace("FileName_", "PathName_", 1)
+            files.append(
+                loaddata_df.select(
+                    pl.lit(str(csv_path)).alias("loaddata"),
+                    pl.lit(col).alias("column"),
+                    (
+                        pl.col(pathname_col)
+                        if pathname_col in loaddata_df.columns
+                        else pl.lit(None, pl.String)
+                    ).alias("pathname"),
+                    pl.col(col).alias("filename"),
+                ).unique(maintain_order=True)
+            )
+    return pl.concat(files)
+
+
+def get_loaddata_cost(loaddata_path: Path | CloudPath) -> int:
+    """Estimate the cost of running a pipeline on a LoadData csv.
+
+    Parameters
+    ----------
+    loaddata_path : Path | CloudPath
+        LoadData csv.
+
+    Returns
+    -------
+    int
+        Number of image sets times the number of `FileName_*` columns.
+
+    """
+    with loaddata_path.open(newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        num_rows = sum(1 for _ in reader)
+    num_images = sum(col.startswith("FileName_") for col in header)
+    return num_rows * max(num_images, 1)
+
+
+def check_dir_files(
+    dir_path: Path | CloudPath, filenames: list[str]
+) -> list[bool]:
+    """Check which files of a directory exist.
+
+    Directories with many files to check are listed once, otherwise every
+    file is checked on its own, which is a HEAD request on cloud paths.
+
+    Parameters
+    ----------
+    dir_path : Path | CloudPath
+        Directory of the files.
+    filenames : list[str]
+        Names of the files.
+
+    Returns
+    -------
+    list[bool]
+        Whether each file exists.
+
+    """
+    if len(filenames) < LOADDATA_LIST_MIN_FILES:
+        return [dir_path.joinpath(name).is_file() for name in filenames]
+    try:
+        names = {path.name for path in dir_path.iterdir()}
+    except (FileNotFoundError, NotADirectoryError):
+        names = set()
+    return [name in names for name in filenames]
+
+
+def find_missing_files(files_df: pl.DataFrame, jobs: int = 1) -> pl.DataFrame:
+    """Find the LoadData files that do not exist.
+
+    The unique files are grouped by directory, and the directories are
+    checked concurrently by a thread pool, as checking a file is mostly
+    waiting on the filesystem or on a request.
+
+    Parameters
+    ----------
+    files_df : pl.DataFrame
+        LoadData files, see `get_loaddata_files`.
+    jobs : int
+        Number of directories checked at a time.
+
+    Returns
+    -------
+    pl.DataFrame
+        The missing files, with their `path`. Files without a name or
+        directory are always missing.
+
+    """
+    files_df = files_df.with_columns(
+        pl.when(
+            pl.col("filename").is_not_null() & pl.col("pathname").is_not_null()
+        )
+        .then(
+            pl.concat_str(
+                pl.col("pathname").str.strip_suffix("/"),
+                pl.lit("/"),
+                pl.col("filename"),
+            )
+        )
+        .alias("path")
+    )
+    dirs = (
+        files_df.filter(pl.col("path").is_not_null())
+        .group_by("pathname", maintain_order=True)
+        .agg(pl.col("filename").unique(maintain_order=True))
+        .rows()
+    )
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        exists = executor.map(
+            lambda row: check_dir_files(AnyPath(row[0]), row[1]), dirs
+        )
+        found = [
+            f"{pathname.removesuffix('/')}/{name}"
+            for (pathname, filenames), dir_exists in zip(dirs, exists)
+            for name, name_exists in zip(filenames, dir_exists)
+            if name_exists
+        ]
+    return files_df.filter(
+        pl.col("path").is_null()
+        | ~pl.col("path").is_in(pl.Series(found, dtype=pl.String).implode())
+    )
+
+
+def validate_loaddata(
+    loaddata_path: Path | CloudPath,
+    out_path: Path | CloudPath,
+    jobs: int = 1,
+) -> pl.DataFrame:
+    """Check that the files of LoadData csvs exist before running them.
+
+    Parameters
+    ----------
+    loaddata_path : Path | CloudPath
+        LoadData csv, or directory searched for LoadData csvs.
+    out_path : Path | CloudPath
+        Path of the missing files report csv.
+    jobs : int
+        Number of directories checked at a time.
+
+    Returns
+    -------
+    pl.DataFrame
+        The missing files, see `find_missing_files`.
+
+    """
+    missing_df = find_missing_files(get_loaddata_files(loaddata_path), jobs)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with out_path.open("wb") as f:
+        missing_df.write_csv(f)
+    return missing_df
@@ -1,8 +1,15 @@
 """Misc utilities."""
 
+import hashlib
 import shutil
+import tempfile
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
+from urllib.parse import quote
 
+import polars as pl
 import pyarrow as pa
 from cloudpathlib import CloudPath
 from pyarrow import parquet as pq
@@ -64,8 +71,327 @@ def resolve_path_loaddata(
         return f"{path_mask.resolve().__str__().rstrip('/')}/{filepath.__str__().lstrip('/')}/"
 
 
+# Rows per row group written by `ParquetSink`
+PQ_ROW_GROUP_SIZE = 128 * 1024
+
+# Compression codec used by `ParquetSink`
+PQ_COMPRESSION = "zstd"
+
+
+# Directory name used for null partition values
+HIVE_NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+
+def to_arrow_table(
+    batch: pa.Table | pa.RecordBatch | pl.DataFrame | dict | list[dict],
+    schema: pa.Schema,
+) -> pa.Table:
+    """Convert a batch of rows to an arrow table with the given schema.
+
+    Parameters
+    ----------
+    batch : pa.Table | pa.RecordBatch | pl.DataFrame | dict | list[dict]
+        Rows to convert. Dicts are column dicts, lists are lists of rows.
+    schema : pa.Schema
+        Schema of the table.
+
+    Returns
+    -------
+    pa.Table
+        Arrow table.
+
+    """
+    if isinstance(batch, dict):
+        batch = pa.Table.from_pydict(batch, schema=schema)
+    elif isinstance(batch, list):
+        batch = pa.Table.from_pylist(batch, schema=schema)
+    elif isinstance(batch, pl.DataFrame):
+        batch = batch.to_arrow()
+    elif isinstance(batch, pa.RecordBatch):
+        batch = pa.Table.from_batches([batch])
+    if not batch.schema.equals(schema):
+        batch = batch.select(schema.names).cast(schema)
+    return batch
+
+
+def get_hive_partition_dir(
+    partition_cols: list[str], values: tuple | list
+) -> str:
+    """Get the Hive-style directory of a partition.
+
+    Parameters
+    ----------
+    partition_cols : list[str]
+        Partition columns.
+    values : tuple | list
+        Partition values.
+
+    Returns
+    -------
+    str
+        Relative directory, e.g. `batch_id=Batch1/plate_id=Plate1`.
+
+    """
+    return "/".join(
+        f"{col}={HIVE_NULL_PARTITION if val is None else quote(str(val), safe='')}"
+        for col, val in zip(partition_cols, values)
+    )
+
+
+class ParquetSink:
+    """Streaming Parquet writer.
+
+    Batches pushed to the sink are buffered and written as row groups of
+    `row_group_size` rows, so that producers never need to hold the whole
+    table in memory. Column statistics are written for every row group.
+
+    Parameters
+    ----------
+    out_path : Path | CloudPath
+        Path to save Parquet file. Can be local or a cloud path.
+    schema : pa.Schema | type[BaseModel]
+        Arrow schema or PyDantic model of the rows.
+    row_group_size : int
+        Number of rows per row group.
+    compression : str
+        Compression codec.
+    use_dictionary : bool | list[str]
+        Dictionary encode all columns, or only the listed column paths,
+        e.g. `col.list.element` for the values of a list column.
+
+    """
+
+    def __init__(
+        self,
+        out_path: Path | CloudPath,
+        schema: pa.Schema | type[BaseModel],
+        row_group_size: int = PQ_ROW_GROUP_SIZE,
+        compression: str = PQ_COMPRESSION,
+        use_dictionary: bool | list[str] = True,
+    ) -> None:
+        """Open the Parquet file for writing."""
+        if not isinstance(schema, pa.Schema):
+            schema = get_pyarrow_schema(schema)
+        self.out_path = out_path
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self.num_rows = 0
+        self._buffer: list[pa.Table] = []
+        self._buffer_rows = 0
+        out_path.parent.mkdir(exist_ok=True, parents=True)
+        self._file = out_path.open("wb")
+        self._writer = pq.ParquetWriter(
+            self._file,
+            schema,
+            compression=compression,
+            use_dictionary=use_dictionary,
+            write_statistics=True,
+        )
+
+    def write(
+        self,
+        batch: pa.Table | pa.RecordBatch | pl.DataFrame | dict | list[dict],
+    ) -> None:
+        """Push a batch of rows to the sink.
+
+        Parameters
+        ----------
+        batch : pa.Table | pa.RecordBatch | pl.DataFrame | dict | list[dict]
+            Rows to write. Dicts are column dicts, lists are lists of rows.
+
+        """
+        batch = to_arrow_table(batch, self.schema)
+        if batch.num_rows == 0:
+            return
+        self._buffer.append(batch)
+        self._buffer_rows += batch.num_rows
+        if self._buffer_rows >= self.row_group_size:
+            self._flush(final=False)
+
+    def _flush(self, final: bool) -> None:
+        table = pa.concat_tables(self._buffer)
+        # Only write full row groups until the sink is closed
+        num_rows = (
+            table.num_rows
+            if final
+            else table.num_rows - table.num_rows % self.row_group_size
+        )
+        if num_rows:
+            self._writer.write_table(
+                table.slice(0, num_rows), row_group_size=self.row_group_size
+            )
+            self.num_rows += num_rows
+        rest = table.slice(num_rows)
+        self._buffer = [rest] if rest.num_rows else []
+        self._buffer_rows = rest.num_rows
+
+    def close(self) -> None:
+        """Write buffered rows and close the file."""
+        if self._buffer:
+            self._flush(final=True)
+        self._writer.close()
+        self._file.close()
+
+    def abort(self) -> None:
+        """Close the file without the buffered rows and remove it."""
+        self._buffer = []
+        self._writer.close()
+        self._file.close()
+        self.out_path.unlink(missing_ok=True)
+
+    def __enter__(self) -> "ParquetSink":
+        """Enter context."""
+        return self
+
+    def __exit__(
+        self, exc_type: type[BaseException] | None, *exc: object
+    ) -> None:
+        """Close the sink on exit, or remove the file if the block raised."""
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class PartitionedParquetSink:
+    """Streaming writer for a Hive-partitioned Parquet dataset.
+
+    Rows pushed to the sink are split on the partition columns and staged
+    in one local file per partition. On close, every partition is sorted on
+    the sort columns and written to
+    `<out_dir>/<col>=<val>/.../part-0.parquet`. Partition columns are also
+    kept in the files, so that their types do not depend on the directory
+    names.
+
+    Parameters
+    ----------
+    out_dir : Path | CloudPath
+        Path to the dataset directory. Can be local or a cloud path.
+    schema : pa.Schema | type[BaseModel]
+        Arrow schema or PyDantic model of the rows.
+    partition_cols : list[str]
+        Columns to partition on.
+    sort_cols : list[str] | None
+        Columns to sort each partition on.
+    row_group_size : int
+        Number of rows per row group.
+    use_dictionary : bool | list[str]
+        Columns to dictionary encode, see `ParquetSink`.
+
+    """
+
+    def __init__(
+        self,
+        out_dir: Path | CloudPath,
+        schema: pa.Schema | type[BaseModel],
+        partition_cols: list[str],
+        sort_cols: list[str] | None = None,
+        row_group_size: int = PQ_ROW_GROUP_SIZE,
+        use_dictionary: bool | list[str] = True,
+    ) -> None:
+        """Create the staging directory."""
+        if not isinstance(schema, pa.Schema):
+            schema = get_pyarrow_schema(schema)
+        self.out_dir = out_dir
+        self.schema = schema
+        self.partition_cols = partition_cols
+        self.sort_cols = sort_cols or []
+        self.row_group_size = row_group_size
+        self.use_dictionary = use_dictionary
+        self._staging_dir = tempfile.TemporaryDirectory()
+        self._sinks: dict[tuple, ParquetSink] = {}
+
+    def write(
+        self,
+        batch: pa.Table | pa.RecordBatch | pl.DataFrame | dict | list[dict],
+    ) -> None:
+        """Push a batch of rows to the sink.
+
+        Parameters
+        ----------
+        batch : pa.Table | pa.RecordBatch | pl.DataFrame | dict | list[dict]
+            Rows to write. Dicts are column dicts, lists are lists of rows.
+
+        """
+        df = pl.from_arrow(to_arrow_table(batch, self.schema))
+        if len(df) == 0:
+            return
+        for values, part in df.partition_by(
+            self.partition_cols, as_dict=True, maintain_order=True
+        ).items():
+            if values not in self._sinks:
+                self._sinks[values] = ParquetSink(
+                    Path(self._staging_dir.name).joinpath(
+                        f"part_{len(self._sinks)}.parquet"
+                    ),
+                    self.schema,
+                    self.row_group_size,
+                )
+            self._sinks[values].write(part)
+
+    def close(self) -> None:
+        """Sort the staged partitions and write them to the dataset.
+
+        Partition files already written are removed if writing another one
+        fails.
+        """
+        out_paths = []
+        try:
+            if not isinstance(self.out_dir, CloudPath):
+                self.out_dir.mkdir(parents=True, exist_ok=True)
+            for values, staging_sink in self._sinks.items():
+                staging_sink.close()
+                df = pl.read_parquet(staging_sink.out_path)
+                if self.sort_cols:
+                    df = df.sort(
+                        self.sort_cols, nulls_last=True, maintain_order=True
+                    )
+                out_path = self.out_dir.joinpath(
+                    get_hive_partition_dir(self.partition_cols, values),
+                    "part-0.parquet",
+                )
+                out_paths.append(out_path)
+                with ParquetSink(
+                    out_path,
+                    self.schema,
+                    self.row_group_size,
+                    use_dictionary=self.use_dictionary,
+                ) as sink:
+                    sink.write(df)
+        except BaseException:
+            for out_path in out_paths:
+                out_path.unlink(missing_ok=True)
+            raise
+        finally:
+            self._staging_dir.cleanup()
+
+    def abort(self) -> None:
+        """Discard the staged partitions without writing the dataset."""
+        try:
+            for staging_sink in self._sinks.values():
+                staging_sink.abort()
+        finally:
+            self._staging_dir.cleanup()
+
+    def __enter__(self) -> "PartitionedParquetSink":
+        """Enter context."""
+        return self
+
+    def __exit__(
+        self, exc_type: type[BaseException] | None, *exc: object
+    ) -> None:
+        """Write the dataset on exit, or discard it if the block raised."""
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
 def write_pq(
-    col_dict: dict, dict_type: type[BaseModel], out_path: Path | CloudPath
+    col_dict: dict,
+    dict_type: type[BaseModel],
+    out_path: Path | CloudPath,
+    row_group_size: int = PQ_ROW_GROUP_SIZE,
 ) -> None:
     """Write Parquet file.
 
@@ -77,37 +403,235 @@ def write_pq(
         PyDantic model.
     out_path : Path | CloudPath
         Path to save Parquet file. Can be local or a cloud path.
+    row_group_size : int
+        Number of rows per row group.
 
     """
-    pq_schema = get_pyarrow_schema(dict_type)
-    out_path.parent.mkdir(exist_ok=True, parents=True)
-    with out_path.open("wb") as f:
-        with pq.ParquetWriter(f, pq_schema) as pq_witer:
-            pq_witer.write_table(
-                pa.Table.from_pydict(col_dict, schema=pq_schema)
-            )
+    with ParquetSink(out_path, dict_type, row_group_size) as sink:
+        sink.write(col_dict)
 
 
 def merge_pq(
-    files_list: list[CloudPath | Path], out_file: CloudPath | Path
+    files_list: list[CloudPath | Path],
+    out_file: CloudPath | Path,
+    row_group_size: int = PQ_ROW_GROUP_SIZE,
+    metadata: dict[str, str] | None = None,
 ) -> None:
     """Merge parquet files.
 
+    Shards are streamed one row group at a time into the merged file.
+
     Parameters
     ----------
     files_list : list[CloudPath | Path]
         List of file paths to merge
     out_file : CloudPath | Path
         Path to merged file
+    row_group_size : int
+        Number of rows per row group of the merged file.
+    metadata : dict[str, str] | None
+        Key-value metadata of the merged file, see `read_pq_metadata`.
 
     """
     schema = pq.ParquetFile(files_list[0]).schema_arrow
-    with out_file.open("wb") as f:
-        with pq.ParquetWriter(f, schema=schema) as writer:
-            for file in files_list:
-                if isinstance(file, CloudPath):
-                    file = file.fspath
-                writer.write_table(pq.read_table(file, schema=schema))
+    if metadata:
+        schema = schema.with_metadata(metadata)
+    with ParquetSink(out_file, schema, row_group_size) as sink:
+        for file in files_list:
+            if isinstance(file, CloudPath):
+                file = file.fspath
+            shard = pq.ParquetFile(file)
+            for idx in range(shard.num_row_groups):
+                sink.write(shard.read_row_group(idx))
+
+
+def read_pq_metadata(pq_path: Path | CloudPath) -> dict[str, str]:
+    """Read the key-value metadata of a Parquet file.
+
+    Parameters
+    ----------
+    pq_path : Path | CloudPath
+        Path to Parquet file. Can be local or a cloud path.
+
+    Returns
+    -------
+    dict[str, str]
+        Key-value metadata, without the Arrow schema.
+
+    """
+    with pq_path.open("rb") as f:
+        metadata = pq.ParquetFile(f).metadata.metadata or {}
+    return {
+        key.decode(): value.decode()
+        for key, value in metadata.items()
+        if key != b"ARROW:schema"
+    }
+
+
+def replace_path(
+    src_path: Path | CloudPath, dst_path: Path | CloudPath
+) -> None:
+    """Replace a file or directory with a file or directory.
+
+    Local files are replaced atomically. Local directories are swapped with
+    two renames, so readers never see a mix of both. A file replaced by a
+    directory is removed first. Cloud objects are copied, which is only
+    atomic for single files.
+
+    Parameters
+    ----------
+    src_path : Path | CloudPath
+        Path to the new file or directory. Removed on success.
+    dst_path : Path | CloudPath
+        Path to replace. Can be missing.
+
+    """
+    if isinstance(dst_path, CloudPath):
+        if dst_path.is_dir():
+            dst_path.rmtree()
+        elif src_path.is_dir() and dst_path.exists():
+            dst_path.unlink()
+        if src_path.is_dir():
+            src_path.copytree(dst_path)
+            src_path.rmtree()
+        else:
+            src_path.replace(dst_path)
+    elif dst_path.is_dir():
+        old_path = dst_path.with_name(f".{dst_path.name}.old")
+        if old_path.exists():
+            shutil.rmtree(old_path)
+        dst_path.rename(old_path)
+        src_path.rename(dst_path)
+        shutil.rmtree(old_path)
+    else:
+        if src_path.is_dir() and dst_path.exists():
+            dst_path.unlink()
+        src_path.replace(dst_path)
+
+
+def _has_content(path: Path | CloudPath, content: bytes) -> bool:
+    """Check whether a file exists with the given content.
+
+    S3 files are compared through their ETag, which is the MD5 of the content
+    unless the object was uploaded in parts. Multipart uploads and the other
+    backends are downloaded and compared byte by byte.
+
+    Parameters
+    ----------
+    path : Path | CloudPath
+        File to check. Can be local or a cloud path.
+    content : bytes
+        Expected content.
+
+    Returns
+    -------
+    bool
+        True if the file holds `content`.
+
+    """
+    if not path.is_file() or path.stat().st_size != len(content):
+        return False
+    if isinstance(path, CloudPath) and path.cloud_prefix == "s3://":
+        etag = (path.etag or "").strip('"')
+        if etag and "-" not in etag:
+            return (
+                etag == hashlib.md5(content, usedforsecurity=False).hexdigest()
+            )
+    return path.read_bytes() == content
+
+
+def sync_directory(
+    src_dir: Path, dst_dir: Path | CloudPath, delete: bool = True
+) -> list[str]:
+    """Replace the files of a directory whose content changed.
+
+    Files with the same content are left untouched, so their modification
+    times, which workflow managers use to decide what to re-run, are kept.
+    Cloud files are compared and uploaded by a thread pool, S3 files through
+    their ETag when it is the MD5 of their content.
+
+    Parameters
+    ----------
+    src_dir : Path
+        Local directory with the new files.
+    dst_dir : Path | CloudPath
+        Directory to update. Can be local or a cloud path.
+    delete : bool
+        Remove the files of `dst_dir` missing from `src_dir`.
+
+    Returns
+    -------
+    list[str]
+        Relative paths of the files written or removed.
+
+    """
+    src_files = {
+        path.relative_to(src_dir).as_posix(): path
+        for path in sorted(src_dir.rglob("*"))
+        if path.is_file()
+    }
+
+    def sync_file(name: str) -> bool:
+        src_path, dst_path = src_files[name], dst_dir.joinpath(name)
+        if _has_content(dst_path, src_path.read_bytes()):
+            return False
+        dst_path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(dst_path, CloudPath):
+            dst_path.upload_from(src_path, force_overwrite_to_cloud=True)
+        else:
+            shutil.move(src_path, dst_path)
+        return True
+
+    dst_dir.mkdir(parents=True, exist_ok=True)
+    if isinstance(dst_dir, CloudPath):
+        with ThreadPoolExecutor() as executor:
+            written = list(executor.map(sync_file, src_files))
+    else:
+        written = [sync_file(name) for name in src_files]
+    changed = [
+        name for name, name_written in zip(src_files, written) if name_written
+    ]
+    if delete:
+        for dst_path in sorted(dst_dir.rglob("*")):
+            name = dst_path.relative_to(dst_dir).as_posix()
+            if name not in src_files and dst_path.is_file():
+                dst_path.unlink()
+                changed.append(name)
+    return changed
+
+
+@contextmanager
+def staged_directory(
+    out_dir: Path | CloudPath, delete: bool = True
+) -> Iterator[Path]:
+    """Stage the files written to a directory, keeping unchanged ones.
+
+    Files are written to a local staging directory and synced into `out_dir`
+    with `sync_directory` once the block succeeds. Local staging directories
+    are created next to `out_dir`, so changed files are moved with a rename.
+
+    Parameters
+    ----------
+    out_dir : Path | CloudPath
+        Directory to write. Can be local or a cloud path.
+    delete : bool
+        Remove the files of `out_dir` not written in the block.
+
+    Yields
+    ------
+    Path
+        Staging directory to write the files to.
+
+    """
+    staging_parent = None
+    if not isinstance(out_dir, CloudPath):
+        out_dir.parent.mkdir(parents=True, exist_ok=True)
+        staging_parent = out_dir.parent
+    with tempfile.TemporaryDirectory(
+        prefix=f".{out_dir.name}.staging_", dir=staging_parent
+    ) as staging_dir:
+        yield Path(staging_dir)
+        sync_directory(Path(staging_dir), out_dir, delete)
 
 
 def clean_directory(directory_path: Path | str) -> None:
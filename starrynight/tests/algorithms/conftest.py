@@ -0,0 +1,77 @@
+"""Fixtures for the algorithms depending on CellProfiler and its libraries."""
+
+import sys
+from collections.abc import Iterator
+from importlib.abc import Loader, MetaPathFinder
+from importlib.machinery import ModuleSpec
+from types import ModuleType
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+STUBBED_PACKAGES = ["cellprofiler", "cellprofiler_core", "centrosome"]
+
+
+class StubFinder(MetaPathFinder, Loader):
+    """Import every module of the stubbed packages as a `MagicMock`."""
+
+    def find_spec(
+        self,
+        fullname: str,
+        path: object = None,
+        target: ModuleType | None = None,
+    ) -> ModuleSpec | None:
+        """Find the spec of a stubbed module.
+
+        Args:
+            fullname: Name of the module
+            path: Search path of the parent package
+            target: Module being reloaded
+
+        Returns:
+            The spec of the stub, None for the other modules.
+
+        """
+        if fullname.split(".")[0] not in STUBBED_PACKAGES:
+            return None
+        return ModuleSpec(fullname, self, is_package=True)
+
+    def create_module(self, spec: ModuleSpec) -> MagicMock:
+        """Create the stub of a module.
+
+        Args:
+            spec: Spec of the module
+
+        Returns:
+            The stub.
+
+        """
+        return MagicMock(name=spec.name)
+
+    def exec_module(self, module: ModuleType) -> None:
+        """Leave the stub as is.
+
+        Args:
+            module: The stub
+
+        """
+
+
+@pytest.fixture
+def cellprofiler_stub() -> Iterator[None]:
+    """Stub CellProfiler for the modules imported by the test.
+
+    The modules imported during the test are dropped afterwards, so that
+    the starrynight modules importing the stub are not reused.
+
+    Yields:
+        None
+
+    """
+    finder = StubFinder()
+    with patch.dict(sys.modules):
+        sys.meta_path.insert(0, finder)
+        try:
+            yield
+        finally:
+            sys.meta_path.remove(finder)
@@ -0,0 +1,437 @@
+"""Test the CellProfiler workers with cellprofiler_core stubbed."""
+
+import importlib
+import os
+import sys
+import threading
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from pathlib import Path
+from types import ModuleType
+from unittest.mock import MagicMock, call, patch
+
+import pytest
+
+CP_CORE_MODULES = [
+    "preferences",
+    "pipeline",
+    "reader",
+    "utilities",
+    "utilities.java",
+    "utilities.core",
+    "utilities.core.modules",
+]
+
+
+@pytest.fixture
+def cp_core() -> Iterator[MagicMock]:
+    """Stub cellprofiler_core for the modules imported by the test.
+
+    Yields:
+        The cellprofiler_core stub. Every pipeline it creates is a new mock.
+
+    """
+    core = MagicMock()
+    core.pipeline.Pipeline.side_effect = lambda: MagicMock()
+    modules = {"cellprofiler_core": core}
+    for name in CP_CORE_MODULES:
+        module = core
+        for part in name.split("."):
+            module = getattr(module, part)
+        modules[f"cellprofiler_core.{name}"] = module
+    # Modules importing cellprofiler_core are imported again with the stub
+    with patch.dict(sys.modules, modules):
+        for name in [
+            "starrynight.utils.cellprofiler",
+            "starrynight.algorithms.cp",
+        ]:
+            sys.modules.pop(name, None)
+        yield core
+
+
+@pytest.fixture
+def cp_utils(cp_core: MagicMock) -> ModuleType:
+    """Import `starrynight.utils.cellprofiler` with the stub.
+
+    Args:
+        cp_core: The cellprofiler_core stub
+
+    Returns:
+        The module.
+
+    """
+    return importlib.import_module("starrynight.utils.cellprofiler")
+
+
+@pytest.fixture
+def cp(cp_core: MagicMock) -> Iterator[ModuleType]:
+    """Import `starrynight.algorithms.cp` with the stub.
+
+    Args:
+        cp_core: The cellprofiler_core stub
+
+    Yields:
+        The module, without a worker for the test process.
+
+    """
+    module = importlib.import_module("starrynight.algorithms.cp")
+    module._cp_worker.clear()
+    yield module
+    module._cp_worker.clear()
+
+
+def test_worker_parses_pipelines_once(
+    cp_core: MagicMock, cp_utils: ModuleType, tmp_path: Path
+):
+    """Test that every cppipe is parsed once and every run gets its files.
+
+    Args:
+        cp_core: The cellprofiler_core stub
+        cp_utils: The cellprofiler utilities module
+        tmp_path: Pytest temporary directory
+
+    """
+    worker = cp_utils.CellProfilerWorker()
+    cp_core.reader.fill_readers.assert_called_once()
+    pipe_paths = [tmp_path.joinpath("a.cppipe"), tmp_path.joinpath("b.cppipe")]
+    runs = [
+        (
+            pipe_paths[idx % 2],
+            tmp_path.joinpath(f"{idx}.csv"),
+            tmp_path.joinpath(str(idx)),
+        )
+        for idx in range(4)
+    ]
+    for pipe_path, loaddata_path, out_dir in runs:
+        worker.run(pipe_path, loaddata_path, out_dir)
+
+    assert cp_core.pipeline.Pipeline.call_count == 2
+    for pipe_path in pipe_paths:
+        pipeline = worker.get_pipeline(pipe_path)
+        pipeline.load.assert_called_once_with(pipe_path.resolve().__str__())
+        assert pipeline.run.call_count == 2
+    # Paths are resolved before the lookup
+    assert worker.get_pipeline(
+        tmp_path.joinpath("sub", "..", "a.cppipe")
+    ) is worker.get_pipeline(pipe_paths[0])
+    assert cp_core.preferences.set_data_file.call_args_list == [
+        call(loaddata_path.resolve().__str__()) for _, loaddata_path, _ in runs
+    ]
+    assert cp_core.preferences.set_default_output_directory.call_args_list == [
+        call(out_dir.resolve().__str__()) for _, _, out_dir in runs
+    ]
+    assert all(out_dir.is_dir() for _, _, out_dir in runs)
+
+
+def test_worker_refills_preloaded_modules(
+    cp_core: MagicMock, cp_utils: ModuleType
+):
+    """Test that modules preloaded with another plugin directory are refilled.
+
+    Args:
+        cp_core: The cellprofiler_core stub
+        cp_utils: The cellprofiler utilities module
+
+    """
+    fill_modules = cp_core.utilities.core.modules.fill_modules
+    set_plugin_directory = cp_core.preferences.set_plugin_directory
+    # Workers without a preloading forkserver fill the modules on first use
+    cp_utils.CellProfilerWorker(plugin_dir=Path("/plugins"))
+    fill_modules.assert_not_called()
+
+    cp_utils.fill_cp_modules("/plugins")
+    fill_modules.reset_mock()
+    cp_utils.CellProfilerWorker(plugin_dir=Path("/plugins"))
+    fill_modules.assert_not_called()
+    cp_utils.CellProfilerWorker(plugin_dir=Path("/other/plugins"))
+    fill_modules.assert_called_once()
+    assert set_plugin_directory.call_args == call("/other/plugins", False)
+
+
+def test_get_cp_worker(cp: ModuleType):
+    """Test that the worker is reused until the plugin directory changes.
+
+    Args:
+        cp: The cp algorithm module
+
+    """
+    with patch.object(
+        cp, "CellProfilerWorker", side_effect=lambda **_: MagicMock()
+    ) as worker_cls:
+        worker = cp.get_cp_worker()
+        assert cp.get_cp_worker() is worker
+        plugin_worker = cp.get_cp_worker(Path("plugins"))
+        assert plugin_worker is not worker
+        assert cp.get_cp_worker(Path("plugins")) is plugin_worker
+        assert cp.get_cp_worker() is not plugin_worker
+
+    assert worker_cls.call_args_list == [
+        call(plugin_dir=None),
+        call(plugin_dir=Path("plugins")),
+        call(plugin_dir=None),
+    ]
+
+
+def test_get_cp_context(cp: ModuleType):
+    """Test that warm workers fork from a forkserver preloading CellProfiler.
+
+    Args:
+        cp: The cp algorithm module
+
+    """
+    with patch.object(
+        type(get_context("forkserver")), "set_forkserver_preload"
+    ) as set_preload:
+        context = cp.get_cp_context(True)
+    assert context.get_start_method() == "forkserver"
+    set_preload.assert_called_once_with(cp.CP_PRELOAD_MODULES)
+    assert cp.get_cp_context(False).get_start_method() == "spawn"
+
+
+@pytest.mark.parametrize("old_plugin_dir", [None, "/old/plugins"])
+def test_cp_plugin_dir_env(
+    cp: ModuleType,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+    old_plugin_dir: str | None,
+):
+    """Test that the plugin directory is only exposed within the context.
+
+    Args:
+        cp: The cp algorithm module
+        monkeypatch: Pytest monkeypatch
+        tmp_path: Pytest temporary directory
+        old_plugin_dir: Plugin directory set before the context
+
+    """
+    env = cp.CP_PLUGIN_DIR_ENV
+    if old_plugin_dir is None:
+        monkeypatch.delenv(env, raising=False)
+    else:
+        monkeypatch.setenv(env, old_plugin_dir)
+    with pytest.raises(RuntimeError), cp.cp_plugin_dir_env(tmp_path):
+        assert os.environ[env] == tmp_path.resolve().__str__()
+        raise RuntimeError
+    assert os.environ.get(env) == old_plugin_dir
+    with cp.cp_plugin_dir_env(None):
+        assert os.environ.get(env) == old_plugin_dir
+    assert os.environ.get(env) == old_plugin_dir
+
+
+def run_uow_in_thread(
+    uow: tuple[Path, Path], out_dir: Path, plugin_dir: Path | None
+) -> tuple[int, float]:
+    """Run a fake UOW item, failing on LoadData files named `bad`.
+
+    Args:
+        uow: Paths to the pipeline and load data files
+        out_dir: Output directory path
+        plugin_dir: Path to cellprofiler plugin directory
+
+    Returns:
+        Thread id standing for the worker and seconds spent.
+
+    """
+    if uow[1].stem == "bad":
+        raise ValueError(f"bad loaddata {uow[1]}")
+    return threading.get_ident(), 1.0
+
+
+def test_run_cp_parallel_failed_uow(
+    cp_core: MagicMock, cp: ModuleType, capsys: pytest.CaptureFixture
+):
+    """Test that a failed UOW item is reported once the others have run.
+
+    Args:
+        cp_core: The cellprofiler_core stub
+        cp: The cp algorithm module
+        capsys: Pytest output capture
+
+    """
+    uow_list = [
+        (Path("a.cppipe"), Path(f"{name}.csv")) for name in ["0", "bad", "1"]
+    ]
+    with (
+        patch.object(cp, "get_loaddata_cost", return_value=1),
+        patch.object(cp, "run_cp_uow", side_effect=run_uow_in_thread) as run,
+        patch.object(
+            cp,
+            "ProcessPoolExecutor",
+            lambda jobs, mp_context: ThreadPoolExecutor(jobs),
+        ),
+        pytest.raises(RuntimeError, match="1 of 3 UOW items failed"),
+    ):
+        cp.run_cp_parallel(uow_list, Path("out"), jobs=2, warm_start=False)
+
+    assert run.call_count == 3
+    cp_core.utilities.java.stop_java.assert_called_once()
+    out = capsys.readouterr().out
+    assert "Ran 2 UOW items" in out
+    assert "failed a.cppipe on bad.csv: ValueError" in out
+
+
+def test_run_cp_parallel_stops_java(cp_core: MagicMock, cp: ModuleType):
+    """Test that the JVM is stopped when the pool breaks.
+
+    Args:
+        cp_core: The cellprofiler_core stub
+        cp: The cp algorithm module
+
+    """
+    uow_list = [(Path("a.cppipe"), Path("0.csv"))]
+    with (
+        patch.object(cp, "get_loaddata_cost", return_value=1),
+        patch.object(cp, "ProcessPoolExecutor", side_effect=BrokenProcessPool),
+        pytest.raises(BrokenProcessPool),
+    ):
+        cp.run_cp_parallel(uow_list, Path("out"), warm_start=False)
+
+    cp_core.utilities.java.start_java.assert_called_once()
+    cp_core.utilities.java.stop_java.assert_called_once()
+
+
+def test_run_cp_parallel_largest_first(cp: ModuleType):
+    """Test that UOW items are submitted by decreasing LoadData cost.
+
+    Args:
+        cp: The cp algorithm module
+
+    """
+    costs = {"small.csv": 1, "large.csv": 30, "empty.csv": 0, "medium.csv": 7}
+    uow_list = [(Path("a.cppipe"), Path(name)) for name in costs]
+    with (
+        patch.object(
+            cp, "get_loaddata_cost", side_effect=lambda path: costs[path.name]
+        ),
+        patch.object(cp, "run_cp_uow", side_effect=run_uow_in_thread) as run,
+        patch.object(
+            cp,
+            "ProcessPoolExecutor",
+            lambda jobs, mp_context: ThreadPoolExecutor(jobs),
+        ),
+    ):
+        cp.run_cp_parallel(uow_list, Path("out"), jobs=1, warm_start=False)
+
+    assert [uow_call.args[0][1].name for uow_call in run.call_args_list] == [
+        "large.csv",
+        "medium.csv",
+        "small.csv",
+        "empty.csv",
+    ]
+
+
+class BreakingExecutor(ThreadPoolExecutor):
+    """Thread pool that breaks like a process pool after some submits."""
+
+    def __init__(self, jobs: int, num_submits: int) -> None:
+        """Create the pool.
+
+        Args:
+            jobs: Number of threads
+            num_submits: Number of submits before the pool breaks
+
+        """
+        super().__init__(jobs)
+        self.num_submits = num_submits
+
+    def submit(self, *args: object, **kwargs: object):  # noqa: ANN201
+        """Submit a call, raising once the pool is broken.
+
+        Args:
+            *args: Function and its arguments
+            **kwargs: Keyword arguments of the function
+
+        Returns:
+            The future of the call.
+
+        """
+        if self.num_submits == 0:
+            raise BrokenProcessPool("a worker died")
+        self.num_submits -= 1
+        return super().submit(*args, **kwargs)
+
+
+def test_run_cp_parallel_broken_pool(
+    cp_core: MagicMock, cp: ModuleType, capsys: pytest.CaptureFixture
+):
+    """Test that the UOW items left in a broken pool are reported as failed.
+
+    Args:
+        cp_core: The cellprofiler_core stub
+        cp: The cp algorithm module
+        capsys: Pytest output capture
+
+    """
+    uow_list = [(Path("a.cppipe"), Path(f"{idx}.csv")) for idx in range(4)]
+    with (
+        patch.object(cp, "get_loaddata_cost", return_value=1),
+        patch.object(cp, "run_cp_uow", side_effect=run_uow_in_thread) as run,
+        patch.object(
+            cp,
+            "ProcessPoolExecutor",
+            lambda jobs, mp_context: BreakingExecutor(jobs, 2),
+        ),
+        pytest.raises(RuntimeError, match="2 of 4 UOW items failed"),
+    ):
+        cp.run_cp_parallel(uow_list, Path("out"), jobs=1, warm_start=False)
+
+    assert run.call_count == 2
+    cp_core.utilities.java.stop_java.assert_called_once()
+    out = capsys.readouterr().out
+    assert "Ran 2 UOW items" in out
+    assert out.count("BrokenProcessPool") == 2
+
+
+def run_first_image_set_in_thread(
+    uow: tuple[Path, Path], out_dir: Path, plugin_dir: Path | None
+) -> None:
+    """Run the first image set of a fake UOW item.
+
+    Args:
+        uow: Paths to the pipeline and load data files
+        out_dir: Output directory path
+        plugin_dir: Path to cellprofiler plugin directory
+
+    """
+    out_dir.mkdir(parents=True)
+
+
+def test_benchmark_cp_startup(cp_core: MagicMock, cp: ModuleType):
+    """Test that every cold and warm worker runs a first image set.
+
+    Args:
+        cp_core: The cellprofiler_core stub
+        cp: The cp algorithm module
+
+    """
+    uow_list = [(Path("a.cppipe"), Path(f"{idx}.csv")) for idx in range(2)]
+    with (
+        patch.object(cp, "get_cp_context") as get_cp_context,
+        patch.object(
+            cp,
+            "run_cp_first_image_set",
+            side_effect=run_first_image_set_in_thread,
+        ) as run,
+        patch.object(
+            cp,
+            "ProcessPoolExecutor",
+            lambda jobs, mp_context: ThreadPoolExecutor(jobs),
+        ),
+    ):
+        timings = cp.benchmark_cp_startup(uow_list, Path("plugins"), jobs=3)
+
+    assert list(timings) == ["cold", "warm"]
+    assert all(seconds >= 0 for seconds in timings.values())
+    assert get_cp_context.call_args_list == [call(False), call(True)]
+    # Jobs cycle through the UOW items, each with its own output directory
+    assert [uow_call.args[0] for uow_call in run.call_args_list] == [
+        uow_list[idx % 2] for idx in [0, 1, 2] * 2
+    ]
+    assert len({uow_call.args[1] for uow_call in run.call_args_list}) == 6
+    assert all(
+        uow_call.args[2] == Path("plugins") for uow_call in run.call_args_list
+    )
+    cp_core.utilities.java.start_java.assert_called_once()
+    cp_core.utilities.java.stop_java.assert_called_once()
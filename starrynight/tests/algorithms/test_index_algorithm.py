@@ -1,20 +1,42 @@
 """Test the index algorithm functionality."""
 
 from pathlib import Path
-from unittest.mock import MagicMock, patch
+from unittest.mock import MagicMock, call, patch
 
 import polars as pl
+import pyarrow.parquet as pq
 import pytest
 from lark import Lark
 
 from starrynight.algorithms.index import (
     IMG_FORMATS,
+    OutputIndex,
     PCPIndex,
     ast_to_pcp_index,
+    gen_output_index,
     gen_pcp_index,
+    update_pcp_index,
+    write_loaddata_output_index,
+    write_pcp_index,
+)
+from starrynight.algorithms.inventory import (
+    INVENTORY_ID_KEY,
+    FileInventory,
+    gen_inventory_cols,
+    write_inventory_delta,
+)
+from starrynight.parsers.common import BaseTransformer, ParserType, get_parser
+from starrynight.parsers.transformer_vincent import VincentAstToIR
+from starrynight.utils.dfutils import (
+    gen_index_summary,
+    read_index_summary,
+    scan_index,
+)
+
+FIXTURE_INDEX_PATH = (
+    Path(__file__).parents[1]
+    / "fixtures/integration/pregenerated_files/fix_s1/index.parquet"
 )
-from starrynight.algorithms.inventory import FileInventory
-from starrynight.parsers.common import BaseTransformer
 
 
 class MockTransformer(BaseTransformer):
@@ -187,11 +209,20 @@ def test_ast_to_pcp_index(mock_file_inventory, mock_parser):
     )
 
 
+@patch("starrynight.algorithms.index.replace_path")
+@patch("starrynight.algorithms.index.get_inventory_id", return_value="inv")
+@patch("starrynight.algorithms.index.write_index_summary")
 @patch("starrynight.algorithms.index.pl.read_parquet")
-@patch("starrynight.algorithms.index.write_pq")
+@patch("starrynight.algorithms.index.ParquetSink")
 @patch("starrynight.algorithms.index.tqdm")
 def test_gen_pcp_index(
-    mock_tqdm, mock_write_pq, mock_read_parquet, mock_parser
+    mock_tqdm,
+    mock_parquet_sink,
+    mock_read_parquet,
+    mock_write_index_summary,
+    mock_get_inventory_id,
+    mock_replace_path,
+    mock_parser,
 ):
     """Test gen_pcp_index function.
 
@@ -200,8 +231,11 @@ def test_gen_pcp_index(
 
     Args:
         mock_tqdm: Mock for progress bar
-        mock_write_pq: Mock for parquet writing function
+        mock_parquet_sink: Mock for parquet writer
         mock_read_parquet: Mock for parquet reading function
+        mock_write_index_summary: Mock for the index summary writer
+        mock_get_inventory_id: Mock for the inventory id reader
+        mock_replace_path: Mock for swapping the staged outputs in
         mock_parser: Mock for the path parser
 
     """
@@ -210,8 +244,6 @@ def test_gen_pcp_index(
         {"key": ["test.tiff"], "filename": ["test"], "extension": [".tiff"]}
     )
     mock_read_parquet.return_value = mock_df
-    # Configure tqdm to iterate through data without progress bar in tests
-    mock_tqdm.return_value = mock_df.iter_slices()
 
     # Run the function
     gen_pcp_index(
@@ -221,33 +253,51 @@ def test_gen_pcp_index(
         ast_tansformer=MockTransformer,
     )
 
-    # Verify core interactions
     # Verify core interactions occurred
     mock_read_parquet.assert_called_once(), "Should read inventory from parquet"
-    mock_write_pq.assert_called_once(), "Should write index to parquet"
-
-    # Verify output path is constructed correctly
-    args, _ = mock_write_pq.call_args
-    assert str(args[2]).endswith("/test/output/index.parquet"), (
-        "Output file should be named 'index.parquet' in specified directory"
+    sink = mock_parquet_sink.return_value
+    # One batch for the index and one for the errors
+    assert sink.write.call_count == 2, "Should write one batch per slice"
+    index_df = sink.write.call_args_list[0][0][0]
+    assert index_df["key"].to_list() == ["test.tiff"]
+
+    # Verify output paths are constructed correctly
+    staging_paths = [args[0] for args, _ in mock_parquet_sink.call_args_list]
+    assert mock_replace_path.call_args_list == [
+        call(staging_paths[0], Path("/test/output/index.parquet")),
+        call(staging_paths[1], Path("/test/output/index_errors.parquet")),
+    ], "Staged outputs should replace the files in the specified directory"
+    mock_write_index_summary.assert_called_once_with(
+        Path("/test/output/index.parquet"), "inv"
     )
 
+    # Progress is reported in rows
+    assert mock_tqdm.call_args.kwargs["total"] == len(mock_df)
+    mock_tqdm.return_value.update.assert_called_once_with(len(mock_df))
 
+
+@patch("starrynight.algorithms.index.get_inventory_id", return_value=None)
 @patch("starrynight.algorithms.index.ast_to_pcp_index")
 @patch("starrynight.algorithms.index.pl.read_parquet")
 def test_gen_pcp_index_error_handling(
-    mock_read_parquet, mock_ast_to_pcp_index, mock_parser
+    mock_read_parquet,
+    mock_ast_to_pcp_index,
+    mock_get_inventory_id,
+    mock_parser,
+    tmp_path,
 ):
     """Test error handling in gen_pcp_index function.
 
     Verifies that the function properly handles parsing errors for individual
-    files without failing the entire process. Checks that appropriate error
-    messages are logged when parsing fails.
+    files without failing the entire process. Checks that the failures are
+    written to the index errors table.
 
     Args:
         mock_read_parquet: Mock for parquet reading function
         mock_ast_to_pcp_index: Mock for index conversion function
+        mock_get_inventory_id: Mock for the inventory id reader
         mock_parser: Mock for the path parser
+        tmp_path: Pytest temporary directory
 
     """
     # Create mock data with good and bad records
@@ -269,28 +319,317 @@ def test_gen_pcp_index_error_handling(
 
     mock_ast_to_pcp_index.side_effect = side_effect
 
-    # Run with print mocked to verify error message
-    with patch("builtins.print") as mock_print:
-        with patch(
-            "starrynight.algorithms.index.tqdm",
-            return_value=mock_df.iter_slices(),
-        ):
-            with patch("starrynight.algorithms.index.write_pq"):
-                gen_pcp_index(
-                    inv_path=Path("/test/inventory.parquet"),
-                    out_path=Path("/test/output"),
-                    path_parser=mock_parser,
-                    ast_tansformer=MockTransformer,
-                )
-
-    # Verify error handling for bad record
-    assert mock_print.call_count > 0, (
-        "Error message should be printed for parsing failures"
+    gen_pcp_index(
+        inv_path=Path("/test/inventory.parquet"),
+        out_path=tmp_path,
+        path_parser=mock_parser,
+        ast_tansformer=MockTransformer,
     )
-    call_args = mock_print.call_args_list[0][0][0]
-    assert "Unable to parse" in call_args, (
-        "Error message should indicate parsing failure"
+
+    # Verify the good record is indexed and the bad one is reported
+    # (read_parquet is mocked)
+    index_df = pl.scan_parquet(tmp_path.joinpath("index.parquet")).collect()
+    assert index_df["key"].to_list() == ["good.tiff"]
+    errors_df = pl.scan_parquet(
+        tmp_path.joinpath("index_errors.parquet")
+    ).collect()
+    assert errors_df["key"].to_list() == ["bad.tiff"], (
+        "Parsing failures should be written to the errors table"
     )
-    assert "Test error" in call_args, (
+    assert "Test error" in errors_df["error"].item(), (
         "Original error message should be included"
     )
+
+
+@pytest.mark.parametrize("partition", [False, True])
+def test_gen_pcp_index_jobs(tmp_path: Path, partition: bool):
+    """Test that worker processes generate the same index as a single one.
+
+    Args:
+        tmp_path: Pytest temporary directory
+        partition: Whether to write a partitioned index
+
+    """
+    keys = pl.read_parquet(FIXTURE_INDEX_PATH)["key"].to_list()
+    keys.append("not/a/dataset/key.tiff")
+    inv_path = tmp_path.joinpath("inventory.parquet")
+    pl.DataFrame({"path": [f"/prefix/{key}" for key in keys]}).select(
+        gen_inventory_cols(pl.col("path"), "/prefix")
+    ).write_parquet(inv_path)
+
+    outputs = {}
+    for jobs in [1, 2]:
+        out_path = tmp_path.joinpath(f"jobs_{jobs}")
+        out_path.mkdir()
+        gen_pcp_index(
+            inv_path,
+            out_path,
+            get_parser(ParserType.OPS_VINCENT),
+            VincentAstToIR,
+            partition=partition,
+            jobs=jobs,
+            chunk_size=10,
+        )
+        outputs[jobs] = (
+            pl.read_parquet(out_path.joinpath("index.parquet")),
+            pl.read_parquet(out_path.joinpath("index_errors.parquet")),
+        )
+
+    index_df, errors_df = outputs[2]
+    assert index_df.equals(outputs[1][0])
+    assert len(index_df) == len(keys) - 1
+    assert errors_df.equals(outputs[1][1])
+    assert errors_df["key"].to_list() == ["not/a/dataset/key.tiff"]
+
+
+def write_inventory(
+    keys: list[str], inv_path: Path, inventory_id: str | None = None
+) -> None:
+    """Write an inventory of keys.
+
+    Args:
+        keys: Keys of the inventory
+        inv_path: Path to save the inventory
+        inventory_id: Id of the inventory
+
+    """
+    inv_df = pl.DataFrame({"path": [f"/prefix/{key}" for key in keys]}).select(
+        gen_inventory_cols(pl.col("path"), "/prefix")
+    )
+    metadata = {} if inventory_id is None else {INVENTORY_ID_KEY: inventory_id}
+    pq.write_table(
+        inv_df.to_arrow().replace_schema_metadata(metadata), inv_path
+    )
+
+
+@pytest.mark.parametrize("partition", [False, True])
+def test_gen_pcp_index_layout_change(tmp_path: Path, partition: bool):
+    """Test that an index is regenerated over an index of the other layout.
+
+    Args:
+        tmp_path: Pytest temporary directory
+        partition: Whether to write a partitioned index over a single file
+
+    """
+    keys = pl.read_parquet(FIXTURE_INDEX_PATH)["key"].to_list()
+    parser = get_parser(ParserType.OPS_VINCENT)
+    inv_path = tmp_path.joinpath("inventory.parquet")
+    write_inventory(keys, inv_path, "inv_0")
+    out_path = tmp_path.joinpath("index")
+    gen_pcp_index(inv_path, out_path, parser, VincentAstToIR, not partition)
+    gen_pcp_index(inv_path, out_path, parser, VincentAstToIR, partition)
+
+    index_path = out_path.joinpath("index.parquet")
+    assert index_path.is_dir() is partition
+    assert sorted(scan_index(index_path).collect()["key"]) == sorted(keys)
+
+
+@pytest.mark.parametrize("partition", [False, True])
+def test_gen_pcp_index_failure(tmp_path: Path, partition: bool):
+    """Test that a failed run leaves the previous index in place.
+
+    Args:
+        tmp_path: Pytest temporary directory
+        partition: Whether to write a partitioned index
+
+    """
+    keys = pl.read_parquet(FIXTURE_INDEX_PATH)["key"].to_list()
+    parser = get_parser(ParserType.OPS_VINCENT)
+    inv_path = tmp_path.joinpath("inventory.parquet")
+    write_inventory(keys[:20], inv_path, "inv_0")
+    out_path = tmp_path.joinpath("index")
+    gen_pcp_index(inv_path, out_path, parser, VincentAstToIR, partition)
+    index_path = out_path.joinpath("index.parquet")
+    summary = read_index_summary(index_path)
+
+    def write_some_rows(df: pl.DataFrame, *args: object) -> int:
+        """Write the first rows of the inventory and fail.
+
+        Args:
+            df: Inventory rows
+            args: Sinks and parser arguments
+
+        Raises:
+            RuntimeError: Always, after writing
+
+        """
+        write_pcp_index(df.head(5), *args)
+        raise RuntimeError("worker failed")
+
+    write_inventory(keys, inv_path, "inv_1")
+    with (
+        patch(
+            "starrynight.algorithms.index.write_pcp_index",
+            side_effect=write_some_rows,
+        ),
+        pytest.raises(RuntimeError, match="worker failed"),
+    ):
+        gen_pcp_index(inv_path, out_path, parser, VincentAstToIR, partition)
+
+    assert sorted(scan_index(index_path).collect()["key"]) == sorted(keys[:20])
+    assert read_index_summary(index_path) == summary
+    # Partial outputs are discarded
+    assert sorted(path.name for path in out_path.iterdir()) == [
+        "index.parquet",
+        "index_errors.parquet",
+        "index_summary.json",
+    ]
+
+
+@pytest.mark.parametrize("partition", [False, True])
+def test_update_pcp_index(tmp_path: Path, partition: bool):
+    """Test that updating an index with a delta matches a full index.
+
+    Args:
+        tmp_path: Pytest temporary directory
+        partition: Whether to write a partitioned index
+
+    """
+    keys = pl.read_parquet(FIXTURE_INDEX_PATH)["key"].to_list()
+    parser = get_parser(ParserType.OPS_VINCENT)
+    inv_path = tmp_path.joinpath("inventory.parquet")
+    write_inventory([*keys[:40], "bad/key.tiff"], inv_path, "inv_0")
+    out_path = tmp_path.joinpath("index")
+    gen_pcp_index(inv_path, out_path, parser, VincentAstToIR, partition)
+
+    new_keys = [*keys[10:], "new/bad/key.tiff"]
+    write_inventory(new_keys, inv_path, "inv_1")
+    delta_path = tmp_path.joinpath("inventory_delta.parquet")
+    delta = pl.DataFrame(
+        {
+            "key": [*keys[:10], "bad/key.tiff", *keys[40:], "new/bad/key.tiff"],
+            "change": ["removed"] * 11 + ["added"] * (len(keys) - 39),
+        }
+    )
+    write_inventory_delta(delta, delta_path, "inv_0", "inv_1")
+    update_pcp_index(inv_path, delta_path, out_path, parser, VincentAstToIR)
+
+    expected_path = tmp_path.joinpath("expected")
+    gen_pcp_index(inv_path, expected_path, parser, VincentAstToIR, partition)
+    for name in ["index.parquet", "index_errors.parquet"]:
+        df = pl.read_parquet(out_path.joinpath(name)).sort("key")
+        expected = pl.read_parquet(expected_path.joinpath(name)).sort("key")
+        assert df.equals(expected)
+        assert out_path.joinpath(name).is_dir() is (
+            partition and name == "index.parquet"
+        )
+    # Staging files are swapped in
+    assert sorted(path.name for path in out_path.iterdir()) == [
+        "index.parquet",
+        "index_errors.parquet",
+        "index_summary.json",
+    ]
+    # The summary is rewritten for the updated index
+    index_path = out_path.joinpath("index.parquet")
+    assert read_index_summary(index_path) == {
+        **gen_index_summary(scan_index(index_path)),
+        "inventory_id": "inv_1",
+    }
+
+
+@pytest.mark.parametrize(
+    ("base_inventory_id", "inventory_id"),
+    [("inv_0", "inv_1"), ("inv_1", "inv_2"), (None, "inv_2")],
+)
+def test_update_pcp_index_stale_delta(
+    tmp_path: Path, base_inventory_id: str | None, inventory_id: str
+):
+    """Test that a delta not leading from the index inventory is not applied.
+
+    Args:
+        tmp_path: Pytest temporary directory
+        base_inventory_id: Inventory the delta was computed against
+        inventory_id: Inventory the delta leads to
+
+    """
+    keys = pl.read_parquet(FIXTURE_INDEX_PATH)["key"].to_list()
+    parser = get_parser(ParserType.OPS_VINCENT)
+    inv_path = tmp_path.joinpath("inventory.parquet")
+    delta_path = tmp_path.joinpath("inventory_delta.parquet")
+    out_path = tmp_path.joinpath("index")
+    write_inventory(keys[:40], inv_path, "inv_0")
+    # Without an index, the first incremental run writes the given layout
+    write_inventory_delta(
+        pl.DataFrame({"key": keys[:40], "change": ["added"] * 40}),
+        delta_path,
+        None,
+        "inv_0",
+    )
+    update_pcp_index(
+        inv_path, delta_path, out_path, parser, VincentAstToIR, partition=True
+    )
+    index_path = out_path.joinpath("index.parquet")
+    assert index_path.is_dir()
+
+    # The delta removes keys that are still in the current inventory
+    write_inventory(keys[10:], inv_path, "inv_2")
+    write_inventory_delta(
+        pl.DataFrame({"key": keys[:10], "change": ["removed"] * 10}),
+        delta_path,
+        base_inventory_id,
+        inventory_id,
+    )
+    update_pcp_index(inv_path, delta_path, out_path, parser, VincentAstToIR)
+
+    index_df = pl.read_parquet(index_path)
+    assert sorted(index_df["key"].to_list()) == sorted(keys[10:])
+    assert index_path.is_dir()
+    assert read_index_summary(index_path)["inventory_id"] == "inv_2"
+
+
+def test_gen_output_index(tmp_path: Path):
+    """Test that output templates match OutputIndex rows of every site."""
+    loaddata_df = pl.DataFrame(
+        {
+            "Metadata_Batch": ["Batch1", "Batch1"],
+            "Metadata_Plate": ["Plate1", "Plate1"],
+            "Metadata_Well": ["A1", "B2"],
+            "Metadata_Site": [1, 12],
+        }
+    )
+    outputs = [
+        {
+            "key": "{batch_id}/Well_{well_id}_Site_{site_id}_A.tiff",
+            "filename": "Well_{well_id}_Site_{site_id}_A.tiff",
+            "cycle_id": "2",
+            "channel_id": "A",
+            "extension": "tiff",
+            "file_type": "compensated_image",
+        },
+        {
+            "key": "Image.csv",
+            "filename": "Image.csv",
+            "extension": "csv",
+            "file_type": "measurements",
+        },
+    ]
+    expected = [
+        OutputIndex(
+            prefix="/out",
+            batch_id="Batch1",
+            plate_id="Plate1",
+            well_id=well_id,
+            site_id=site_id,
+            **{
+                **output,
+                "key": output["key"].format(
+                    batch_id="Batch1", well_id=well_id, site_id=site_id
+                ),
+                "filename": output["filename"].format(
+                    well_id=well_id, site_id=site_id
+                ),
+            },
+            channel_dict=[output["channel_id"]]
+            if "channel_id" in output
+            else None,
+        ).model_dump()
+        for well_id, site_id in [("A1", "1"), ("B2", "12")]
+        for output in outputs
+    ]
+
+    index_df = gen_output_index(loaddata_df, outputs, "/out")
+    assert index_df.to_dicts() == expected
+
+    index_path = tmp_path / "index.parquet"
+    write_loaddata_output_index(loaddata_df, outputs, "/out", index_path)
+    assert pl.read_parquet(index_path).to_dicts() == expected
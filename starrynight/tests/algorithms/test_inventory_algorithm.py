@@ -0,0 +1,328 @@
+"""Test the inventory algorithm functionality."""
+
+import gzip
+import json
+from pathlib import Path
+from urllib.parse import quote_plus
+
+import polars as pl
+import pytest
+from cloudpathlib import S3Path
+from cloudpathlib.local import LocalS3Path
+
+from starrynight.algorithms.inventory import (
+    chunked,
+    create_inventory,
+    create_inventory_from_manifest,
+    gen_inventory_delta,
+    parse_prefix,
+    split_dataset_tree,
+)
+from starrynight.utils import globbing
+from starrynight.utils.globbing import list_dir, scan_file_stats, scan_files
+
+DATASET_FILES = [
+    "Source1/Batch1/images/Plate1/20X_c1_SBS-1/WellA1_PointA1_0000_ChannelC,A,T,G,DAPI_Seq0000.ome.tiff",
+    "Source1/Batch1/images/Plate1/20X_c1_SBS-1/WellA1_PointA1_0001_ChannelC,A,T,G,DAPI_Seq0001.ome.tiff",
+    "Source1/Batch1/images/Plate1/20X_CP_Plate1/WellA1_PointA1_0000_ChannelDAPI_Seq0000.ome.tiff",
+    "Source1/Batch1/images/Plate2/20X_CP_Plate2/WellB1_PointB1_0000_ChannelDAPI_Seq0000.ome.tiff",
+    "Source1/Batch2/images/Plate1/20X_CP_Plate1/WellA1_PointA1_0000_ChannelDAPI_Seq0000.ome.tiff",
+    "Source1/Batch2/metadata.csv",
+    "README.md",
+]
+
+
+@pytest.fixture
+def dataset_dir(tmp_path: Path) -> Path:
+    """Create a small dataset tree for testing.
+
+    Args:
+        tmp_path: Pytest temporary directory
+
+    Returns:
+        Path to the dataset directory.
+
+    """
+    dataset = tmp_path.joinpath("dataset")
+    for file in DATASET_FILES:
+        file_path = dataset.joinpath(file)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_text(file)
+    # Empty dirs should not end up in the inventory
+    dataset.joinpath("Source1/Batch3/images").mkdir(parents=True)
+    return dataset
+
+
+def test_scan_files(dataset_dir: Path):
+    """Test that scanning yields every file and no directories."""
+    files = sorted(
+        file.relative_to(dataset_dir).as_posix()
+        for file in scan_files(dataset_dir)
+    )
+    assert files == sorted(DATASET_FILES)
+
+
+@pytest.mark.parametrize("private_api", [True, False])
+def test_scan_cloud_files(monkeypatch: pytest.MonkeyPatch, private_api: bool):
+    """Test cloud listing with and without the private cloudpathlib API."""
+    if not private_api:
+        monkeypatch.setattr(
+            globbing, "CLOUDPATHLIB_PRIVATE_API_VERSIONS", ((0, 0), (0, 0))
+        )
+    dataset = LocalS3Path("s3://bucket/scan")
+    for file in DATASET_FILES:
+        dataset.joinpath(file).write_text(file)
+
+    files = sorted(
+        file.relative_to(dataset).as_posix() for file in scan_files(dataset)
+    )
+    assert files == sorted(DATASET_FILES)
+    assert sorted(
+        (child.name, is_dir) for child, is_dir in list_dir(dataset)
+    ) == [("README.md", False), ("Source1", True)]
+    assert sorted(
+        file.relative_to(dataset).as_posix()
+        for file, *_ in scan_file_stats(dataset)
+    ) == sorted(DATASET_FILES)
+
+
+def test_chunked():
+    """Test that chunks are bounded and keep every item in order."""
+    chunks = list(chunked(range(7), 3))
+    assert chunks == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_parse_prefix(tmp_path: Path):
+    """Test that the inventory columns match the pathlib ones."""
+    files = [
+        tmp_path.joinpath("dataset", name)
+        for name in ["a.ome.tiff", ".hidden", "file.", "a..b", "noext"]
+    ]
+    for file in files:
+        file.parent.mkdir(exist_ok=True)
+        file.write_text(file.name)
+    out_dir = tmp_path.joinpath("inv")
+    out_dir.mkdir()
+    parse_prefix(files, out_dir, str(tmp_path))
+
+    df = pl.read_parquet(next(out_dir.glob("*.parquet")))
+    assert df.select("key", "filename", "extension").rows() == [
+        (file.relative_to(tmp_path).as_posix(), file.name, file.suffix)
+        for file in files
+    ]
+
+
+def test_split_dataset_tree(dataset_dir: Path):
+    """Test that the tree is split without losing or duplicating files."""
+    subtrees, loose_files = split_dataset_tree(dataset_dir, min_parts=4)
+
+    # Expansion stops at the plate directories (max depth)
+    assert [
+        subtree.relative_to(dataset_dir).as_posix() for subtree in subtrees
+    ] == [
+        "Source1/Batch1/images/Plate1",
+        "Source1/Batch1/images/Plate2",
+        "Source1/Batch2/images/Plate1",
+    ]
+    files = [file for subtree in subtrees for file in scan_files(subtree)]
+    files += loose_files
+    assert sorted(
+        file.relative_to(dataset_dir).as_posix() for file in files
+    ) == sorted(DATASET_FILES)
+
+
+def test_create_inventory(dataset_dir: Path, tmp_path: Path):
+    """Test inventory creation with multiple jobs and small shards."""
+    out_dir = tmp_path.joinpath("inventory")
+    create_inventory(dataset_dir, out_dir, jobs=2, chunk_size=2)
+
+    df = pl.read_parquet(out_dir.joinpath("inventory.parquet"))
+    assert df.columns == [
+        "key",
+        "filename",
+        "extension",
+        "prefix",
+        "size",
+        "mtime",
+        "etag",
+    ]
+    assert sorted(df["key"].to_list()) == sorted(
+        f"dataset/{file}" for file in DATASET_FILES
+    )
+    assert df["prefix"].unique().to_list() == [str(tmp_path.resolve())]
+    row = df.filter(pl.col("key").eq("dataset/Source1/Batch2/metadata.csv"))
+    assert row["filename"].item() == "metadata.csv"
+    assert row["extension"].item() == ".csv"
+
+
+def test_create_inventory_incremental(dataset_dir: Path, tmp_path: Path):
+    """Test that an incremental refresh writes the delta of the dataset."""
+    out_dir = tmp_path.joinpath("inventory")
+    create_inventory(dataset_dir, out_dir, jobs=2)
+
+    dataset_dir.joinpath("README.md").write_text("A longer readme")
+    dataset_dir.joinpath("Source1/Batch2/metadata.csv").unlink()
+    new_file = dataset_dir.joinpath(
+        "Source1/Batch3/images/Plate1/20X_CP_Plate1/"
+        "WellA1_PointA1_0000_ChannelDAPI_Seq0000.ome.tiff"
+    )
+    new_file.parent.mkdir(parents=True)
+    new_file.write_text("new")
+
+    create_inventory(dataset_dir, out_dir, jobs=2, incremental=True)
+
+    delta = pl.read_parquet(out_dir.joinpath("inventory_delta.parquet"))
+    assert dict(zip(delta["key"], delta["change"])) == {
+        "dataset/README.md": "changed",
+        "dataset/Source1/Batch2/metadata.csv": "removed",
+        f"dataset/{new_file.relative_to(dataset_dir).as_posix()}": "added",
+    }
+    df = pl.read_parquet(out_dir.joinpath("inventory.parquet"))
+    assert len(df) == len(DATASET_FILES)
+    assert df["size"].null_count() == 0
+
+    # A full listing does not keep the delta of the previous inventory
+    create_inventory(dataset_dir, out_dir, jobs=2)
+    assert not out_dir.joinpath("inventory_delta.parquet").exists()
+    with pytest.raises(ValueError, match="incremental"):
+        create_inventory(dataset_dir, out_dir, subtrees=[dataset_dir])
+
+
+def test_gen_inventory_delta():
+    """Test that ETags are only compared when both inventories have one."""
+    prev_df = pl.LazyFrame(
+        {
+            "key": ["same", "loose", "listed", "resized", "removed"],
+            "size": [1, 1, 1, 1, 1],
+            "mtime": [1.0, 1.0, 1.0, 1.0, 1.0],
+            "etag": ["a", None, "a", None, None],
+        }
+    )
+    new_df = pl.LazyFrame(
+        {
+            "key": ["same", "loose", "listed", "resized", "added"],
+            "size": [1, 1, 1, 2, 1],
+            "mtime": [1.0, 1.0, 1.0, 1.0, 1.0],
+            "etag": ["b", "a", None, None, None],
+        }
+    )
+
+    delta = gen_inventory_delta(prev_df, new_df).collect()
+    assert dict(zip(delta["key"], delta["change"])) == {
+        "added": "added",
+        "removed": "removed",
+        "resized": "changed",
+        "same": "changed",
+    }
+
+
+def test_create_inventory_broken_symlink(dataset_dir: Path, tmp_path: Path):
+    """Test that broken symlinks are listed without stats."""
+    link = dataset_dir.joinpath("Source1/Batch2/link.csv")
+    link.symlink_to(dataset_dir.joinpath("missing.csv"))
+    # Loose files and subtree files are both statted
+    dataset_dir.joinpath("link.md").symlink_to(link)
+    out_dir = tmp_path.joinpath("inventory")
+    create_inventory(dataset_dir, out_dir, jobs=2)
+
+    df = pl.read_parquet(out_dir.joinpath("inventory.parquet"))
+    links = df.filter(pl.col("filename").is_in(["link.csv", "link.md"]))
+    assert len(links) == 2
+    assert links["size"].null_count() == 2
+
+    create_inventory(dataset_dir, out_dir, jobs=2, incremental=True)
+    delta = pl.read_parquet(out_dir.joinpath("inventory_delta.parquet"))
+    assert len(delta) == 0
+
+
+def test_create_inventory_incremental_subtrees(
+    dataset_dir: Path, tmp_path: Path
+):
+    """Test that only the given subtrees are listed again."""
+    out_dir = tmp_path.joinpath("inventory")
+    create_inventory(dataset_dir, out_dir, jobs=2)
+
+    plate_dir = dataset_dir.joinpath("Source1/Batch1/images/Plate2")
+    plate_dir.joinpath("20X_CP_Plate2/extra.tiff").write_text("extra")
+    # Changes outside of the subtrees are not picked up
+    dataset_dir.joinpath("README.md").unlink()
+
+    create_inventory(
+        dataset_dir, out_dir, jobs=2, incremental=True, subtrees=[plate_dir]
+    )
+
+    delta = pl.read_parquet(out_dir.joinpath("inventory_delta.parquet"))
+    assert delta.select("key", "change").rows() == [
+        (
+            "dataset/Source1/Batch1/images/Plate2/20X_CP_Plate2/extra.tiff",
+            "added",
+        )
+    ]
+    df = pl.read_parquet(out_dir.joinpath("inventory.parquet"))
+    assert len(df) == len(DATASET_FILES) + 1
+    assert "dataset/README.md" in df["key"].to_list()
+
+
+def test_create_inventory_from_manifest(tmp_path: Path):
+    """Test inventory creation from a local copy of an S3 Inventory report."""
+    report_dir = tmp_path.joinpath("report")
+    report_dir.joinpath("data").mkdir(parents=True)
+    # Keys with escaped ASCII and non-ASCII characters are decoded
+    files = [*DATASET_FILES, "Source1/Batch2/a b+c%41,é.csv"]
+    rows = [
+        f'"bucket","dataset/{quote_plus(file)}","12",'
+        '"2024-01-01T00:00:00.000Z","0123abcd"'
+        for file in files
+    ]
+    # Directory markers and objects outside of the dataset are dropped
+    rows.append('"bucket","dataset/Source1/","0","2024-01-01T00:00:00.000Z",""')
+    rows.append('"bucket","other/file.txt","1","2024-01-01T00:00:00.000Z",""')
+    report_dir.joinpath("data", "part-0.csv.gz").write_bytes(
+        gzip.compress("\n".join(rows).encode())
+    )
+    manifest_path = report_dir.joinpath("2024-01-01T00-00Z", "manifest.json")
+    manifest_path.parent.mkdir()
+    manifest_path.write_text(
+        json.dumps(
+            {
+                "sourceBucket": "bucket",
+                "destinationBucket": "arn:aws:s3:::inventory-bucket",
+                "fileFormat": "CSV",
+                "fileSchema": "Bucket, Key, Size, LastModifiedDate, ETag",
+                "files": [{"key": "report/data/part-0.csv.gz"}],
+            }
+        )
+    )
+
+    out_dir = tmp_path.joinpath("inventory")
+    create_inventory_from_manifest(
+        manifest_path, S3Path("s3://bucket/dataset"), out_dir
+    )
+
+    df = pl.read_parquet(out_dir.joinpath("inventory.parquet"))
+    assert sorted(df["key"].to_list()) == sorted(
+        f"dataset/{file}" for file in files
+    )
+    assert df["prefix"].unique().to_list() == ["s3://bucket"]
+    row = df.filter(pl.col("key").eq("dataset/Source1/Batch2/metadata.csv"))
+    assert row.select("filename", "extension", "size", "mtime", "etag").row(
+        0
+    ) == ("metadata.csv", ".csv", 12, 1704067200.0, "0123abcd")
+
+
+def test_create_inventory_from_listing(dataset_dir: Path, tmp_path: Path):
+    """Test that a listing matches the inventory from listing the dataset."""
+    out_dir = tmp_path.joinpath("inventory")
+    create_inventory(dataset_dir, out_dir)
+    listing_path = tmp_path.joinpath("listing.parquet")
+    pl.DataFrame(
+        {"key": [str(file.resolve()) for file in scan_files(dataset_dir)]}
+    ).write_parquet(listing_path)
+
+    manifest_out_dir = tmp_path.joinpath("manifest_inventory")
+    create_inventory_from_manifest(listing_path, dataset_dir, manifest_out_dir)
+
+    cols = ["key", "filename", "extension", "prefix"]
+    expected = pl.read_parquet(out_dir.joinpath("inventory.parquet"))
+    df = pl.read_parquet(manifest_out_dir.joinpath("inventory.parquet"))
+    assert df.select(cols).sort("key").equals(expected.select(cols).sort("key"))
@@ -0,0 +1,249 @@
+"""Test the LoadData commands of the CellProfiler stages on a fixture index."""
+
+import csv
+import importlib
+import importlib.util
+import shutil
+from pathlib import Path
+
+import polars as pl
+import pytest
+from click.testing import CliRunner
+
+FIXTURE_DIR = (
+    Path(__file__)
+    .parents[1]
+    .joinpath("fixtures/integration/pregenerated_files")
+)
+
+# LoadData files generated from the fix_s1 index
+LOADDATA_FIXTURE_DIR = (
+    Path(__file__).parents[1].joinpath("fixtures/loaddata/fix_s1")
+)
+
+
+def read_loaddata(out_dir: Path) -> dict[str, list[dict]]:
+    """Read the LoadData files of a directory.
+
+    Args:
+        out_dir: LoadData directory
+
+    Returns:
+        Rows of every LoadData file, by path relative to the directory.
+
+    """
+    loaddata = {}
+    for path in sorted(out_dir.rglob("*.csv")):
+        with path.open() as f:
+            loaddata[path.relative_to(out_dir).as_posix()] = list(
+                csv.DictReader(f)
+            )
+    return loaddata
+
+
+@pytest.fixture(params=["fix_s1", "fix_s2"])
+def index_path(request: pytest.FixtureRequest, tmp_path: Path) -> Path:
+    """Copy a fixture index to the temporary directory.
+
+    Args:
+        request: Pytest request of the fixture name
+        tmp_path: Pytest temporary directory
+
+    Returns:
+        Path to the index.
+
+    """
+    index_path = tmp_path.joinpath("index", "index.parquet")
+    index_path.parent.mkdir()
+    shutil.copy(
+        FIXTURE_DIR.joinpath(request.param, "index.parquet"), index_path
+    )
+    return index_path
+
+
+@pytest.mark.usefixtures("cellprofiler_stub")
+def test_align_loaddata_cli(index_path: Path, tmp_path: Path):
+    """Test that align LoadData is written for every batch and plate.
+
+    Args:
+        index_path: Path to the fixture index
+        tmp_path: Pytest temporary directory
+
+    """
+    from starrynight.cli.align import align
+
+    out_dir = tmp_path.joinpath("align")
+    # Worker processes would import CellProfiler without the stub
+    result = CliRunner().invoke(
+        align,
+        [
+            "loaddata",
+            *["-i", str(index_path), "-o", str(out_dir)],
+            *["-c", "/corr/imgs", "-n", "DAPI", "-j", "1"],
+        ],
+    )
+    assert result.exit_code == 0, result.output
+
+    images = pl.read_parquet(index_path).filter(
+        pl.col("is_sbs_image"), pl.col("is_image")
+    )
+    loaddata = read_loaddata(out_dir)
+    assert list(loaddata) == ["Batch1/Plate1/align_Batch1_Plate1.csv"]
+    rows = loaddata["Batch1/Plate1/align_Batch1_Plate1.csv"]
+    assert len(rows) == images.select("well_id", "site_id").n_unique()
+    assert rows[0]["PathName_Corr_Cycle_1_DAPI"] == "/corr/imgs"
+
+
+@pytest.mark.usefixtures("cellprofiler_stub")
+@pytest.mark.parametrize("sbs", [False, True])
+def test_presegcheck_loaddata_cli(index_path: Path, tmp_path: Path, sbs: bool):
+    """Test that pre-segcheck LoadData is written for the sampled images.
+
+    Args:
+        index_path: Path to the fixture index
+        tmp_path: Pytest temporary directory
+        sbs: Write the LoadData of the SBS images
+
+    """
+    from starrynight.cli.presegcheck import presegcheck
+
+    out_dir = tmp_path.joinpath("presegcheck")
+    # Worker processes would import CellProfiler without the stub
+    result = CliRunner().invoke(
+        presegcheck,
+        [
+            "loaddata",
+            *["-i", str(index_path), "-o", str(out_dir)],
+            *["-c", "/corr/imgs", "-j", "1"],
+            *(["--sbs"] if sbs else []),
+        ],
+    )
+    assert result.exit_code == 0, result.output
+
+    loaddata = read_loaddata(out_dir)
+    assert loaddata
+    for path, rows in loaddata.items():
+        if sbs:
+            assert path.startswith("Batch1/Plate1/pre_segcheck_Batch1_Plate1_0")
+        else:
+            assert path == "Batch1/pre_segcheck_Batch1_Plate1.csv"
+        assert rows
+        assert all(row["PathName_CorrDAPI"] == "/corr/imgs" for row in rows)
+
+
+def get_mtimes(out_dirs: list[Path]) -> dict[Path, int]:
+    """Get the modification times of the files of directories.
+
+    Args:
+        out_dirs: Directories to list
+
+    Returns:
+        Modification time in nanoseconds, by file path.
+
+    """
+    return {
+        path: path.stat().st_mtime_ns
+        for out_dir in out_dirs
+        for path in out_dir.rglob("*")
+        if path.is_file()
+    }
+
+
+@pytest.mark.usefixtures("cellprofiler_stub")
+@pytest.mark.parametrize(
+    ("stage", "args", "index_dir"),
+    [
+        ("illum", ["apply", "loaddata"], "cp_illum_apply"),
+        pytest.param(
+            "preprocess",
+            ["loaddata", "-n", "DAPI"],
+            "sbs_preprocess",
+            # The preprocess plugins import scipy
+            marks=pytest.mark.skipif(
+                importlib.util.find_spec("scipy") is None,
+                reason="scipy is not installed",
+            ),
+        ),
+    ],
+)
+def test_loaddata_cli_rerun(
+    index_path: Path,
+    tmp_path: Path,
+    stage: str,
+    args: list[str],
+    index_dir: str,
+):
+    """Test that re-running a stage keeps its LoadData and output indexes.
+
+    Args:
+        index_path: Path to the fixture index
+        tmp_path: Pytest temporary directory
+        stage: Name of the CLI module of the stage
+        args: Arguments of the LoadData command
+        index_dir: Output index directory of the stage, next to the index
+
+    """
+    cli = getattr(importlib.import_module(f"starrynight.cli.{stage}"), stage)
+    out_dir = tmp_path.joinpath(stage)
+    out_dirs = [out_dir, index_path.parent.joinpath(index_dir)]
+    mtimes = []
+    for _ in range(2):
+        result = CliRunner().invoke(
+            cli,
+            [*args, "-i", str(index_path), "-o", str(out_dir), "-j", "1"],
+        )
+        assert result.exit_code == 0, result.output
+        mtimes.append(get_mtimes(out_dirs))
+
+    assert any(path.suffix == ".csv" for path in mtimes[0])
+    assert any(path.suffix == ".parquet" for path in mtimes[0])
+    assert mtimes[1] == mtimes[0]
+
+
+@pytest.mark.usefixtures("cellprofiler_stub")
+@pytest.mark.parametrize("index_path", ["fix_s1"], indirect=True)
+@pytest.mark.parametrize(
+    ("stage", "args", "csv_path"),
+    [
+        (
+            "illum",
+            ["apply", "loaddata", "--sbs", "-n", "DAPI", "--illum", "/illum"],
+            "illum_apply_sbs/Batch1^Plate1^A1^0000#illum_apply_sbs.csv",
+        ),
+        (
+            "align",
+            ["loaddata", "-c", "/corr/imgs", "-n", "DAPI"],
+            "align/Batch1/Plate1/align_Batch1_Plate1.csv",
+        ),
+    ],
+)
+def test_loaddata_cli_fixture(
+    index_path: Path,
+    tmp_path: Path,
+    stage: str,
+    args: list[str],
+    csv_path: str,
+):
+    """Test that LoadData files match the fixtures byte for byte.
+
+    Cycles are ordered numerically, while the index lists them as 2, 3, 1.
+
+    Args:
+        index_path: Path to the fixture index
+        tmp_path: Pytest temporary directory
+        stage: Name of the CLI module of the stage
+        args: Arguments of the LoadData command
+        csv_path: LoadData file, relative to the fixture directory
+
+    """
+    cli = getattr(importlib.import_module(f"starrynight.cli.{stage}"), stage)
+    out_dir = tmp_path.joinpath(csv_path.split("/")[0])
+    result = CliRunner().invoke(
+        cli, [*args, "-i", str(index_path), "-o", str(out_dir), "-j", "1"]
+    )
+    assert result.exit_code == 0, result.output
+
+    assert (
+        tmp_path.joinpath(csv_path).read_bytes()
+        == LOADDATA_FIXTURE_DIR.joinpath(csv_path).read_bytes()
+    )
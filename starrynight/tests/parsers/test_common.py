@@ -0,0 +1,59 @@
+"""Test the common parser modules."""
+
+import pytest
+from lark import Lark, UnexpectedInput
+
+from starrynight.parsers.common import (
+    DirectoryCachedParser,
+    ParserType,
+    get_parser,
+)
+
+KEYS = [
+    "cpg0999-broad-asma/broad/BATCH1/images/plate1/10X_c11_SBS-11/WellB3_PointB3_0099_Channel405 nm,477 nm,G,T,A,C_Seq2069.tiff",
+    "cpg0999-broad-asma/broad/BATCH1/images/plate1/10X_c11_SBS-11/WellB3_PointB3_0100_Channel405 nm,477 nm,G,T,A,C_Seq2070.tiff",
+    "cpg0999-broad-asma/broad/BATCH1/images/plate1/10X_c11_SBS-11/metadata.csv",
+    "/ds/src/Batch1/images/Plate1/10X_CP_Plate1/WellB2_PointB2_0001_ChannelDAPI_Seq0001.ome.tiff",
+    "ds/src/Batch1/illum/Plate1/Plate1_IllumDAPI.npy",
+    "ds/src/Batch1/images/Plate1/10X_c1_SBS-1",
+]
+
+INVALID_KEYS = [
+    "cpg0999-broad-asma/broad/BATCH1/images/plate1/10X_c11_SBS-11/Well",
+    "invalid/path/format",
+    "noslash",
+]
+
+
+@pytest.fixture
+def parser() -> Lark:
+    """Create and return a Vincent parser instance."""
+    return get_parser(ParserType.OPS_VINCENT)
+
+
+def test_directory_cached_parser(parser: Lark):
+    """Test that cached directory parses give the same trees."""
+    cached_parser = DirectoryCachedParser(parser, maxsize=2)
+
+    for key in KEYS:
+        assert cached_parser.parse(key) == parser.parse(key)
+    for key in INVALID_KEYS:
+        with pytest.raises(UnexpectedInput):
+            cached_parser.parse(key)
+
+    # The first three keys share their directory
+    assert cached_parser.prefix_state.cache_info().hits == 2
+    assert cached_parser.prefix_state.cache_info().currsize == 2
+
+
+def test_directory_cached_parser_grammar():
+    """Test that grammars with tokens across directories are rejected."""
+    parser = Lark(
+        r"""
+        start: PART+
+        PART: /[a-z\/]+/
+        """,
+        parser="lalr",
+    )
+    with pytest.raises(ValueError, match="PART"):
+        DirectoryCachedParser(parser)
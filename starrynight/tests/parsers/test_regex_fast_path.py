@@ -0,0 +1,102 @@
+"""Test the regex fast path of the Vincent path parser."""
+
+from pathlib import Path
+
+import polars as pl
+import pytest
+from lark import Lark
+
+from starrynight.algorithms.index import ast_to_pcp_index, fast_path_pcp_index
+from starrynight.algorithms.inventory import FileInventory, gen_inventory_cols
+from starrynight.parsers.common import ParserType, get_parser
+from starrynight.parsers.regex_fast_path import RegexFastPath
+from starrynight.parsers.transformer_vincent import VincentAstToIR
+
+FIXTURE_INDEX_PATH = (
+    Path(__file__).parents[1]
+    / "fixtures/integration/pregenerated_files/fix_s1/index.parquet"
+)
+
+KEYS = [
+    # SBS images
+    "cpg0999-broad-asma/broad/BATCH1/images/plate1/10X_c11_SBS-11/WellB3_PointB3_0099_Channel405 nm,477 nm,G,T,A,C_Seq2069.tiff",
+    "ds/src/Batch1/images/Plate1/10X_c1_SBS-1_2024_01_01/WellA1_PointA1_0000_ChannelCy3 nm,DAPI-x nm_Seq0000.ome.tiff",
+    "/ds/src/Batch1/images/Plate1/10X_c12_SBS-12/WellA1_PointA1_0000_ChannelC_Seq0000.tiff",
+    "my-ds,x/src/Batch 1/images/Plate1/10X_c1_SBS-1/WellA1_PointA1_0000_ChannelC,A_Seq0000.tiff",
+    # CP images
+    "ds/src/Batch1/images/Plate1/10X_CP_Plate1/WellB2_PointB2_0001_ChannelPhalloAF750,ZO1-AF488,DAPI_Seq0001.ome.tiff",
+    "ds/src/Batch1/images/Plate1/10X_CP_Plate1/WellB2_PointB2_0001_ChannelDAPI_Seq0001.csv",
+    # Keywords in unexpected places are left to Lark
+    "ds/src/Batch1/images/Plate1/10X_CP_PlateWell1/WellB2_PointB2_0001_ChannelDAPI_Seq0001.tiff",
+    "ds/illumsrc/Batch1/images/Plate1/10X_CP_Plate1/WellB2_PointB2_0001_ChannelDAPI_Seq0001.tiff",
+    # Not images
+    "ds/src/Batch1/images/Plate1/10X_CP_Plate1/metadata.csv",
+    "ds/src/Batch1/illum/Plate1/Plate1_IllumDAPI.npy",
+    "ds/src/Batch1/images/Plate1/10X_c1_SBS-1",
+    # Invalid
+    "ds/src/Batch1/images/Plate1/10X_c1_SBS-1/WellA1_PointA1_0000_ChannelC-_Seq0000.tiff",
+    "ds/src/Batch1/images/Plate1/10X_c1_SBS-1/WellA1_PointA1_0000_Channel_Seq0000.tiff",
+    "ds/src/Batch1/images/Plate1/10X_c1_SBS-1/WellA1_PointA1_0000_ChannelC_Seq00001.tiff",
+]
+
+
+@pytest.fixture
+def parser() -> Lark:
+    """Create and return a Vincent parser instance."""
+    return get_parser(ParserType.OPS_VINCENT)
+
+
+def lark_pcp_index(inv_df: pl.DataFrame, parser: Lark) -> dict[int, dict]:
+    """Create the PCPIndex rows of an inventory with Lark."""
+    rows = {}
+    for row in inv_df.to_dicts():
+        row_idx = row.pop("row_idx")
+        try:
+            rows[row_idx] = ast_to_pcp_index(
+                FileInventory(**row), parser, VincentAstToIR
+            ).model_dump()
+        except Exception:
+            pass
+    return rows
+
+
+@pytest.mark.parametrize("source", ["fixture", "keys"])
+def test_fast_path_pcp_index(parser: Lark, source: str):
+    """Test that the fast path creates the same rows as Lark."""
+    if source == "fixture":
+        keys = pl.read_parquet(FIXTURE_INDEX_PATH)["key"].to_list()
+    else:
+        keys = KEYS
+    inv_df = (
+        pl.DataFrame({"path": [f"/prefix/{key.lstrip('/')}" for key in keys]})
+        .select(gen_inventory_cols(pl.col("path"), "/prefix"))
+        .with_row_index("row_idx")
+    )
+
+    index_df, rest_df = fast_path_pcp_index(
+        inv_df, RegexFastPath(parser, VincentAstToIR)
+    )
+
+    expected = lark_pcp_index(inv_df, parser)
+    rows = {row.pop("row_idx"): row for row in index_df.to_dicts()}
+    assert rows == {row_idx: expected[row_idx] for row_idx in rows}
+    assert sorted([*rows, *rest_df["row_idx"]]) == list(range(len(keys)))
+    # Images are only left to Lark for keywords outside of their rule
+    images = {row_idx for row_idx, row in expected.items() if row["is_image"]}
+    assert images - set(rows) <= ({6, 7} if source == "keys" else set())
+
+
+def test_fast_path_keyword_guard(parser: Lark):
+    """Test that keys with keywords outside of their rule are not matched."""
+    fast_path = RegexFastPath(parser, VincentAstToIR)
+    keys = pl.Series(KEYS[4:8])
+
+    parsed_df, mask = fast_path.parse(keys)
+
+    assert parsed_df["row_idx"].to_list() == [0, 1]
+    assert mask.to_list() == [False, False, True, True]
+    assert parsed_df["channel_dict"].to_list()[0] == [
+        "PhalloAF750",
+        "ZO1AF488",
+        "DAPI",
+    ]
@@ -0,0 +1 @@
+"""Tests for starrynight utils."""
@@ -0,0 +1,220 @@
+"""Test the dataframe utilities."""
+
+import json
+import shutil
+from pathlib import Path
+
+import polars as pl
+import pytest
+
+from starrynight.utils.dfutils import (
+    INDEX_CACHE,
+    IndexCache,
+    IndexHierarchy,
+    filter_df_by_hierarchy,
+    filter_images,
+    gen_image_hierarchy,
+    gen_index_summary,
+    get_channels_from_df,
+    get_cycles_from_df,
+    get_default_path_prefix,
+    get_index_summary_path,
+    load_images,
+    load_index,
+    read_index_summary,
+    scan_index,
+    write_index_summary,
+)
+from starrynight.utils.globbing import flatten_all
+from starrynight.utils.loaddata import write_loaddata_levels
+
+FIXTURE_INDEX_PATH = (
+    Path(__file__)
+    .parents[1]
+    .joinpath("fixtures/integration/pregenerated_files/fix_s1/index.parquet")
+)
+
+
+def sort_hierarchy(hierarchy: dict | list) -> dict | list:
+    """Sort the levels of a nested hierarchy.
+
+    Args:
+        hierarchy: Nested hierarchy
+
+    Returns:
+        Hierarchy with sorted levels.
+
+    """
+    if isinstance(hierarchy, list):
+        return sorted(hierarchy)
+    return {k: sort_hierarchy(hierarchy[k]) for k in sorted(hierarchy)}
+
+
+def test_gen_image_hierarchy():
+    """Test that levels are nested in order of first occurrence."""
+    df = pl.LazyFrame(
+        {
+            "batch_id": ["B2", "B1", "B1", "B2", "B1", None],
+            "plate_id": ["P1", "P2", "P1", None, "P2", "P3"],
+            "well_id": ["A1", "A2", None, "A1", "A1", "A1"],
+        }
+    )
+
+    assert gen_image_hierarchy(df, ["batch_id", "plate_id", "well_id"]) == {
+        "B2": {"P1": ["A1"]},
+        "B1": {"P2": ["A2", "A1"], "P1": []},
+    }
+    assert gen_image_hierarchy(df, ["plate_id", "batch_id"]) == {
+        "P1": ["B2", "B1"],
+        "P2": ["B1"],
+        "P3": [],
+    }
+    assert gen_image_hierarchy(df, ["batch_id"]) == ["B2", "B1"]
+    assert gen_image_hierarchy(df, []) == []
+
+
+@pytest.mark.parametrize("for_sbs", [False, True])
+def test_index_hierarchy(for_sbs: bool):
+    """Test that hierarchy lookups match the LazyFrame queries."""
+    images_df = filter_images(scan_index(FIXTURE_INDEX_PATH), for_sbs)
+    levels = ["batch_id", "plate_id", "well_id", "site_id"]
+    hierarchy = IndexHierarchy(images_df, levels)
+
+    assert hierarchy.to_dict() == sort_hierarchy(
+        gen_image_hierarchy(images_df, levels)
+    )
+    paths = hierarchy.paths()
+    assert paths == sorted(flatten_all(gen_image_hierarchy(images_df, levels)))
+    for path in [*paths, paths[0][:2]]:
+        level_df = filter_df_by_hierarchy(images_df, path, False)
+        assert hierarchy.get_df(path).equals(level_df.collect())
+        assert hierarchy.get_channels(path) == get_channels_from_df(level_df)
+        assert sorted(hierarchy.get_cycles(path)) == sorted(
+            get_cycles_from_df(level_df)
+        )
+        assert (
+            hierarchy.get_filenames(path)
+            == level_df.collect()["filename"].to_list()
+        )
+    assert hierarchy.get_df().equals(images_df.collect())
+    assert hierarchy.get_df(["Batch1", "Plate2"]).is_empty()
+
+
+def test_index_hierarchy_nulls():
+    """Test that rows with unset levels are left out of their nodes."""
+    df = pl.DataFrame(
+        {
+            "batch_id": ["B1", "B1", "B1", None],
+            "plate_id": ["P2", None, "P1", "P1"],
+            "filename": ["a", "b", "c", "d"],
+        }
+    )
+    hierarchy = IndexHierarchy(df, ["batch_id", "plate_id"])
+
+    assert hierarchy.to_dict() == {"B1": ["P1", "P2"]}
+    assert hierarchy.get_filenames(["B1"]) == ["a", "b", "c"]
+    assert hierarchy.get_filenames(["B1", "P2"]) == ["a"]
+
+
+def test_write_loaddata_levels():
+    """Test that every unit of work is written once with its images."""
+    images_df = filter_images(scan_index(FIXTURE_INDEX_PATH), False)
+    levels = ["batch_id", "plate_id", "well_id"]
+    hierarchy = IndexHierarchy(images_df, levels)
+    written = {}
+
+    def write_level(
+        level: list[str], level_df: pl.LazyFrame, suffix: str
+    ) -> None:
+        written[f"{'^'.join(level)}#{suffix}"] = level_df.collect()
+
+    assert (
+        write_loaddata_levels(images_df, levels, write_level, suffix="x")
+        == hierarchy.paths()
+    )
+    assert list(written) == [f"{'^'.join(p)}#x" for p in hierarchy.paths()]
+    for path in hierarchy.paths():
+        assert written[f"{'^'.join(path)}#x"].equals(hierarchy.get_df(path))
+
+    with pytest.raises(ValueError, match="do not match"):
+        write_loaddata_levels(hierarchy, levels[:2], write_level, suffix="x")
+
+
+def test_index_summary(tmp_path: Path):
+    """Test that the summary matches queries of the index."""
+    index_path = tmp_path.joinpath("index.parquet")
+    shutil.copy(FIXTURE_INDEX_PATH, index_path)
+    df = scan_index(index_path)
+    assert read_index_summary(index_path) is None
+
+    summary = write_index_summary(index_path)
+    assert get_index_summary_path(index_path).name == "index_summary.json"
+    assert read_index_summary(index_path) == summary
+    assert summary["num_rows"] == df.select(pl.len()).collect().item()
+    assert summary["dataset_ids"] == ["fix-s1-input"]
+    for name, for_sbs in [("cp", False), ("sbs", True)]:
+        images_df = filter_images(df, for_sbs)
+        assert summary[name]["channels"] == get_channels_from_df(images_df)
+        assert summary[name]["n_cycles"] == len(get_cycles_from_df(images_df))
+        assert summary[name]["im_per_well"] == [4]
+        assert summary[name]["prefixes"] == [get_default_path_prefix(images_df)]
+    num_images = sum(group["num_images"] for group in summary["groups"])
+    assert num_images == filter_images(df).collect().height + (
+        filter_images(df, True).collect().height
+    )
+
+    # The prefix is read from the summary
+    summary["sbs"]["prefixes"] = ["/summary"]
+    get_index_summary_path(index_path).write_text(json.dumps(summary))
+    assert get_default_path_prefix(df, index_path, True) == "/summary"
+
+    # Summaries of other rows are ignored
+    df.head(10).collect().write_parquet(index_path)
+    assert read_index_summary(index_path) is None
+    df = scan_index(index_path)
+    assert get_default_path_prefix(df, index_path, True) != "/summary"
+
+
+def test_index_cache(tmp_path: Path):
+    """Test that frames are shared until the index is rewritten."""
+    index_path = tmp_path.joinpath("index.parquet")
+    shutil.copy(FIXTURE_INDEX_PATH, index_path)
+    cache = IndexCache(maxsize=2)
+
+    def load() -> pl.DataFrame:
+        return scan_index(index_path).collect()
+
+    df = cache.get(index_path, "index", load)
+    assert df.equals(load())
+    assert cache.get(index_path, "index", load) is df
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # A rewritten index is read again, and its previous frame dropped
+    df.head(10).write_parquet(index_path)
+    assert cache.get(index_path, "index", load).height == 10
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert len(cache._frames) == 1
+
+    # The least recently used frames are evicted
+    cache.get(index_path, "a", load)
+    cache.get(index_path, "index", load)
+    cache.get(index_path, "b", load)
+    assert [key[1] for key in cache._frames] == ["index", "b"]
+    cache.max_bytes = load().head(1).estimated_size()
+    cache.get(index_path, "c", lambda: load().head(1))
+    assert [key[1] for key in cache._frames] == ["c"]
+    # Frames over the budget are not kept
+    cache.get(index_path, "d", load)
+    assert [key[1] for key in cache._frames] == ["c"]
+
+
+def test_load_images():
+    """Test that the shared images match the filtered index."""
+    INDEX_CACHE.clear()
+    df = scan_index(FIXTURE_INDEX_PATH)
+    assert load_index(FIXTURE_INDEX_PATH).equals(df.collect())
+    for for_sbs in [False, True]:
+        images_df = load_images(FIXTURE_INDEX_PATH, for_sbs)
+        assert images_df.equals(filter_images(df, for_sbs).collect())
+        assert load_images(FIXTURE_INDEX_PATH, for_sbs) is images_df
+    INDEX_CACHE.clear()
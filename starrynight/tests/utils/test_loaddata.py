@@ -0,0 +1,244 @@
+"""Test the shared LoadData generation."""
+
+import csv
+import io
+from pathlib import Path
+
+import polars as pl
+import pytest
+from cloudpathlib import CloudPath
+from cloudpathlib.local import LocalS3Path
+
+from starrynight.utils import loaddata
+from starrynight.utils.dfutils import IndexHierarchy, filter_images, scan_index
+from starrynight.utils.loaddata import (
+    frame_index_expr,
+    get_loaddata_cost,
+    key_dir_expr,
+    lookup_index_files,
+    validate_loaddata,
+    well_value_expr,
+    write_loaddata_csv,
+    write_loaddata_levels,
+)
+
+FIXTURE_INDEX_PATH = (
+    Path(__file__)
+    .parents[1]
+    .joinpath("fixtures/integration/pregenerated_files/fix_s1/index.parquet")
+)
+
+IMAGES = pl.DataFrame(
+    {
+        "key": ["src/Batch1/images/a.tiff", "b.tiff", "src/x,y/c.tiff"],
+        "well_id": ["WellA1", "B2", None],
+        "site_id": ["0001", "", 'quote"d'],
+        "channel_dict": [["DAPI", "CY3"], ["CY3", "DAPI"], ["CY3", "A"]],
+    }
+)
+
+
+def test_write_loaddata_csv():
+    """Test that the rows match the output of csv.writer."""
+    heads = ["Metadata_Well", "Metadata_Site", "Frame_OrigCY3", "PathName"]
+    values = [
+        well_value_expr(),
+        pl.col("site_id"),
+        frame_index_expr(["CY3"]),
+        key_dir_expr("/mnt/data/"),
+    ]
+    expected = io.StringIO()
+    loaddata_writer = csv.writer(expected)
+    loaddata_writer.writerow(heads)
+    loaddata_writer.writerows(
+        [
+            ["A1", "0001", "1", "/mnt/data/src/Batch1/images/"],
+            ["B2", "", "0", "/mnt/data//"],
+            [None, 'quote"d', "0", "/mnt/data/src/x,y/"],
+        ]
+    )
+
+    f = io.StringIO()
+    write_loaddata_csv(IMAGES.lazy(), heads, values, f)
+    assert f.getvalue() == expected.getvalue()
+
+    f = io.StringIO()
+    write_loaddata_csv(IMAGES.head(0), heads, values, f)
+    assert (
+        f.getvalue() == "Metadata_Well,Metadata_Site,Frame_OrigCY3,PathName\r\n"
+    )
+
+
+def test_write_loaddata_csv_missing_frame():
+    """Test that images without a LoadData channel are rejected."""
+    with pytest.raises(ValueError, match="Frame_OrigDNA"):
+        write_loaddata_csv(
+            IMAGES,
+            ["Frame_OrigDNA"],
+            [frame_index_expr(["DAPI"])],
+            io.StringIO(),
+        )
+    with pytest.raises(ValueError, match="2 LoadData columns"):
+        write_loaddata_csv(
+            IMAGES,
+            ["Frame_OrigDNA", "Site"],
+            [pl.col("site_id")],
+            io.StringIO(),
+        )
+
+
+def test_frame_index_expr():
+    """Test that the first of the mapped channels gives the frame."""
+    frames = IMAGES.select(frame_index_expr(["A", "DAPI"])).to_series()
+    assert frames.to_list() == [0, 1, 1]
+
+
+def write_level_parquet(
+    level: list[str], level_df: pl.LazyFrame, out_path: Path | CloudPath
+) -> None:
+    """Write the images of a unit of work.
+
+    Args:
+        level: Level values of the unit of work
+        level_df: Images of the unit of work
+        out_path: Output directory
+
+    """
+    with out_path.joinpath(f"{'^'.join(level)}.parquet").open("wb") as f:
+        level_df.collect().write_parquet(f)
+
+
+@pytest.mark.parametrize(("jobs", "cloud"), [(1, False), (3, False), (3, True)])
+def test_write_loaddata_levels_jobs(tmp_path: Path, jobs: int, cloud: bool):
+    """Test that parallel jobs write every unit of work."""
+    images_df = filter_images(scan_index(FIXTURE_INDEX_PATH), True)
+    levels = ["batch_id", "plate_id", "well_id"]
+    hierarchy = IndexHierarchy(images_df, levels)
+    out_path = LocalS3Path("s3://bucket/loaddata") if cloud else tmp_path
+    out_path.mkdir(parents=True, exist_ok=True)
+
+    written = write_loaddata_levels(
+        images_df, levels, write_level_parquet, jobs=jobs, out_path=out_path
+    )
+    assert written == hierarchy.paths()
+    assert len(list(out_path.iterdir())) == len(written)
+    for path in written:
+        with out_path.joinpath(f"{'^'.join(path)}.parquet").open("rb") as f:
+            assert pl.read_parquet(f).equals(hierarchy.get_df(path))
+
+
+def test_lookup_index_files():
+    """Test that files are joined on well, site, channel and cycle."""
+    index_df = pl.LazyFrame(
+        {
+            "prefix": ["/out/sbs"] * 5 + [None],
+            "key": [
+                "A1-1/1_DNA.tiff",
+                "2_A.tiff",
+                "1_A.tiff",
+                "3_A.tiff",
+                "x",
+                "y",
+            ],
+            "filename": [
+                "1_DNA.tiff",
+                "2_A.tiff",
+                "1_A.tiff",
+                "3_A.tiff",
+                None,
+                "y",
+            ],
+            "well_id": ["A1", "A1", "A1", "B1", "A1", "A1"],
+            "site_id": ["1", "1", "1", "1", "1", "1"],
+            "cycle_id": ["1", "2", "1", "3", "2", "2"],
+            "channel_id": ["DNA", "A", "A", "A", "DNA", "T"],
+        }
+    )
+    sites_df = pl.DataFrame({"well_id": ["A1"], "site_id": ["0001"]})
+
+    files = lookup_index_files(
+        sites_df,
+        index_df,
+        ["A", "DNA", "A"],
+        ["2", "2", "1"],
+        fallback_cycle="1",
+    )
+    assert files.to_dicts() == [
+        {
+            "well_id": "A1",
+            "site_id": "0001",
+            "filename": ["2_A.tiff", "1_DNA.tiff", "1_A.tiff"],
+            "pathname": ["/out/sbs", "/out/sbs/A1-1", "/out/sbs"],
+        }
+    ]
+    files = lookup_index_files(sites_df, index_df, ["DNA"])
+    assert files["filename"].to_list() == [["1_DNA.tiff"]]
+
+    with pytest.raises(ValueError, match="channel T cycle 3 of well A1"):
+        lookup_index_files(sites_df, index_df, ["T"], ["3"], fallback_cycle="1")
+    with pytest.raises(ValueError, match="channel DNA cycle 2"):
+        lookup_index_files(sites_df, index_df, ["DNA"], ["2"])
+
+
+@pytest.mark.parametrize(
+    ("min_files", "cloud"), [(32, False), (1, False), (32, True)]
+)
+def test_validate_loaddata(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, min_files: int, cloud: bool
+):
+    """Test that missing LoadData files are reported."""
+    monkeypatch.setattr(loaddata, "LOADDATA_LIST_MIN_FILES", min_files)
+    # LoadData pathnames on s3 are checked on the local s3 mock
+    monkeypatch.setattr(
+        loaddata,
+        "AnyPath",
+        lambda path: LocalS3Path(path)
+        if path.startswith("s3://")
+        else Path(path),
+    )
+    root = LocalS3Path("s3://bucket/validate") if cloud else tmp_path
+    images_path = root.joinpath("images")
+    images_path.mkdir(parents=True, exist_ok=True)
+    for name in ["a_DNA.tiff", "b_DNA.tiff", "a_A.tiff"]:
+        images_path.joinpath(name).write_text("")
+
+    loaddata_path = root.joinpath("loaddata")
+    loaddata_path.mkdir(parents=True, exist_ok=True)
+    loaddata_path.joinpath("Batch1^Plate1#a.csv").write_text(
+        "Metadata_Site,FileName_OrigDNA,PathName_OrigDNA,Frame_OrigDNA\n"
+        f"1,a_DNA.tiff,{images_path}/,0\n"
+        f"2,c_DNA.tiff,{images_path}/,0\n"
+        f"3,a_DNA.tiff,{root}/missing/,0\n"
+    )
+    loaddata_path.joinpath("Batch1^Plate1#b.csv").write_text(
+        "FileName_Cycle_1_A,PathName_Cycle_1_A,FileName_Cycle_2_A\n"
+        f"a_A.tiff,{images_path},b_DNA.tiff\n"
+    )
+
+    out_path = root.joinpath("report", "missing.csv")
+    missing_df = validate_loaddata(loaddata_path, out_path, jobs=2)
+    with out_path.open("rb") as f:
+        assert pl.read_csv(f).equals(missing_df)
+    assert missing_df.select("column", "path").rows() == [
+        ("FileName_OrigDNA", f"{images_path}/c_DNA.tiff"),
+        ("FileName_OrigDNA", f"{root}/missing/a_DNA.tiff"),
+        ("FileName_Cycle_2_A", None),
+    ]
+    assert missing_df["loaddata"].to_list() == [
+        str(loaddata_path.joinpath("Batch1^Plate1#a.csv"))
+    ] * 2 + [str(loaddata_path.joinpath("Batch1^Plate1#b.csv"))]
+
+
+def test_get_loaddata_cost(tmp_path: Path):
+    """Test that the cost counts the images of every image set."""
+    loaddata_path = tmp_path.joinpath("Batch1^Plate1#a.csv")
+    loaddata_path.write_text(
+        "Metadata_Site,FileName_OrigDNA,PathName_OrigDNA,FileName_OrigA\n"
+        '1,"a,DNA.tiff",/images/,a_A.tiff\n'
+        "2,b_DNA.tiff,/images/,b_A.tiff\n"
+    )
+    assert get_loaddata_cost(loaddata_path) == 4
+    loaddata_path.write_text("Metadata_Site\n1\n2\n3\n")
+    assert get_loaddata_cost(loaddata_path) == 3
+    loaddata_path.write_text("")
+    assert get_loaddata_cost(loaddata_path) == 0
@@ -0,0 +1,260 @@
+"""Test the misc utilities."""
+
+from pathlib import Path
+from unittest.mock import PropertyMock, patch
+
+import polars as pl
+import pyarrow.parquet as pq
+import pytest
+from cloudpathlib.local import LocalS3Path
+
+from starrynight.algorithms.index import (
+    INDEX_PARTITION_COLS,
+    INDEX_SORT_COLS,
+    PCPIndex,
+    get_index_sink,
+)
+from starrynight.algorithms.inventory import FileInventory
+from starrynight.utils.dfutils import (
+    INDEX_CATEGORICAL_COLS,
+    INDEX_SCHEMA_VERSION,
+    filter_df_by_hierarchy,
+    get_index_schema_version,
+    scan_index,
+    with_index_num_cols,
+)
+from starrynight.utils.misc import (
+    HIVE_NULL_PARTITION,
+    ParquetSink,
+    PartitionedParquetSink,
+    merge_pq,
+    staged_directory,
+    sync_directory,
+)
+
+FIXTURE_INDEX_PATH = (
+    Path(__file__)
+    .parents[1]
+    .joinpath("fixtures/integration/pregenerated_files/fix_s1/index.parquet")
+)
+
+
+def gen_rows(start: int, stop: int) -> list[dict]:
+    """Generate inventory rows.
+
+    Args:
+        start: Index of the first row
+        stop: Index after the last row
+
+    Returns:
+        Inventory rows.
+
+    """
+    return [
+        {
+            "key": f"file_{idx}.tiff",
+            "filename": f"file_{idx}.tiff",
+            "extension": ".tiff",
+            "size": idx,
+        }
+        for idx in range(start, stop)
+    ]
+
+
+def test_parquet_sink_row_groups(tmp_path: Path):
+    """Test that pushed batches are written as bounded row groups."""
+    out_path = tmp_path.joinpath("out", "inventory.parquet")
+    with ParquetSink(out_path, FileInventory, row_group_size=4) as sink:
+        sink.write(gen_rows(0, 3))
+        sink.write(gen_rows(3, 6))
+        sink.write(gen_rows(6, 10))
+
+    pq_file = pq.ParquetFile(out_path)
+    assert [
+        pq_file.metadata.row_group(idx).num_rows
+        for idx in range(pq_file.num_row_groups)
+    ] == [4, 4, 2]
+    column = pq_file.metadata.row_group(0).column(0)
+    assert column.compression == "ZSTD"
+    assert column.statistics.min == "file_0.tiff"
+    assert pq_file.read()["size"].to_pylist() == list(range(10))
+
+
+def test_sinks_abort_on_error(tmp_path: Path):
+    """Test that sinks remove their partial outputs when the block raises."""
+    out_path = tmp_path.joinpath("inventory.parquet")
+    with (
+        pytest.raises(RuntimeError),
+        ParquetSink(out_path, FileInventory, row_group_size=2) as sink,
+    ):
+        sink.write(gen_rows(0, 5))
+        raise RuntimeError
+    assert not out_path.exists()
+
+    index_df = pl.read_parquet(FIXTURE_INDEX_PATH)
+    out_dir = tmp_path.joinpath("index.parquet")
+    with (
+        pytest.raises(RuntimeError),
+        PartitionedParquetSink(
+            out_dir, PCPIndex, INDEX_PARTITION_COLS, INDEX_SORT_COLS
+        ) as sink,
+    ):
+        sink.write(with_index_num_cols(index_df, 1))
+        raise RuntimeError
+    assert not out_dir.exists()
+
+
+def test_merge_pq(tmp_path: Path):
+    """Test that shards are merged in order."""
+    shards = []
+    for idx in range(3):
+        shard = tmp_path.joinpath(f"shard_{idx}.parquet")
+        with ParquetSink(shard, FileInventory, row_group_size=2) as sink:
+            sink.write(gen_rows(idx * 5, (idx + 1) * 5))
+        shards.append(shard)
+    out_path = tmp_path.joinpath("merged.parquet")
+    merge_pq(shards, out_path, row_group_size=4)
+
+    table = pq.read_table(out_path)
+    assert table.schema.equals(pq.read_schema(shards[0]))
+    assert table["size"].to_pylist() == list(range(15))
+    assert pq.ParquetFile(out_path).metadata.row_group(0).num_rows == 4
+
+
+def test_partitioned_parquet_sink(tmp_path: Path):
+    """Test that a partitioned index reads back like the single file."""
+    index_df = pl.read_parquet(FIXTURE_INDEX_PATH)
+    out_dir = tmp_path.joinpath("index.parquet")
+    with PartitionedParquetSink(
+        out_dir, PCPIndex, INDEX_PARTITION_COLS, INDEX_SORT_COLS
+    ) as sink:
+        for batch in index_df.iter_slices(10):
+            sink.write(with_index_num_cols(batch, 1))
+
+    part_dir = out_dir.joinpath(
+        "batch_id=Batch1", "plate_id=Plate1", f"cycle_id={HIVE_NULL_PARTITION}"
+    )
+    part_df = pl.read_parquet(part_dir.joinpath("part-0.parquet"))
+    assert part_df.equals(part_df.sort(INDEX_SORT_COLS, nulls_last=True))
+
+    df = scan_index(out_dir)
+    cols = index_df.columns
+    assert (
+        df.select(cols)
+        .collect()
+        .sort("key")
+        .equals(index_df.select(cols).sort("key"))
+    )
+    levels = ["Batch1", "Plate1", "2"]
+    assert (
+        filter_df_by_hierarchy(df, levels, True)
+        .collect()
+        .sort("key")
+        .select(cols)
+        .equals(
+            filter_df_by_hierarchy(index_df.lazy(), levels, True)
+            .collect()
+            .sort("key")
+        )
+    )
+
+
+def test_scan_index_compat(tmp_path: Path):
+    """Test that indexes without integer columns read like new ones."""
+    # The fixture index predates the integer columns
+    index_df = pl.read_parquet(FIXTURE_INDEX_PATH)
+    assert "site_num" not in index_df.columns
+    out_path = tmp_path.joinpath("index.parquet")
+    with get_index_sink(out_path, False) as sink:
+        sink.write(
+            [PCPIndex(**row).model_dump() for row in index_df.to_dicts()]
+        )
+    assert get_index_schema_version(FIXTURE_INDEX_PATH) == 1
+    assert get_index_schema_version(out_path) == INDEX_SCHEMA_VERSION
+
+    old_df = scan_index(FIXTURE_INDEX_PATH).collect()
+    new_df = scan_index(out_path).collect()
+    assert old_df.select(new_df.columns).equals(new_df)
+    assert old_df.schema["site_num"] == pl.Int64
+    sites = old_df.filter(pl.col("site_id").is_not_null())
+    assert sites["site_num"].to_list() == [
+        int(site) for site in sites["site_id"]
+    ]
+
+    # Partitioned indexes record the version in every file
+    out_dir = tmp_path.joinpath("index_dir.parquet")
+    with get_index_sink(out_dir, True) as sink:
+        sink.write(new_df)
+    assert get_index_schema_version(out_dir) == INDEX_SCHEMA_VERSION
+    assert scan_index(out_dir).collect().sort("key").equals(new_df.sort("key"))
+
+
+def test_scan_index_categorical():
+    """Test that the opt-in categorical scan only changes the column types."""
+    str_df = scan_index(FIXTURE_INDEX_PATH).collect()
+    with pl.StringCache():
+        cat_df = scan_index(FIXTURE_INDEX_PATH, categorical=True).collect()
+    assert cat_df.schema["plate_id"] == pl.Categorical
+    assert cat_df.schema["channel_dict"] == pl.List(pl.Categorical)
+    assert cat_df.with_columns(
+        pl.col(col).cast(str_df.schema[col]) for col in INDEX_CATEGORICAL_COLS
+    ).equals(str_df)
+
+
+def test_staged_directory(tmp_path: Path):
+    """Test that staged writes keep unchanged files and remove stale ones."""
+    out_dir = tmp_path.joinpath("out")
+    out_dir.joinpath("sub").mkdir(parents=True)
+    out_dir.joinpath("same.csv").write_text("a,b\n1,2\n")
+    out_dir.joinpath("sub", "changed.csv").write_text("a,b\n1,2\n")
+    out_dir.joinpath("stale.csv").write_text("a,b\n")
+    same_mtime = out_dir.joinpath("same.csv").stat().st_mtime_ns
+
+    with staged_directory(out_dir, delete=False) as staging_dir:
+        staging_dir.joinpath("same.csv").write_text("a,b\n1,2\n")
+    assert out_dir.joinpath("stale.csv").exists()
+
+    with staged_directory(out_dir) as staging_dir:
+        assert staging_dir.parent == tmp_path
+        staging_dir.joinpath("sub").mkdir()
+        staging_dir.joinpath("same.csv").write_text("a,b\n1,2\n")
+        staging_dir.joinpath("sub", "changed.csv").write_text("a,b\n3,4\n")
+        staging_dir.joinpath("new.csv").write_text("a,b\n")
+
+    assert sorted(
+        path.relative_to(out_dir).as_posix() for path in out_dir.rglob("*.csv")
+    ) == ["new.csv", "same.csv", "sub/changed.csv"]
+    assert out_dir.joinpath("same.csv").stat().st_mtime_ns == same_mtime
+    assert out_dir.joinpath("sub", "changed.csv").read_text() == "a,b\n3,4\n"
+    # Staging directories are removed after syncing
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["out"]
+
+
+def test_sync_directory_cloud_etag(tmp_path: Path):
+    """Test that S3 files are compared through their ETag when possible."""
+    out_dir = LocalS3Path("s3://bucket/sync")
+    out_dir.joinpath("same.csv").write_text("a,b\n1,2\n")
+    out_dir.joinpath("changed.csv").write_text("a,b\n1,2\n")
+    src_dir = tmp_path.joinpath("src")
+    src_dir.mkdir()
+    src_dir.joinpath("same.csv").write_text("a,b\n1,2\n")
+    # Same size, so only the content tells the files apart
+    src_dir.joinpath("changed.csv").write_text("a,b\n3,4\n")
+
+    with patch.object(LocalS3Path, "read_bytes") as read_bytes:
+        assert sync_directory(src_dir, out_dir) == ["changed.csv"]
+    read_bytes.assert_not_called()
+    assert out_dir.joinpath("changed.csv").read_text() == "a,b\n3,4\n"
+
+    # Multipart ETags are not the MD5 of the content, files are read back
+    read_bytes = LocalS3Path.read_bytes
+    with (
+        patch.object(
+            LocalS3Path, "etag", new_callable=PropertyMock, return_value='"0-2"'
+        ),
+        patch.object(
+            LocalS3Path, "read_bytes", autospec=True, side_effect=read_bytes
+        ) as mock_read_bytes,
+    ):
+        assert sync_directory(src_dir, out_dir) == []
+    assert mock_read_bytes.call_count == 2